@@ -0,0 +1,263 @@
+"""
+Active-learning selection: which reviews deserve the premium model (or a human).
+
+Labeling or re-tagging everything with the strongest model spends the budget
+evenly, including on reviews every model already agrees on. This module
+ranks a pool of unlabeled reviews from the batch input by two signals:
+
+    disagreement  the cheap models from compare_models tag every pool review.
+                  Per field, disagreement is the normalized vote entropy for
+                  sentiment, project_type and the two flags, the spread of
+                  sentiment_score, and the mean pairwise Jaccard distance of
+                  detected_services. A review fewer than two models could
+                  tag counts as fully uncertain.
+    novelty       1 - cosine similarity to the nearest labeled review, in
+                  knn_demos' hashed TF-IDF space.
+
+score = (1 - w) * disagreement + w * novelty, with w = --novelty-weight.
+Picks are greedy: after each pick the pick counts as labeled, so novelty
+drops for reviews close to it and the top-N doesn't fill up with
+near-copies.
+
+`select` writes the picks to active_picks.json. `label` tags them with the
+premium model and appends the results to active_labels.json in the
+TRAINING_DATA format. A human can review or edit that file, or fill it by
+hand. review_tagger.run_optimization adds those labels to its training
+split.
+
+Usage:
+    python active_learning.py select --pool 500 --top 20
+    python active_learning.py select --models gemma2:9b qwen2.5:14b --novelty-weight 0.5
+    python active_learning.py label --model gemini-2.5-flash
+    python review_tagger.py --optimize          # trains on TRAINING_DATA + active_labels.json
+"""
+
+import json
+import argparse
+from collections import Counter
+from itertools import combinations
+
+import dspy
+import numpy as np
+
+from batch_tagging import tag_many
+from dedup import normalize
+from knn_demos import HashedTfidf, labeled_pool
+from prediction_cache import CachedTagger, PredictionCache, print_cache_stats
+from review_store import PROJECT_TYPES, SENTIMENTS
+from review_tagger import ACTIVE_LABELS_PATH, ReviewTagger, default_models, load_active_labels, setup_lm
+from stream_batch import DEFAULT_INPUT, read_requests, to_analysis
+
+DEFAULT_PICKS_PATH = "active_picks.json"
+# Voted fields and their number of classes (project_type includes "null")
+VOTE_FIELDS = {"sentiment": len(SENTIMENTS), "project_type": len(PROJECT_TYPES),
+               "mentions_price": 2, "mentions_timeline": 2}
+
+
+# =============================================================================
+# Signals
+# =============================================================================
+
+def vote_entropy(votes: list, n_classes: int) -> float:
+    """Entropy of the vote distribution, normalized to [0, 1] by its maximum for this many voters and classes."""
+    if len(votes) < 2:
+        return 0.0
+    counts = np.array(list(Counter(str(v).lower() for v in votes).values()), dtype=float)
+    p = counts / counts.sum()
+    # Clipped: an out-of-vocabulary answer can add a class beyond n_classes
+    return float(np.clip(-(p * np.log(p)).sum() / np.log(min(len(votes), n_classes)), 0.0, 1.0))
+
+
+def jaccard_distance(a, b) -> float:
+    a, b = {str(s).lower() for s in a or []}, {str(s).lower() for s in b or []}
+    if not a and not b:
+        return 0.0
+    return 1.0 - len(a & b) / len(a | b)
+
+
+def disagreement(analyses: list[dict | None]) -> dict:
+    """Per-signal disagreement between the models' analyses of one review, plus their mean ("overall")."""
+    valid = [a for a in analyses if a is not None]
+    if len(valid) < 2:
+        return {"overall": 1.0, "tagged_by": len(valid)}
+    parts = {field: vote_entropy([a.get(field) for a in valid], n_classes) for field, n_classes in VOTE_FIELDS.items()}
+    scores = []
+    for a in valid:
+        try:
+            scores.append(float(a.get("sentiment_score")))
+        except (TypeError, ValueError):
+            pass
+    parts["sentiment_score"] = min(1.0, float(np.std(scores))) if len(scores) > 1 else 0.0
+    parts["detected_services"] = float(np.mean([jaccard_distance(a.get("detected_services"), b.get("detected_services"))
+                                                for a, b in combinations(valid, 2)]))
+    return {"overall": float(np.mean(list(parts.values()))), "tagged_by": len(valid), **parts}
+
+
+def unlabeled_pool(input_path: str, size: int, labeled: list[dict]) -> list[dict]:
+    """The first `size` parsable batch reviews whose normalized text isn't labeled already (nor repeated)."""
+    seen = {normalize(item["review_text"]) for item in labeled}
+    pool = []
+    for request in read_requests(input_path):
+        if len(pool) >= size:
+            break
+        key = normalize(request.get("review_text", ""))
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        pool.append({"custom_id": request["custom_id"], "review_text": request["review_text"],
+                     "rating": request["rating"], "reviewer_name": request["reviewer_name"]})
+    return pool
+
+
+def greedy_select(disagreements: np.ndarray, candidates: np.ndarray, labeled: np.ndarray, top: int,
+                  novelty_weight: float) -> list[tuple[int, float, float]]:
+    """(index, novelty at pick time, score) of the top picks; each pick joins the labeled set for the next."""
+    nearest = (candidates @ labeled.T).max(axis=1) if len(labeled) else np.zeros(len(candidates))
+    picks = []
+    available = np.ones(len(candidates), dtype=bool)
+    for _ in range(min(top, len(candidates))):
+        novelty = 1.0 - np.clip(nearest, 0.0, 1.0)
+        score = np.where(available, (1 - novelty_weight) * disagreements + novelty_weight * novelty, -np.inf)
+        i = int(np.argmax(score))
+        picks.append((i, float(novelty[i]), float(score[i])))
+        available[i] = False
+        nearest = np.maximum(nearest, candidates @ candidates[i])
+    return picks
+
+
+# =============================================================================
+# Commands
+# =============================================================================
+
+def run_selection(model_names: list[str] | None = None, input_path: str = DEFAULT_INPUT, pool_size: int = 500,
+                  top: int = 20, novelty_weight: float = 0.3, concurrency: int = 8, use_cache: bool = True,
+                  output_path: str = DEFAULT_PICKS_PATH) -> list[dict]:
+    """Tag a pool with the cheap models, rank by disagreement + novelty and save the top picks."""
+    model_names = model_names or [name for name, _ in default_models()]
+    labeled = labeled_pool(include_test_50=True) + load_active_labels()
+    pool = unlabeled_pool(input_path, pool_size, labeled)
+
+    print("\n" + "=" * 70)
+    print(f"Active-Learning Selection ({len(pool)} unlabeled reviews, {len(labeled)} labeled, "
+          f"{len(model_names)} models, novelty weight {novelty_weight})")
+    print("=" * 70)
+
+    cache = PredictionCache() if use_cache else None
+    tagger = CachedTagger(ReviewTagger(), cache)
+    analyses = {}
+    for model_name in model_names:
+        print(f"\n--- {model_name} ---")
+        try:
+            lm = setup_lm(model_name)
+        except Exception as e:
+            print(f"  Skipped: {e}")
+            continue
+        with dspy.context(lm=lm):
+            results = tag_many(tagger, pool, concurrency=concurrency)
+        analyses[model_name] = [to_analysis(r.prediction) if r.ok else None for r in results]
+        print(f"  {sum(r.ok for r in results)}/{len(pool)} tagged")
+    if len(analyses) < 2:
+        raise ValueError("Disagreement needs at least two models that could be set up")
+
+    per_review = [disagreement([analyses[m][i] for m in analyses]) for i in range(len(pool))]
+    vectorizer = HashedTfidf()
+    matrix = vectorizer.fit_transform([item["review_text"] for item in labeled] +
+                                      [item["review_text"] for item in pool])
+    picks = greedy_select(np.array([d["overall"] for d in per_review]), matrix[len(labeled):],
+                          matrix[:len(labeled)], top, novelty_weight)
+
+    selected = []
+    print(f"\n{'#':>3} {'Score':>6} {'Disagr':>7} {'Novel':>6}  {'Sentiments':<28} Review")
+    for rank, (i, novelty, score) in enumerate(picks, 1):
+        entry = {**pool[i], "rank": rank, "score": score, "novelty": novelty, "disagreement": per_review[i],
+                 "analyses": {m: analyses[m][i] for m in analyses}}
+        selected.append(entry)
+        votes = "/".join(str((a or {}).get("sentiment", "✗"))[:3] for a in entry["analyses"].values())
+        print(f"{rank:>3} {score:>6.2f} {per_review[i]['overall']:>7.2f} {novelty:>6.2f}  {votes:<28} "
+              f"{pool[i]['review_text'][:50]!r}")
+
+    overall = np.array([d["overall"] for d in per_review])
+    print(f"\nPool disagreement: mean {overall.mean():.2f}; mean pick score {np.mean([p[2] for p in picks]):.2f}; "
+          f"{int((overall == 0).sum())} reviews all models agree on")
+    print_cache_stats(cache)
+    with open(output_path, "w") as f:
+        json.dump(selected, f, indent=2, ensure_ascii=False)
+    print(f"\n✓ {len(selected)} picks saved to {output_path} "
+          f"(label with: python active_learning.py label --model <premium model>)")
+    return selected
+
+
+def to_training_item(pick: dict, analysis: dict, source: str) -> dict:
+    """A TRAINING_DATA-style entry (project_type None for unknown) for a labeled pick."""
+    project_type = analysis.get("project_type")
+    if str(project_type).lower() in ("null", "none", ""):
+        project_type = None
+    return {
+        "review_text": pick["review_text"],
+        "rating": pick["rating"],
+        "reviewer_name": pick["reviewer_name"],
+        "detected_services": list(analysis.get("detected_services") or []),
+        "sentiment": analysis.get("sentiment"),
+        "sentiment_score": analysis.get("sentiment_score"),
+        "themes": list(analysis.get("themes") or []),
+        "project_type": project_type,
+        "mentions_price": bool(analysis.get("mentions_price")),
+        "mentions_timeline": bool(analysis.get("mentions_timeline")),
+        "confidence": analysis.get("confidence"),
+        "source": source,
+        "custom_id": pick.get("custom_id"),
+    }
+
+
+def run_labeling(model_name: str = "gemini-2.5-flash", picks_path: str = DEFAULT_PICKS_PATH,
+                 labels_path: str = ACTIVE_LABELS_PATH, concurrency: int = 4) -> list[dict]:
+    """Tag the picks with the premium model and append them to the active labels file."""
+    with open(picks_path, "r") as f:
+        picks = json.load(f)
+    labels = load_active_labels(labels_path)
+    done = {normalize(item["review_text"]) for item in labels}
+    todo = [pick for pick in picks if normalize(pick["review_text"]) not in done]
+    print(f"{len(todo)} of {len(picks)} picks to label with {model_name} ({len(picks) - len(todo)} already labeled)")
+
+    setup_lm(model_name)
+    results = tag_many(ReviewTagger(), todo, concurrency=concurrency)
+    added = [to_training_item(r.review, to_analysis(r.prediction), model_name) for r in results if r.ok]
+    for r in results:
+        if not r.ok:
+            print(f"  ✗ {r.review['reviewer_name'][:20]}: {r.error[:60]}")
+
+    with open(labels_path, "w") as f:
+        json.dump(labels + added, f, indent=2, ensure_ascii=False)
+    print(f"✓ {len(added)} labels added → {labels_path} ({len(labels) + len(added)} total; "
+          f"review them, then run review_tagger.py --optimize)")
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the most informative reviews for the premium model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    select = sub.add_parser("select", help="Rank unlabeled reviews by model disagreement and novelty")
+    select.add_argument("--models", nargs="+", help="Cheap models to compare (default: the compare_models list)")
+    select.add_argument("--input", default=DEFAULT_INPUT, help="Batch request JSONL to draw the pool from")
+    select.add_argument("--pool", type=int, default=500, help="Unlabeled reviews to consider")
+    select.add_argument("--top", type=int, default=20, help="Reviews to pick")
+    select.add_argument("--novelty-weight", type=float, default=0.3, help="Weight of novelty vs disagreement")
+    select.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    select.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    select.add_argument("--output", default=DEFAULT_PICKS_PATH, help="Picks JSON path")
+    label = sub.add_parser("label", help="Label the picks with the premium model")
+    label.add_argument("--model", default="gemini-2.5-flash", help="Premium model")
+    label.add_argument("--picks", default=DEFAULT_PICKS_PATH, help="Picks JSON from `select`")
+    label.add_argument("--labels", default=ACTIVE_LABELS_PATH, help="Labels JSON read by run_optimization")
+    label.add_argument("--concurrency", type=int, default=4, help="Max LM calls in flight")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "select":
+            run_selection(args.models, input_path=args.input, pool_size=args.pool, top=args.top,
+                          novelty_weight=args.novelty_weight, concurrency=args.concurrency,
+                          use_cache=not args.no_cache, output_path=args.output)
+        else:
+            run_labeling(args.model, picks_path=args.picks, labels_path=args.labels, concurrency=args.concurrency)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error: {e}")
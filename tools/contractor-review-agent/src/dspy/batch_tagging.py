@@ -0,0 +1,107 @@
+"""
+Concurrent batch tagging for ReviewTagger.
+
+Runs a tagger over many reviews with a bounded number of LM calls in flight
+on a thread pool. Results come back in input order, and a review that fails
+is reported on its own result instead of stopping the batch.
+
+Usage:
+    from batch_tagging import tag_many
+
+    results = tag_many(tagger, reviews, concurrency=8)
+    for r in results:
+        print(r.index, r.prediction if r.ok else r.error)
+
+    with track_usage() as tracker:          # dspy.utils.usage_tracker; reaches the worker threads
+        tag_many(tagger, reviews)
+    tracked_usage(tracker)                  # {"calls": ..., "input_tokens": ..., "output_tokens": ...}
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator
+
+import dspy
+
+
+@dataclass
+class TagResult:
+    """Outcome of tagging one review."""
+    index: int
+    review: Any
+    prediction: Any = None
+    error: str | None = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def review_inputs(review) -> dict:
+    """Pull the ReviewTagger inputs out of a dict or dspy.Example."""
+    return {
+        "review_text": review["review_text"],
+        "rating": review.get("rating", 5),
+        "reviewer_name": review.get("reviewer_name", "Unknown"),
+    }
+
+
+def _tag_one(tagger, index: int, review, lm, tracker, inputs: Callable) -> TagResult:
+    start = time.perf_counter()
+    try:
+        # Worker threads don't inherit dspy.context overrides, so pin the caller's LM and usage tracker
+        with dspy.context(lm=lm, usage_tracker=tracker):
+            prediction = tagger(**inputs(review))
+        return TagResult(index, review, prediction, elapsed=time.perf_counter() - start)
+    except Exception as e:
+        return TagResult(index, review, error=f"{type(e).__name__}: {e}", elapsed=time.perf_counter() - start)
+
+
+def iter_tagged(
+    tagger,
+    reviews: Iterable,
+    concurrency: int = 8,
+    inputs: Callable = review_inputs,
+) -> Iterator[TagResult]:
+    """
+    Tag reviews concurrently, yielding results in input order.
+
+    At most `concurrency` reviews are in flight and at most 2x that are
+    buffered, so `reviews` may be a lazy iterator over a large file.
+    `inputs` maps a review to the keyword arguments passed to `tagger`.
+    """
+    concurrency = max(1, concurrency)
+    lm = dspy.settings.lm
+    tracker = dspy.settings.usage_tracker
+
+    if concurrency == 1:
+        for i, review in enumerate(reviews):
+            yield _tag_one(tagger, i, review, lm, tracker, inputs)
+        return
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, review in enumerate(reviews):
+            pending.append(pool.submit(_tag_one, tagger, i, review, lm, tracker, inputs))
+            if len(pending) >= concurrency * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def tag_many(tagger, reviews: Iterable, concurrency: int = 8) -> list[TagResult]:
+    """Tag all reviews concurrently and return one TagResult per review, in input order."""
+    return list(iter_tagged(tagger, reviews, concurrency=concurrency))
+
+
+def tracked_usage(tracker) -> dict:
+    """Sum calls and tokens over a dspy track_usage() tracker, across models (cache hits report no usage)."""
+    entries = [entry for model_entries in tracker.usage_data.values() for entry in model_entries]
+    return {
+        "calls": len(entries),
+        "input_tokens": sum(entry.get("prompt_tokens") or 0 for entry in entries),
+        "output_tokens": sum(entry.get("completion_tokens") or 0 for entry in entries),
+    }
@@ -0,0 +1,255 @@
+"""
+Latency / throughput / cost benchmark for the models in compare_models.
+
+For each model: a few warmup calls (not timed), then several timed
+repetitions over the same reviews. Records per-call latency percentiles,
+reviews per second, tokens per review, estimated cost per 1K reviews and
+accuracy, and writes them to a JSON report. Pass `--baseline` with an earlier
+report to print per-metric deltas and flag regressions.
+
+DSPy's response cache and the on-disk prediction cache are both bypassed so
+every timed call really reaches the model.
+
+Usage:
+    python benchmark.py                                     # default models, test_reviews_50.json
+    python benchmark.py --models gemini-2.0-flash gemma2:9b --repetitions 5
+    python benchmark.py --models fake/x?latency=0.1 --baseline benchmark_results.json --output new.json
+    python review_tagger.py --benchmark --models gemma2:9b  # same, from the tagger CLI
+    python benchmark.py --models gemma2:9b --mode predict   # fast mode (see distill.py for CoT vs Predict)
+"""
+
+import json
+import time
+import argparse
+from datetime import datetime
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+import numpy as np
+
+from batch_tagging import tag_many, tracked_usage
+from prediction_cache import prompt_version
+from review_tagger import TAGGER_MODES, classify_model, default_models, setup_lm
+from vector_metric import EVAL_50_METRIC, score_tagged
+
+# USD per 1M tokens (input, output), standard API pricing from FINAL-MODEL-EVALUATION-REPORT.md.
+# Cost comes from these and the tracked token counts; local and fake models cost nothing.
+PRICES_PER_1M = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+}
+
+# Relative change that counts as a regression when diffing against a baseline
+REGRESSION_THRESHOLDS = {
+    "p50_latency": 0.10,
+    "p95_latency": 0.15,
+    "reviews_per_second": -0.10,
+    "cost_per_1k_reviews": 0.10,
+    "input_tokens_per_review": 0.10,
+    "accuracy": -0.02,       # absolute: two points of accuracy
+}
+
+# Errors that mean the reply couldn't be parsed (as opposed to provider/transport failures)
+PARSE_ERRORS = ("AdapterParseError", "ValidationError", "JSONDecodeError", "ValueError")
+
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    """Cost in USD from the price table; longest matching model prefix wins."""
+    matches = [name for name in PRICES_PER_1M if model_name.startswith(name)]
+    if not matches:
+        return 0.0
+    input_price, output_price = PRICES_PER_1M[max(matches, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def latency_percentiles(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"p50_latency": None, "p95_latency": None, "p99_latency": None, "mean_latency": None}
+    values = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_latency": float(p50), "p95_latency": float(p95), "p99_latency": float(p99),
+            "mean_latency": float(values.mean())}
+
+
+def benchmark_model(model_name: str, reviews: list, warmup: int = 3, repetitions: int = 3,
+                    concurrency: int = 8, rule_fields: bool = False, mode: str = "cot", tagger=None) -> dict:
+    """Warm up, then time `repetitions` passes over `reviews` with one model (and `tagger`, if given)."""
+    from eval_50_reviews import ReviewTagger
+
+    setup_lm(model_name)
+    lm = dspy.settings.lm.copy(cache=False)
+    dspy.configure(lm=lm)
+    if tagger is None:
+        tagger = ReviewTagger(rule_fields=rule_fields, mode=mode)
+
+    if warmup:
+        tag_many(tagger, reviews[:warmup], concurrency=min(concurrency, warmup))
+
+    latencies, runs = [], []
+    totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+    for repetition in range(repetitions):
+        start = time.perf_counter()
+        with track_usage() as tracker:
+            tagged_results = tag_many(tagger, reviews, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        usage = tracked_usage(tracker)
+        for key in totals:
+            totals[key] += usage[key]
+
+        latencies.extend(t.elapsed for t in tagged_results if t.ok)
+        errors = sum(not t.ok for t in tagged_results)
+        parse_errors = sum(not t.ok and t.error.startswith(PARSE_ERRORS) for t in tagged_results)
+        accuracy = 0.0
+        if errors < len(tagged_results):
+            _, batch = score_tagged(tagged_results, lambda r: r["analysis_json"], EVAL_50_METRIC)
+            accuracy = batch.mean()["overall"]
+        runs.append({"time": elapsed, "reviews_per_second": len(reviews) / elapsed if elapsed else 0.0,
+                     "errors": errors, "parse_errors": parse_errors, "accuracy": accuracy})
+        print(f"  rep {repetition + 1}/{repetitions}: {runs[-1]['reviews_per_second']:.2f} reviews/s | "
+              f"accuracy {accuracy:.1%} | {errors} errors")
+
+    tagged_count = len(reviews) * repetitions
+    cost = estimate_cost(model_name, totals["input_tokens"], totals["output_tokens"])
+    return {
+        "type": classify_model(model_name),
+        "reviews": len(reviews),
+        "repetitions": repetitions,
+        **latency_percentiles(latencies),
+        "reviews_per_second": float(np.mean([r["reviews_per_second"] for r in runs])),
+        "accuracy": float(np.mean([r["accuracy"] for r in runs])),
+        "errors": sum(r["errors"] for r in runs),
+        "error_rate": sum(r["errors"] for r in runs) / tagged_count,
+        "parse_failure_rate": sum(r["parse_errors"] for r in runs) / tagged_count,
+        "lm_calls": totals["calls"],
+        "input_tokens_per_review": totals["input_tokens"] / tagged_count,
+        "output_tokens_per_review": totals["output_tokens"] / tagged_count,
+        "cost_per_1k_reviews": cost / tagged_count * 1000,
+        "prompt_hash": prompt_version(tagger),
+        "runs": runs,
+    }
+
+
+# =============================================================================
+# Baseline diff
+# =============================================================================
+
+def diff_reports(current: dict, baseline: dict) -> dict:
+    """Per-model, per-metric {before, after, change, regression} for models in both reports."""
+    diffs = {}
+    for model, after in current["models"].items():
+        before = baseline.get("models", {}).get(model)
+        if not before or not after:
+            continue
+        model_diff = {}
+        for metric, threshold in REGRESSION_THRESHOLDS.items():
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            if metric == "accuracy":
+                change = new - old
+            else:
+                change = (new - old) / old if old else 0.0
+            regression = change < threshold if threshold < 0 else change > threshold
+            model_diff[metric] = {"before": old, "after": new, "change": change, "regression": regression}
+        model_diff["prompt_changed"] = before.get("prompt_hash") != after.get("prompt_hash")
+        diffs[model] = model_diff
+    return diffs
+
+
+def print_diff(diffs: dict) -> int:
+    """Print the diff table; returns the number of regressions."""
+    regressions = 0
+    for model, metrics in diffs.items():
+        note = " (prompt changed)" if metrics["prompt_changed"] else ""
+        print(f"\n{model}{note}")
+        for metric, d in metrics.items():
+            if metric == "prompt_changed":
+                continue
+            change = f"{d['change'] * 100:+.1f} pts" if metric == "accuracy" else f"{d['change']:+.1%}"
+            flag = "  ⚠ REGRESSION" if d["regression"] else ""
+            print(f"  {metric:<26} {d['before']:>10.4g} → {d['after']:<10.4g} {change:>10}{flag}")
+            regressions += d["regression"]
+    return regressions
+
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def run_benchmark(model_names: list[str] | None = None, warmup: int = 3, repetitions: int = 3,
+                  concurrency: int = 8, rule_fields: bool = False, limit: int | None = None,
+                  output_path: str = "benchmark_results.json", baseline_path: str | None = None,
+                  mode: str = "cot") -> dict:
+    """Benchmark each model on test_reviews_50.json and save (and optionally diff) the report."""
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)[:limit]
+
+    models = [(name, classify_model(name)) for name in model_names] if model_names else default_models()
+
+    print("\n" + "=" * 70)
+    print(f"Benchmark: {len(reviews)} reviews × {repetitions} repetitions (warmup {warmup}, "
+          f"concurrency {concurrency})")
+    print("=" * 70)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {"reviews": len(reviews), "warmup": warmup, "repetitions": repetitions,
+                   "concurrency": concurrency, "rule_fields": rule_fields, "mode": mode},
+        "models": {},
+    }
+    for model_name, model_type in models:
+        print(f"\n--- {model_name} ({model_type}) ---")
+        try:
+            report["models"][model_name] = benchmark_model(
+                model_name, reviews, warmup=warmup, repetitions=repetitions,
+                concurrency=concurrency, rule_fields=rule_fields, mode=mode,
+            )
+        except Exception as e:
+            print(f"  Error: {e}")
+            report["models"][model_name] = None
+
+    print("\n" + "=" * 70)
+    print("BENCHMARK RESULTS")
+    print("=" * 70)
+    print(f"\n{'Model':<35} {'p50':>7} {'p95':>7} {'p99':>7} {'rev/s':>7} {'$/1K':>8} {'Acc':>7} {'Err':>5}")
+    print("-" * 90)
+    for model, data in report["models"].items():
+        if data and data["p50_latency"] is not None:
+            print(f"{model[:35]:<35} {data['p50_latency']:>6.2f}s {data['p95_latency']:>6.2f}s "
+                  f"{data['p99_latency']:>6.2f}s {data['reviews_per_second']:>7.2f} "
+                  f"{data['cost_per_1k_reviews']:>8.4f} {data['accuracy']:>6.1%} {data['errors']:>5}")
+
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        print(f"\nDiff against {baseline_path} ({baseline.get('created', '?')}):")
+        report["diff"] = diff_reports(report, baseline)
+        regressions = print_diff(report["diff"])
+        print(f"\n{regressions} regression(s)")
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency/throughput/cost benchmark for tagging models")
+    parser.add_argument("--models", nargs="+", help="Models to benchmark (default: the compare_models list)")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed warmup calls per model")
+    parser.add_argument("--repetitions", type=int, default=3, help="Timed passes over the reviews")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--limit", type=int, help="Only use the first N reviews")
+    parser.add_argument("--rule-fields", action="store_true",
+                        help="Compute mentions_price/mentions_timeline with keyword rules instead of the LM")
+    parser.add_argument("--mode", choices=TAGGER_MODES, default="cot",
+                        help="cot = reasoning before the fields; predict = fast mode without reasoning; "
+                        "structured = JSON constrained by the ReviewAnalysis schema")
+    parser.add_argument("--output", default="benchmark_results.json", help="Report JSON path")
+    parser.add_argument("--baseline", help="Earlier report to diff against")
+    args = parser.parse_args()
+
+    run_benchmark(args.models, warmup=args.warmup, repetitions=args.repetitions, concurrency=args.concurrency,
+                  rule_fields=args.rule_fields, limit=args.limit, output_path=args.output,
+                  baseline_path=args.baseline, mode=args.mode)
@@ -0,0 +1,179 @@
+"""
+Confidence-gated model cascade: local Ollama model first, cloud on escalation.
+
+Each review is tagged by the cheap local model. It is re-tagged by the cloud
+model only when the local call fails, its output doesn't validate as
+ReviewAnalysis, or its `confidence` is below the threshold. The tagger keeps
+escalation counts and per-tier token usage so a run can report the share of
+reviews escalated and the blended cost per 1K reviews.
+
+Usage:
+    python cascade.py --local gemma2:9b --cloud gemini-2.0-flash --threshold 0.8
+    python stream_batch.py --cascade-local gemma2:9b --escalate-below 0.8   # tag the backlog
+"""
+
+import json
+import time
+import argparse
+import threading
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+
+from batch_tagging import tag_many
+from benchmark import estimate_cost
+from packed_tagger import validate_item
+from review_tagger import ReviewAnalysis, setup_lm
+from vector_metric import EVAL_50_METRIC, score_tagged
+
+ESCALATION_REASONS = ("local_error", "invalid", "low_confidence")
+
+
+def escalation_reason(prediction, threshold: float) -> str | None:
+    """Why a local prediction should go to the cloud model, or None to keep it."""
+    fields = {field: prediction.get(field) for field in ReviewAnalysis.model_fields if field in prediction}
+    analysis = validate_item(fields)
+    if analysis is None:
+        return "invalid"
+    if analysis.confidence < threshold:
+        return "low_confidence"
+    return None
+
+
+class CascadeTagger(dspy.Module):
+    """Tags with `local_lm`, escalating to `cloud_lm` on errors, invalid output or low confidence."""
+
+    def __init__(self, tagger, local_lm, cloud_lm, threshold: float = 0.7):
+        super().__init__()
+        self.tagger = tagger
+        self.local_lm = local_lm
+        self.cloud_lm = cloud_lm
+        self.threshold = threshold
+        self.counts = {"local": 0, **{reason: 0 for reason in ESCALATION_REASONS}}
+        # Counted per call, not from lm.history: DSPy trims history to max_history_size on long runs
+        self.usage = {tier: {"calls": 0, "input_tokens": 0, "output_tokens": 0} for tier in ("local", "cloud")}
+        self._lock = threading.Lock()
+        # The answer depends on both models and the threshold; prediction_cache folds this into its key
+        self.cache_fingerprint = {"cascade": [local_lm.model, cloud_lm.model], "threshold": threshold}
+
+    def _tag(self, tier: str, lm, inputs: dict):
+        """Tag with `lm`, adding the calls and tokens it used (cache hits report none) to the tier."""
+        with dspy.context(lm=lm), track_usage() as tracker:
+            try:
+                return self.tagger(**inputs)
+            finally:
+                entries = [entry for model_entries in tracker.usage_data.values() for entry in model_entries]
+                with self._lock:
+                    usage = self.usage[tier]
+                    usage["calls"] += len(entries)
+                    usage["input_tokens"] += sum(entry.get("prompt_tokens") or 0 for entry in entries)
+                    usage["output_tokens"] += sum(entry.get("completion_tokens") or 0 for entry in entries)
+
+    def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
+        inputs = {"review_text": review_text, "rating": rating, "reviewer_name": reviewer_name}
+        try:
+            prediction = self._tag("local", self.local_lm, inputs)
+            reason = escalation_reason(prediction, self.threshold)
+        except Exception:
+            reason = "local_error"
+
+        with self._lock:
+            self.counts[reason or "local"] += 1
+        if reason is None:
+            return prediction
+        return self._tag("cloud", self.cloud_lm, inputs)
+
+    def summary(self) -> dict:
+        """Escalation share plus per-tier usage and blended cost per 1K reviews."""
+        reviews = sum(self.counts.values())
+        escalated = reviews - self.counts["local"]
+        tiers = {}
+        for tier, lm in (("local", self.local_lm), ("cloud", self.cloud_lm)):
+            with self._lock:
+                usage = dict(self.usage[tier])
+            model = lm.model.split("/", 1)[-1]
+            usage["cost"] = estimate_cost(model, usage["input_tokens"], usage["output_tokens"])
+            tiers[tier] = usage
+        cost = tiers["local"]["cost"] + tiers["cloud"]["cost"]
+        return {
+            "reviews": reviews,
+            "escalated": escalated,
+            "escalation_rate": escalated / reviews if reviews else 0.0,
+            "reasons": dict(self.counts),
+            "tiers": tiers,
+            "cost_per_1k_reviews": cost / reviews * 1000 if reviews else 0.0,
+            # What the same reviews would have cost sent straight to the cloud model, from the cost per
+            # escalated review (per review, not per call: retries and JSON fallbacks are part of that cost)
+            "cloud_only_cost_per_1k_reviews": (
+                tiers["cloud"]["cost"] / escalated * 1000 if escalated else None
+            ),
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        reasons = ", ".join(f"{s['reasons'][r]} {r}" for r in ESCALATION_REASONS)
+        print(f"Cascade: {s['escalated']}/{s['reviews']} escalated ({s['escalation_rate']:.0%}: {reasons})")
+        line = f"Cascade: ${s['cost_per_1k_reviews']:.4f} per 1K reviews blended"
+        if s["cloud_only_cost_per_1k_reviews"] is not None:
+            line += f" vs ${s['cloud_only_cost_per_1k_reviews']:.4f} cloud-only"
+        print(line)
+
+
+def setup_cascade(local_model: str, cloud_model: str) -> tuple:
+    """(local_lm, cloud_lm), with the cloud LM left as the configured default."""
+    local_lm = setup_lm(local_model)
+    cloud_lm = setup_lm(cloud_model)
+    return local_lm, cloud_lm
+
+
+# =============================================================================
+# Report on test_reviews_50.json
+# =============================================================================
+
+def run_cascade_report(local_model: str, cloud_model: str, thresholds: list[float], concurrency: int = 8,
+                       output_path: str = "cascade_report.json") -> dict:
+    """Accuracy, escalation share and blended cost for each threshold."""
+    from eval_50_reviews import ReviewTagger
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+    local_lm, cloud_lm = setup_cascade(local_model, cloud_model)
+
+    print("\n" + "=" * 70)
+    print(f"Cascade Report ({local_model} → {cloud_model}, {len(reviews)} reviews)")
+    print("=" * 70)
+
+    report = {"local": local_model, "cloud": cloud_model, "reviews": len(reviews), "runs": []}
+    for threshold in thresholds:
+        tagger = CascadeTagger(ReviewTagger(), local_lm, cloud_lm, threshold=threshold)
+        start = time.perf_counter()
+        tagged_results = tag_many(tagger, reviews, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        errors = sum(not t.ok for t in tagged_results)
+        accuracy = 0.0
+        if errors < len(tagged_results):
+            _, batch = score_tagged(tagged_results, lambda r: r["analysis_json"], EVAL_50_METRIC)
+            accuracy = batch.mean()["overall"]
+        run = {"threshold": threshold, "accuracy": accuracy, "errors": errors, "time": elapsed, **tagger.summary()}
+        report["runs"].append(run)
+        print(f"\n  threshold {threshold:.2f}: accuracy {accuracy:.1%} | {elapsed:.1f}s | {errors} errors")
+        tagger.print_summary()
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local-first model cascade report")
+    parser.add_argument("--local", default="gemma2:9b", help="Cheap first-pass model (Ollama)")
+    parser.add_argument("--cloud", default="gemini-2.0-flash", help="Escalation model")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.7, 0.8, 0.9],
+                        help="Escalate when local confidence is below this")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max reviews in flight")
+    parser.add_argument("--output", default="cascade_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_cascade_report(args.local, args.cloud, args.threshold, concurrency=args.concurrency,
+                       output_path=args.output)
@@ -0,0 +1,229 @@
+"""
+Near-duplicate review deduplication ahead of ReviewTagger.
+
+Groups exact and near-identical `review_text` values (MinHash signatures over
+character shingles, banded LSH, verified against a Jaccard threshold) so only
+one representative per group is sent to the LM. Its analysis is then fanned
+back out to the group's members.
+
+Memory is bounded: the index keeps at most `max_entries` representatives and
+forgets the oldest first, so it can sit in front of the streaming JSONL
+runner. Reviews only group with reviews of the same star rating.
+
+Usage:
+    python dedup.py --threshold 0.8                 # report groups in batch_input_65000.jsonl
+    python stream_batch.py --dedup --dedup-threshold 0.8
+"""
+
+import re
+import zlib
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+import numpy as np
+
+PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+def choose_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Pick (bands, rows) with bands * rows == num_perm whose LSH threshold is closest to `threshold`."""
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+
+class MinHasher:
+    """MinHash signatures over character shingles of normalized text."""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a < 2**31 keeps a * x + b inside uint64 for 32-bit shingle hashes
+        self.a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**31, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def signature(self, normalized: str) -> np.ndarray:
+        k = self.shingle_size
+        shingles = {normalized[i:i + k] for i in range(max(1, len(normalized) - k + 1))}
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(self.a, x) + self.b[:, None]) % PRIME).min(axis=1)
+
+
+class NearDuplicateIndex:
+    """Bounded LSH index mapping each new review to an earlier representative, if any."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, max_entries: int = 20_000):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # representative key -> (signature, bucket keys)
+        self.buckets = {}              # bucket key -> representative key
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _bucket_keys(self, rating, exact: str, signature: np.ndarray) -> list:
+        keys = [("exact", rating, zlib.crc32(exact.encode("utf-8")), exact)]
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append((band, rating, chunk))
+        return keys
+
+    def assign(self, key: str, review_text: str, rating=None) -> str | None:
+        """Return the representative key `key` duplicates, or None if it becomes a representative."""
+        self.seen += 1
+        normalized = normalize(review_text)
+        signature = self.hasher.signature(normalized)
+        bucket_keys = self._bucket_keys(rating, normalized, signature)
+
+        representative = self.buckets.get(bucket_keys[0])
+        if representative is not None:
+            self.exact_duplicates += 1
+            self.entries.move_to_end(representative)
+            return representative
+
+        for bucket in bucket_keys[1:]:
+            candidate = self.buckets.get(bucket)
+            if candidate is None:
+                continue
+            similarity = float(np.mean(self.entries[candidate][0] == signature))
+            if similarity >= self.threshold:
+                self.near_duplicates += 1
+                self.entries.move_to_end(candidate)
+                return candidate
+
+        self._add(key, signature, bucket_keys)
+        return None
+
+    def _add(self, key: str, signature: np.ndarray, bucket_keys: list):
+        self.entries[key] = (signature, bucket_keys)
+        for bucket in bucket_keys:
+            self.buckets.setdefault(bucket, key)
+        while len(self.entries) > self.max_entries:
+            old_key, (_, old_buckets) = self.entries.popitem(last=False)
+            for bucket in old_buckets:
+                if self.buckets.get(bucket) == old_key:
+                    del self.buckets[bucket]
+
+    def stats(self) -> dict:
+        duplicates = self.exact_duplicates + self.near_duplicates
+        return {
+            "reviews": self.seen,
+            "representatives": self.seen - duplicates,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "lm_calls_saved": duplicates,
+        }
+
+
+class _Slot:
+    def __init__(self):
+        self.done = threading.Event()
+        self.prediction = None
+
+
+class FanOutTagger:
+    """
+    Tags representatives and hands their prediction to duplicates.
+
+    Representatives are registered (in input order) before any worker runs,
+    so a duplicate always finds its representative's slot and waits on it.
+    If the representative failed or was evicted, the duplicate is tagged
+    itself.
+    """
+
+    def __init__(self, tagger, max_slots: int = 20_000):
+        self.tagger = tagger
+        self.max_slots = max_slots
+        self.slots = OrderedDict()
+        self.fanned_out = {}
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    def register(self, key: str):
+        with self._lock:
+            self.slots[key] = _Slot()
+            while len(self.slots) > self.max_slots:
+                self.slots.popitem(last=False)
+
+    def __call__(self, dedup_key: str, representative: str | None = None, **inputs):
+        if representative is None:
+            slot = self.slots.get(dedup_key)
+            try:
+                prediction = self.tagger(**inputs)
+                if slot is not None:
+                    slot.prediction = prediction
+                return prediction
+            finally:
+                if slot is not None:
+                    slot.done.set()
+
+        slot = self.slots.get(representative)
+        if slot is not None:
+            slot.done.wait()
+            if slot.prediction is not None:
+                with self._lock:
+                    self.saved += 1
+                    self.fanned_out[dedup_key] = representative
+                return slot.prediction
+        return self.tagger(**inputs)
+
+    def pop_representative(self, dedup_key: str) -> str | None:
+        """Representative whose analysis `dedup_key` received, if it was fanned out."""
+        with self._lock:
+            return self.fanned_out.pop(dedup_key, None)
+
+
+def dedup_requests(requests: Iterable[dict], index: NearDuplicateIndex, fanout: FanOutTagger | None = None,
+                   key_field: str = "custom_id") -> Iterator[dict]:
+    """Annotate each request with `duplicate_of` (None for representatives)."""
+    for request in requests:
+        text = request.get("review_text")
+        request["duplicate_of"] = None
+        if text is not None:
+            request["duplicate_of"] = index.assign(request[key_field], text, request.get("rating"))
+            if request["duplicate_of"] is None and fanout is not None:
+                fanout.register(request[key_field])
+        yield request
+
+
+def print_dedup_stats(index: NearDuplicateIndex, fanout: FanOutTagger | None = None):
+    s = index.stats()
+    print(f"Dedup: {s['reviews']} reviews → {s['representatives']} representatives "
+          f"({s['exact_duplicates']} exact + {s['near_duplicates']} near duplicates)")
+    if fanout is not None:
+        print(f"Dedup: {fanout.saved} LM calls saved by fan-out")
+
+
+if __name__ == "__main__":
+    from stream_batch import DEFAULT_INPUT, read_requests
+
+    parser = argparse.ArgumentParser(description="Report near-duplicate reviews in a batch input JSONL")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Gemini batch request JSONL")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity to count as duplicate")
+    parser.add_argument("--max-entries", type=int, default=20_000, help="Representatives kept in the index")
+    parser.add_argument("--show", type=int, default=10, help="Print this many example duplicate pairs")
+    args = parser.parse_args()
+
+    index = NearDuplicateIndex(threshold=args.threshold, max_entries=args.max_entries)
+    texts = OrderedDict()
+    shown = 0
+    for request in dedup_requests(read_requests(args.input), index):
+        if request.get("review_text") is None:
+            continue
+        texts[request["custom_id"]] = request["review_text"]
+        if len(texts) > args.max_entries:
+            texts.popitem(last=False)
+        if request["duplicate_of"] and shown < args.show:
+            shown += 1
+            print(f"  {request['review_text'][:70]!r}\n    ≈ {texts.get(request['duplicate_of'], '?')[:70]!r}")
+
+    print_dedup_stats(index)
@@ -0,0 +1,145 @@
+"""
+CoT-to-Predict distillation and the fast-mode benchmark.
+
+ReviewTagger(mode="predict") skips the reasoning paragraph that
+ChainOfThought writes and we throw away. That saves output tokens and
+latency, but a zero-shot Predict loses some accuracy. Distillation wins most
+of it back. The CoT tagger (the teacher) tags the labeled TRAINING_DATA
+reviews. Outputs that score at least --threshold against the labels become
+demos for the Predict tagger (the student), with the reasoning dropped.
+This is what BootstrapFewShot does. It cannot be used directly here: it
+requires the teacher and student to have identical predictors, and a CoT
+predictor carries an extra reasoning field.
+
+The benchmark runs three variants on test_reviews_50.json through
+benchmark.benchmark_model: CoT, zero-shot Predict and distilled Predict. It
+compares accuracy, tokens per review and p50/p95 latency, and saves the
+distilled program.
+
+Usage:
+    python distill.py                                        # gemini-2.0-flash
+    python distill.py --model gemma2:9b --repetitions 1
+    python distill.py --model "fake/x?latency=0.05" --threshold 0.6
+    python eval_50_reviews.py --mode predict                 # fast mode in a normal eval
+"""
+
+import json
+import argparse
+
+import dspy
+
+from batch_tagging import review_inputs, tag_many
+from knn_demos import labeled_pool
+from review_tagger import setup_lm
+from vector_metric import EVAL_50_METRIC, TAGGER_METRIC, score_tagged
+
+
+def distill_demos(teacher, student, trainset: list, expected=lambda item: item, metric=TAGGER_METRIC,
+                  threshold: float = 0.8, max_demos: int = 4, concurrency: int = 8) -> list[dspy.Example]:
+    """
+    Tag `trainset` with the teacher and give its best outputs (score >= threshold) to the student as demos.
+
+    Each demo holds the review inputs plus the teacher's values for the
+    student's output fields. Any reasoning field is dropped. Returns the
+    demos, best first.
+    """
+    results = tag_many(teacher, trainset, concurrency=concurrency)
+    scores, _ = score_tagged(results, expected, metric)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    predictors = [predictor for _, predictor in student.named_predictors()]
+    output_fields = list(predictors[0].signature.output_fields)
+    demos = []
+    for index, score in ranked[:max_demos]:
+        if score < threshold:
+            break
+        result = results[index]
+        inputs = review_inputs(result.review)
+        outputs = {field: result.prediction[field] for field in output_fields}
+        demos.append(dspy.Example(**inputs, **outputs).with_inputs(*inputs))
+    for predictor in predictors:
+        predictor.demos = list(demos)
+
+    failed = sum(not r.ok for r in results)
+    print(f"  Distilled {len(demos)} demos from {len(trainset)} teacher outputs "
+          f"({sum(s >= threshold for s in scores.values())} scored >= {threshold:.0%}, {failed} failed)")
+    return demos
+
+
+def run_distillation_benchmark(model_name: str = "gemini-2.0-flash", threshold: float = 0.8, max_demos: int = 4,
+                               warmup: int = 3, repetitions: int = 3, concurrency: int = 8,
+                               program_path: str = "distilled_tagger.json",
+                               output_path: str = "distill_report.json") -> dict:
+    """Distill a Predict tagger from the CoT tagger, then benchmark CoT / Predict / distilled Predict."""
+    from benchmark import benchmark_model
+    from eval_50_reviews import ReviewTagger as Eval50Tagger
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+
+    print("\n" + "=" * 70)
+    print(f"CoT → Predict Distillation ({model_name})")
+    print("=" * 70)
+
+    setup_lm(model_name)
+    student = Eval50Tagger(mode="predict")
+    demos = distill_demos(Eval50Tagger(mode="cot"), student, labeled_pool(include_test_50=False),
+                          metric=EVAL_50_METRIC, threshold=threshold, max_demos=max_demos, concurrency=concurrency)
+    student.save(program_path)
+    print(f"  ✓ Saved distilled program to {program_path}")
+
+    variants = {
+        "cot": Eval50Tagger(mode="cot"),
+        "predict": Eval50Tagger(mode="predict"),
+        "predict+distilled": student,
+    }
+    report = {"model": model_name, "threshold": threshold, "demos": len(demos), "program": program_path,
+              "variants": {}}
+    for name, tagger in variants.items():
+        print(f"\n--- {name} ---")
+        report["variants"][name] = benchmark_model(model_name, reviews, warmup=warmup, repetitions=repetitions,
+                                                   concurrency=concurrency, tagger=tagger)
+
+    print("\n" + "=" * 70)
+    print("DISTILLATION RESULTS")
+    print("=" * 70)
+    print(f"\n{'Variant':<20} {'Accuracy':>9} {'In tok':>8} {'Out tok':>8} {'p50':>8} {'p95':>8} {'Err':>5}")
+    print("-" * 72)
+    for name, data in report["variants"].items():
+        p50, p95 = data["p50_latency"] or 0.0, data["p95_latency"] or 0.0
+        print(f"{name:<20} {data['accuracy']:>8.1%} {data['input_tokens_per_review']:>8.0f} "
+              f"{data['output_tokens_per_review']:>8.0f} {p50:>7.2f}s {p95:>7.2f}s {data['errors']:>5}")
+
+    cot, distilled = report["variants"]["cot"], report["variants"]["predict+distilled"]
+    report["accuracy_retained"] = distilled["accuracy"] / cot["accuracy"] if cot["accuracy"] else None
+    report["output_tokens_saved"] = 1 - distilled["output_tokens_per_review"] / cot["output_tokens_per_review"] \
+        if cot["output_tokens_per_review"] else None
+    report["p95_speedup"] = cot["p95_latency"] / distilled["p95_latency"] \
+        if cot["p95_latency"] and distilled["p95_latency"] else None
+    if report["accuracy_retained"] is not None and report["output_tokens_saved"] is not None:
+        print(f"\nDistilled Predict keeps {report['accuracy_retained']:.0%} of CoT accuracy with "
+              f"{report['output_tokens_saved']:.0%} fewer output tokens"
+              + (f"; p95 latency {cot['p95_latency']:.2f}s → {distilled['p95_latency']:.2f}s"
+                 if report["p95_speedup"] else ""))
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the CoT tagger into a fast Predict tagger and benchmark both")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum teacher score for a demo")
+    parser.add_argument("--max-demos", type=int, default=4, help="Demos given to the Predict tagger")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed warmup calls per variant")
+    parser.add_argument("--repetitions", type=int, default=3, help="Timed passes over the reviews per variant")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--program", default="distilled_tagger.json", help="Where to save the distilled program")
+    parser.add_argument("--output", default="distill_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_distillation_benchmark(args.model, threshold=args.threshold, max_demos=args.max_demos, warmup=args.warmup,
+                               repetitions=args.repetitions, concurrency=args.concurrency,
+                               program_path=args.program, output_path=args.output)
@@ -1,17 +1,49 @@
 """
 Evaluate DSPy models on 50 reviews from the database.
 Uses the existing analysis_json as ground truth.
+
+Usage:
+    python eval_50_reviews.py                                  # all models, logged to eval_runs/<run_id>.jsonl
+    python eval_50_reviews.py --resume 20250101-120000         # continue an interrupted run
+    python eval_50_reviews.py --repair                         # fix malformed outputs locally (output_repair.py)
+    python eval_50_reviews.py --sequential --alpha 0.1         # stop evaluating dominated models early
+    python eval_50_reviews.py --profile profile_trace.json     # per-stage timings + Chrome trace (profiler.py)
+    python eval_50_reviews.py --prefix-cache                   # cacheable prompt prefix (prompt_cache.py)
+    python eval_50_reviews.py --mode predict                   # fast mode without reasoning (distill.py)
 """
 
 import os
 import json
 import time
+import argparse
+from contextlib import nullcontext
 from dotenv import load_dotenv
 import dspy
 from dspy import InputField, OutputField, Signature
 
+from batch_tagging import iter_tagged
+from fake_lm import FakeLM
+from review_tagger import TAGGER_MODES, classify_model, make_predictor
+from knn_demos import DemoIndex, KNNReviewTagger, labeled_pool
+from keyword_rules import RuleAgreement, apply_rule_fields, slim_signature
+from ollama_backend import print_ollama_stats, setup_ollama
+from profiler import profiled, stage
+from prompt_cache import prefix_cache_adapter, print_prefix_stats
+from output_repair import RepairingChatAdapter, RepairLog
+from rate_limiter import print_rate_limit_stats, rate_limited
+from prediction_cache import CachedTagger, PredictionCache, print_cache_stats
+from review_store import ReviewStore, align, score_stores
+from run_log import RunLog
+from vector_metric import EVAL_50_METRIC, score_records
+
 load_dotenv()
 
+DEFAULT_MODELS = [
+    ("gemini-2.0-flash", "cloud"),
+    ("qwen2.5:14b", "local"),
+    ("gemma2:9b", "local"),
+]
+
 
 class ReviewTaggingSignature(Signature):
     """Extract structured information from a contractor review.
@@ -40,31 +72,40 @@ class ReviewTaggingSignature(Signature):
 
 
 class ReviewTagger(dspy.Module):
-    def __init__(self):
+    def __init__(self, rule_fields: bool = False, mode: str = "cot"):
         super().__init__()
-        self.tagger = dspy.ChainOfThought(ReviewTaggingSignature)
+        self.rule_fields = rule_fields
+        self.mode = mode
+        signature = slim_signature(ReviewTaggingSignature) if rule_fields else ReviewTaggingSignature
+        self.tagger = make_predictor(signature, mode)
 
     def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
-        return self.tagger(
+        result = self.tagger(
             review_text=review_text,
             rating=rating,
             reviewer_name=reviewer_name
         )
+        if self.rule_fields:
+            apply_rule_fields(result, review_text)
+        return result
 
 
 def setup_lm(model_name: str):
     """Configure DSPy with a language model."""
-    if ":" in model_name or model_name.startswith("ollama/"):
-        # Ollama model
-        if not model_name.startswith("ollama/"):
-            model_name = f"ollama/{model_name}"
-        lm = dspy.LM(model=model_name, api_base="http://localhost:11434", temperature=0.1)
+    if model_name.startswith("fake/"):
+        # Offline fake LM for benchmarking (see fake_lm.py); rate limited when it simulates 429s
+        lm = FakeLM(model_name)
+        if lm.options["throttle_rate"]:
+            lm = rate_limited(lm, model_name)
+    elif ":" in model_name or model_name.startswith("ollama/"):
+        # Ollama model, loaded and pinned before any timing (see ollama_backend.py)
+        lm = setup_ollama(model_name)
     else:
         # Gemini model
         api_key = os.getenv("GOOGLE_AI_API_KEY") or os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_AI_API_KEY required")
-        lm = dspy.LM(model=f"gemini/{model_name}", api_key=api_key, temperature=0.1)
+        lm = rate_limited(dspy.LM(model=f"gemini/{model_name}", api_key=api_key, temperature=0.1), model_name)
 
     dspy.configure(lm=lm)
     return lm
@@ -85,7 +126,7 @@ def accuracy_metric(pred, expected):
         true_score = float(expected.get("sentiment_score", 0))
         if abs(pred_score - true_score) <= 0.15:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 3. Project type match
@@ -100,7 +141,7 @@ def accuracy_metric(pred, expected):
         true_price = bool(expected.get("mentions_price", False))
         if pred_price == true_price:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 5. Mentions timeline
@@ -109,7 +150,7 @@ def accuracy_metric(pred, expected):
         true_timeline = bool(expected.get("mentions_timeline", False))
         if pred_timeline == true_timeline:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 6. Services detection (partial credit)
@@ -123,14 +164,35 @@ def accuracy_metric(pred, expected):
             intersection = len(pred_services & true_services)
             union = len(pred_services | true_services)
             score += intersection / union if union > 0 else 0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     return score / max_score
 
 
-def run_evaluation():
-    """Run evaluation on 50 reviews across all models."""
+def run_evaluation(
+    concurrency: int = 8,
+    use_cache: bool = True,
+    rule_fields: bool = False,
+    model_names: list[str] | None = None,
+    knn_demos: int = 0,
+    resume: str | None = None,
+    repair: bool = False,
+    prefix_cache: bool = False,
+    mode: str = "cot",
+):
+    """
+    Run evaluation on 50 reviews across all models (with knn_demos > 0, k retrieved demos per review).
+
+    Every prediction is appended to a run log (eval_runs/<run_id>.jsonl) as it
+    completes. With `resume`, the run's own models and options are used,
+    (model, review) pairs already in the log are skipped, and the summary is
+    rebuilt from the log. With `repair`, malformed outputs are repaired
+    locally (output_repair.py) instead of counting as errors. With
+    `prefix_cache`, prompts put the static instructions first in a byte-stable
+    system message that providers can cache (prompt_cache.py). mode="predict"
+    tags without the reasoning step.
+    """
     print("\n" + "=" * 70)
     print("DSPy Evaluation on 50 Reviews")
     print("=" * 70)
@@ -141,12 +203,29 @@ def run_evaluation():
 
     print(f"Loaded {len(reviews)} reviews")
 
-    models = [
-        ("gemini-2.0-flash", "cloud"),
-        ("qwen2.5:14b", "local"),
-        ("gemma2:9b", "local"),
-    ]
-
+    models = list(DEFAULT_MODELS)
+    if model_names:
+        models = [(name, classify_model(name)) for name in model_names]
+
+    if resume:
+        log = RunLog.open(resume)
+        models = [tuple(m) for m in log.header["models"]]
+        options = log.header["options"]
+        rule_fields, knn_demos = options["rule_fields"], options["knn_demos"]
+        repair = options.get("repair", False)
+        prefix_cache = options.get("prefix_cache", False)
+        mode = options.get("mode", "cot")
+        print(f"Resuming run {log.run_id} ({sum(len(log.completed(m)) for m, _ in models)} predictions logged)")
+    else:
+        log = RunLog.create(models, {"rule_fields": rule_fields, "knn_demos": knn_demos, "repair": repair,
+                                     "prefix_cache": prefix_cache, "mode": mode})
+        print(f"Run {log.run_id} → {log.path}")
+
+    cache = PredictionCache() if use_cache else None
+    demo_index = DemoIndex(labeled_pool()) if knn_demos else None
+    expected = {review["id"]: review for review in reviews}
+    truth = ReviewStore.from_reviews(reviews, keep_text=False)
+    position = {review["id"]: i for i, review in enumerate(reviews)}
     results = {}
 
     for model_name, model_type in models:
@@ -154,46 +233,81 @@ def run_evaluation():
         print(f"Testing: {model_name} ({model_type})")
         print("=" * 70)
 
-        start_time = time.time()
+        completed = log.completed(model_name)
+        todo = [review for review in reviews if review["id"] not in completed]
+        if len(todo) < len(reviews):
+            print(f"  {len(reviews) - len(todo)} reviews already in the run log")
 
         try:
-            setup_lm(model_name)
-            tagger = ReviewTagger()
-
-            scores = []
-            errors = 0
+            if todo:
+                lm = setup_lm(model_name)
+                start_time = time.time()
+                repair_log = None
+                if repair:
+                    repair_log = RepairLog()
+                    dspy.configure(adapter=RepairingChatAdapter(repair_log))
+                elif prefix_cache:
+                    dspy.configure(adapter=prefix_cache_adapter(lm))
+                tagger = ReviewTagger(rule_fields=rule_fields, mode=mode)
+                if demo_index is not None:
+                    tagger = KNNReviewTagger(tagger, demo_index, k=knn_demos)
+                tagger = CachedTagger(tagger, cache)
 
-            for i, review in enumerate(reviews):
                 try:
-                    pred = tagger(
-                        review_text=review["review_text"],
-                        rating=review["rating"],
-                        reviewer_name=review["reviewer_name"]
-                    )
-
-                    expected = review["analysis_json"]
-                    score = accuracy_metric(pred, expected)
-                    scores.append(score)
-
-                    status = "✓" if score >= 0.8 else "○" if score >= 0.5 else "✗"
-                    print(f"  [{i+1:2d}] {status} {review['reviewer_name'][:20]:<20} {score:.0%}")
-
-                except Exception as e:
-                    errors += 1
-                    print(f"  [{i+1:2d}] ✗ {review['reviewer_name'][:20]:<20} ERROR: {str(e)[:40]}")
-
-            elapsed = time.time() - start_time
-            avg_score = sum(scores) / len(scores) if scores else 0
+                    for tagged in iter_tagged(tagger, todo, concurrency=concurrency):
+                        review = tagged.review
+                        i = position[review["id"]]
+                        record = {"type": "review", "model": model_name, "review_id": review["id"],
+                                  "elapsed": tagged.elapsed}
+                        if not tagged.ok:
+                            log.append({**record, "error": tagged.error})
+                            print(f"  [{i+1:2d}] ✗ {review['reviewer_name'][:20]:<20} ERROR: {tagged.error[:40]}")
+                            continue
+
+                        prediction = tagged.prediction.toDict()
+                        with stage("metric"):
+                            score = float(score_records([prediction], [review["analysis_json"]],
+                                                        EVAL_50_METRIC).overall[0])
+                        log.append({**record, "prediction": prediction, "score": score})
+                        status = "✓" if score >= 0.8 else "○" if score >= 0.5 else "✗"
+                        print(f"  [{i+1:2d}] {status} {review['reviewer_name'][:20]:<20} {score:.0%}")
+                finally:
+                    log.append({"type": "segment", "model": model_name, "time": time.time() - start_time})
+
+            # Summary for this model, rebuilt from everything in the log
+            done = log.completed(model_name)
+            rows = [done[review["id"]] for review in reviews if review["id"] in done]
+            errors = len(reviews) - len(rows)
+            rules = RuleAgreement()
+            for row in rows:
+                review = expected[row["review_id"]]
+                rules.update(review["review_text"], None if rule_fields else row["prediction"], review["analysis_json"])
+            # Field accuracy is scored column-wise on compact stores, aligned to the ground truth by review id
+            predicted = ReviewStore.from_records({"custom_id": row["review_id"], "analysis": row["prediction"]}
+                                                 for row in rows)
+            batch = score_stores(*align(predicted, truth))
+
+            avg_score = sum(row["score"] for row in rows) / len(rows) if rows else 0
+            elapsed = log.elapsed(model_name)
 
             results[model_name] = {
                 "accuracy": avg_score,
                 "time": elapsed,
                 "type": model_type,
-                "reviews": len(scores),
-                "errors": errors
+                "reviews": len(rows),
+                "errors": errors,
+                "field_accuracy": batch.mean(),
+                "rule_agreement": rules.summary()
             }
 
             print(f"\n  Average: {avg_score:.1%} | Time: {elapsed:.1f}s | Errors: {errors}")
+            rules.print_summary()
+            if todo:
+                print_rate_limit_stats(dspy.settings.lm)
+                print_ollama_stats(dspy.settings.lm)
+                if repair_log is not None:
+                    repair_log.print_summary()
+                print_prefix_stats(dspy.settings.adapter)
 
         except Exception as e:
             print(f"  Model error: {e}")
@@ -209,12 +323,58 @@ def run_evaluation():
     for model, data in sorted(results.items(), key=lambda x: x[1]["accuracy"] if x[1] else 0, reverse=True):
         if data:
             print(f"{model:<25} {data['type']:<8} {data['accuracy']:.1%}      {data['time']:.1f}s      {data['errors']}")
+    print_cache_stats(cache)
 
     # Save results
     with open("eval_50_results.json", "w") as f:
         json.dump(results, f, indent=2)
-    print(f"\n✓ Saved to eval_50_results.json")
+    print(f"\n✓ Saved to eval_50_results.json (run {log.run_id}; resume with --resume {log.run_id})")
 
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description="Evaluate DSPy models on 50 reviews")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight per model")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    parser.add_argument("--rule-fields", action="store_true",
+                        help="Compute mentions_price/mentions_timeline with keyword rules instead of the LM")
+    parser.add_argument("--models", nargs="+", help="Models to evaluate (e.g. fake/default for offline runs)")
+    parser.add_argument("--knn-demos", type=int, default=0,
+                        help="Tag each review with its K most similar labeled reviews as demos (leave-one-out)")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Continue an interrupted run from eval_runs/RUN_ID.jsonl, skipping finished reviews")
+    parser.add_argument("--repair", action="store_true",
+                        help="Repair and coerce malformed LM outputs locally, logging to repair_log.jsonl")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="Byte-stable static prompt prefix with provider context caching (prompt_cache.py)")
+    parser.add_argument("--mode", choices=TAGGER_MODES, default="cot",
+                        help="cot = reasoning before the fields; predict = fast mode without reasoning; "
+                        "structured = JSON constrained by the ReviewAnalysis schema")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Interleaved mini-batches; drop statistically dominated models (see sequential_compare.py)")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level for --sequential")
+    parser.add_argument("--profile", metavar="TRACE_JSON",
+                        help="Time format/LM/parse/metric stages and write a Chrome trace here")
+    args = parser.parse_args()
+    if args.repair and args.prefix_cache:
+        parser.error("--repair and --prefix-cache each replace the chat adapter; use one")
+    if args.sequential and (args.knn_demos or args.resume or args.repair or args.prefix_cache):
+        parser.error("--sequential doesn't support --knn-demos, --resume, --repair or --prefix-cache")
+
+    with profiled(args.profile) if args.profile else nullcontext():
+        if args.sequential:
+            from sequential_compare import run_sequential_comparison
+            run_sequential_comparison(args.models or [name for name, _ in DEFAULT_MODELS], dataset="test50",
+                                      alpha=args.alpha, concurrency=args.concurrency, use_cache=not args.no_cache,
+                                      mode=args.mode, rule_fields=args.rule_fields)
+        else:
+            run_evaluation(
+                concurrency=args.concurrency,
+                use_cache=not args.no_cache,
+                rule_fields=args.rule_fields,
+                model_names=args.models,
+                knn_demos=args.knn_demos,
+                resume=args.resume,
+                repair=args.repair,
+                prefix_cache=args.prefix_cache,
+                mode=args.mode,
+            )
@@ -0,0 +1,196 @@
+"""
+Offline, deterministic fake LM for throughput benchmarking.
+
+Selected from setup_lm with a `fake/...` model name. It reads the output
+fields DSPy asks for (single review, slim, packed, or raw JSON prompts) and
+returns schema-valid tagging outputs, after a simulated latency, with
+configurable error and malformed-output rates. Every decision is drawn from
+an RNG seeded by the request content, the seed and the attempt number, so a
+run is reproducible regardless of thread scheduling.
+
+Options go in a query string:
+    fake/gemini?latency=0.4&sigma=0.3&error_rate=0.02&malformed_rate=0.05&seed=7
+
+    latency         median seconds per call (default 0.2)
+    sigma           lognormal spread of the latency; 0 = fixed (default 0.25)
+    error_rate      share of calls raising FakeLMError (default 0)
+    throttle_rate   share of calls raising FakeRateLimitError, a 429 (default 0)
+    malformed_rate  share of calls returning unparsable output (default 0)
+    flag_error_rate share of mentions_price / mentions_timeline answers that
+                    disagree with the keyword rules (default 0.1), so rule/LM
+                    agreement (keyword_rules.RuleAgreement) is below 100% offline
+    seed            RNG seed (default 0)
+
+Usage:
+    python eval_50_reviews.py --models "fake/default?latency=0.05&error_rate=0.01" --no-cache
+    python review_tagger.py --compare --models fake/a "fake/b?malformed_rate=0.1"
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+import dspy
+
+from keyword_rules import keyword_flags
+
+_OUTPUT_FIELDS = re.compile(r"Your output fields are:\n(.*?)(?:\n[A-Z]|\Z)", re.DOTALL)
+_FIELD_NAME = re.compile(r"^\d+\. `(\w+)`", re.MULTILINE)
+_SECTION = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\n\nRespond with|\Z)", re.DOTALL)
+
+SERVICES = ["chimney cleaning", "inspection", "repair", "installation", "cleaning", "roofing", "painting",
+            "maintenance", "waterproofing", "masonry"]
+THEMES = ["professional", "on time", "quality work", "friendly", "knowledgeable", "clean", "would recommend",
+          "communicative", "efficient", "fair price"]
+PROJECT_TYPES = ["repair", "maintenance", "consultation", "new_construction", "null"]
+
+
+class FakeLMError(RuntimeError):
+    """Simulated provider failure."""
+
+
+class FakeRateLimitError(FakeLMError):
+    """Simulated 429 / quota response."""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_fake_model(model: str) -> tuple[str, dict]:
+    """Split "fake/name?k=v" into the name and numeric options."""
+    name, _, query = model.partition("?")
+    options = {"latency": 0.2, "sigma": 0.25, "error_rate": 0.0, "throttle_rate": 0.0,
+               "malformed_rate": 0.0, "flag_error_rate": 0.1, "seed": 0}
+    for key, value in parse_qsl(query):
+        if key not in options:
+            raise ValueError(f"Unknown fake LM option '{key}' (known: {', '.join(options)})")
+        options[key] = float(value)
+    return name, options
+
+
+def fake_analysis(rng: random.Random, review_text: str, rating: int = 5, flag_error_rate: float = 0.1) -> dict:
+    """A ReviewAnalysis-shaped dict plausible for the review; the flags are the keyword rules, flipped at random."""
+    lowered = review_text.lower()
+    sign = 1 if rating >= 4 else -1 if rating <= 2 else 0
+    sentiment = {1: "positive", -1: "negative", 0: rng.choice(["neutral", "mixed"])}[sign]
+    return {
+        "detected_services": [s for s in SERVICES if s in lowered][:3],
+        "sentiment": sentiment,
+        "sentiment_score": round(sign * rng.uniform(0.7, 0.95), 2) if sign else round(rng.uniform(-0.3, 0.3), 2),
+        "themes": rng.sample(THEMES, 3),
+        "project_type": rng.choice(PROJECT_TYPES),
+        **{field: value != (rng.random() < flag_error_rate) for field, value in keyword_flags(review_text).items()},
+        "confidence": round(rng.uniform(0.6, 0.95), 2),
+    }
+
+
+def _format_field(value) -> str:
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+class FakeLM(dspy.BaseLM):
+    """BaseLM that answers tagging prompts locally with simulated latency and failures."""
+
+    def __init__(self, model: str = "fake/default", **kwargs):
+        kwargs.setdefault("temperature", 0.1)
+        super().__init__(model=model, cache=False, **kwargs)
+        self.name, self.options = parse_fake_model(model)
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, messages: list) -> random.Random:
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+        return random.Random(f"{self.options['seed']}:{digest}:{attempt}")
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt or ""}]
+        rng = self._rng(messages)
+
+        latency = self.options["latency"] * rng.lognormvariate(0, self.options["sigma"]) \
+            if self.options["sigma"] > 0 else self.options["latency"]
+        time.sleep(latency)
+
+        roll = rng.random()
+        if roll < self.options["throttle_rate"]:
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED (fake)", retry_after=round(rng.uniform(0.5, 2.0), 2))
+        if roll < self.options["throttle_rate"] + self.options["error_rate"]:
+            raise FakeLMError("503 UNAVAILABLE (fake)")
+
+        text = self._respond(messages, rng, kwargs)
+        if rng.random() < self.options["malformed_rate"]:
+            text = self._malform(text, rng)
+
+        prompt_text = "".join(str(m.get("content", "")) for m in messages)
+        usage = {
+            "prompt_tokens": len(prompt_text) // 4,
+            "completion_tokens": len(text) // 4,
+            "total_tokens": (len(prompt_text) + len(text)) // 4,
+        }
+        return SimpleNamespace(
+            id=f"fake-{rng.getrandbits(32):08x}",
+            model=self.model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop", message=SimpleNamespace(content=text))],
+            usage=usage,
+            _hidden_params={"response_cost": 0.0},
+        )
+
+    def _respond(self, messages: list, rng: random.Random, kwargs: dict) -> str:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        if not isinstance(last_user, str):
+            last_user = json.dumps(last_user, default=str)
+
+        sections = dict(_SECTION.findall(last_user))
+        match = _OUTPUT_FIELDS.search(system)
+        output_fields = _FIELD_NAME.findall(match.group(1)) if match else []
+
+        if not output_fields:
+            # Raw prompt (e.g. stream_batch --mode raw): answer with the bare JSON object
+            return json.dumps(fake_analysis(rng, last_user, flag_error_rate=self.options["flag_error_rate"]))
+
+        if "reviews" in sections:
+            try:
+                reviews = json.loads(sections["reviews"])
+            except json.JSONDecodeError:
+                reviews = []
+            values = {"analyses": [
+                {"id": r.get("id", i), **fake_analysis(rng, r.get("review_text", ""), r.get("rating", 5),
+                                                       self.options["flag_error_rate"])}
+                for i, r in enumerate(reviews)
+            ]}
+        else:
+            try:
+                rating = int(sections.get("rating", "5").strip())
+            except ValueError:
+                rating = 5
+            values = fake_analysis(rng, sections.get("review_text", last_user), rating, self.options["flag_error_rate"])
+
+        values["reasoning"] = "The review was analyzed offline by the fake LM."
+        answer = {field: values.get(field, "") for field in output_fields}
+
+        json_mode = kwargs.get("response_format") is not None or "JSON object" in last_user
+        if json_mode:
+            return json.dumps(answer)
+        body = "\n\n".join(f"[[ ## {field} ## ]]\n{_format_field(value)}" for field, value in answer.items())
+        return body + "\n\n[[ ## completed ## ]]"
+
+    def _malform(self, text: str, rng: random.Random) -> str:
+        style = rng.choice(["truncate", "prose", "drop_headers"])
+        if style == "truncate":
+            return text[: max(1, len(text) // 2)]
+        if style == "prose":
+            return "Sure! Here is my analysis of the review: it was very positive overall."
+        return re.sub(r"\[\[ ## \w+ ## \]\]\n", "", text)
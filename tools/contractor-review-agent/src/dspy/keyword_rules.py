@@ -0,0 +1,117 @@
+"""
+Rule-based fast path for mentions_price and mentions_timeline.
+
+The ReviewTaggingSignature docstring already spells out keyword rules for
+these two booleans. This module compiles them into a single regex so they can
+be computed locally in microseconds, and builds a slimmer signature that drops
+both fields (and their instruction lines) so the LM emits fewer tokens.
+
+Usage:
+    from keyword_rules import keyword_flags
+
+    keyword_flags("Free estimate and they showed up right on time")
+    # {'mentions_price': True, 'mentions_timeline': True}
+"""
+
+import re
+
+RULE_FIELDS = ("mentions_price", "mentions_timeline")
+
+# "free" that isn't about money: "hassle free", "feel free to call", "free from leaks" ("raccoon-free" via the hyphen)
+NON_PRICE_FREE = ("hassle", "stress", "worry", "mess", "trouble", "problem", "pain", "dust", "smoke", "debris",
+                  "clutter", "odor", "leak", "feel")
+
+PRICE_TERMS = [
+    r"(?<!-)" + "".join(rf"(?<!{word} )" for word in NON_PRICE_FREE) + r"free\b(?!-)(?! from| of (?!charge))",
+    r"costs?", r"costly", r"pric(?:e|es|ed|ing)", r"quot(?:e|es|ed)",
+    r"estimates?", r"affordabl[ey]", r"reasonabl[ey] priced", r"expensive", r"cheap(?:er|est)?",
+    r"fees?", r"dollars?", r"budget", r"invoice",
+    # Bare "bill"/"charge" are a first name and "in charge of"; require money context
+    r"(?:the|a|our|my|final|total) bill", r"bill(?:ed|ing)", r"(?:over)?charg(?:es|ed|ing)",
+    r"(?:no|extra|service|hidden|additional|a|the) charges?",
+    r"(?:good|great|fair|reasonable|competitive) (?:value|rates?)", r"worth the (?:money|price|cost)",
+]
+PRICE_SYMBOLS = [r"\$"]
+
+TIMELINE_TERMS = [
+    r"on time", r"right on time", r"on schedule", r"ahead of schedule", r"schedul(?:e|ed|es|ing)",
+    r"quick(?:ly)?", r"same[- ]day", r"next[- ]day", r"next season", r"prompt(?:ly|ness)?",
+    r"timely", r"punctual(?:ity)?", r"right away", r"in no time", r"fast", r"speedy",
+    r"showed up (?:early|late)", r"(?:arrived|was|were|came) (?:early|late)", r"wait(?:ed|ing)? (?:for|weeks|days|months)",
+    r"within (?:a|an|one|two|the|a couple of|a few|\d+) (?:hour|day|week|month)s?",
+    r"response time", r"turnaround", r"(?:install|installation|appointment) date",
+]
+
+# One combined pattern: a single pass over the text reports which group(s) hit
+RULE_PATTERN = re.compile(
+    r"(?P<mentions_price>\b(?:" + "|".join(PRICE_TERMS) + r")\b|" + "|".join(PRICE_SYMBOLS) + r")"
+    r"|(?P<mentions_timeline>\b(?:" + "|".join(TIMELINE_TERMS) + r")\b)",
+    re.IGNORECASE,
+)
+
+
+def keyword_flags(review_text: str) -> dict:
+    """Compute mentions_price / mentions_timeline from the review text."""
+    flags = {field: False for field in RULE_FIELDS}
+    for match in RULE_PATTERN.finditer(review_text or ""):
+        flags[match.lastgroup] = True
+        if all(flags.values()):
+            break
+    return flags
+
+
+def slim_signature(signature):
+    """Drop the rule-computed output fields and their instruction lines from a signature."""
+    slim = signature
+    for field in RULE_FIELDS:
+        slim = slim.delete(field)
+    instructions = "\n".join(
+        line for line in signature.instructions.splitlines()
+        if not line.strip().startswith(tuple(f"- {field}" for field in RULE_FIELDS))
+    )
+    return slim.with_instructions(instructions)
+
+
+def apply_rule_fields(prediction, review_text: str):
+    """Fill the rule-computed fields on a prediction in place."""
+    for field, value in keyword_flags(review_text).items():
+        prediction[field] = value
+    return prediction
+
+
+def _as_bool(value) -> bool:
+    return str(value).lower() in ("true", "1", "yes")
+
+
+class RuleAgreement:
+    """Tallies how often the keyword rules agree with the LM and with ground truth."""
+
+    def __init__(self):
+        self.counts = {field: {"lm": [0, 0], "truth": [0, 0]} for field in RULE_FIELDS}
+
+    def update(self, review_text: str, prediction=None, expected=None):
+        flags = keyword_flags(review_text)
+        for field, rule_value in flags.items():
+            lm_value = prediction.get(field) if prediction is not None else None
+            if lm_value is not None:
+                self.counts[field]["lm"][0] += rule_value == _as_bool(lm_value)
+                self.counts[field]["lm"][1] += 1
+            true_value = expected.get(field) if expected is not None else None
+            if true_value is not None:
+                self.counts[field]["truth"][0] += rule_value == bool(true_value)
+                self.counts[field]["truth"][1] += 1
+
+    def summary(self) -> dict:
+        return {
+            field: {
+                source: (agree / total if total else None)
+                for source, (agree, total) in sources.items()
+            }
+            for field, sources in self.counts.items()
+        }
+
+    def print_summary(self):
+        for field, rates in self.summary().items():
+            parts = [f"vs {source}: {rate:.0%}" for source, rate in rates.items() if rate is not None]
+            if parts:
+                print(f"Rules {field}: " + ", ".join(parts))
@@ -0,0 +1,226 @@
+"""
+Per-review k-NN few-shot demo selection.
+
+BootstrapFewShot freezes the same demos into every prompt. This module
+builds a small local index over a labeled pool (TRAINING_DATA plus
+test_reviews_50.json): hashed word 1-2 gram TF-IDF vectors in NumPy,
+L2-normalized when the index is built so a query is a single mat-vec
+product plus an argpartition. Each review is then tagged with the k most
+similar labeled reviews as its demos, which are usually more relevant than
+the frozen four while costing fewer prompt tokens.
+
+The query review itself (same normalized text) is never returned as a demo,
+so evaluating on a review that is also in the pool is leave-one-out.
+
+Usage:
+    python knn_demos.py --k 0 1 2 4                   # accuracy / tokens per K on test_reviews_50.json
+    python knn_demos.py --model gemma2:9b --k 2
+    python eval_50_reviews.py --knn-demos 2           # evaluate with 2 retrieved demos per review
+"""
+
+import re
+import json
+import time
+import zlib
+import hashlib
+import argparse
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+import numpy as np
+
+from batch_tagging import tag_many, tracked_usage
+from dedup import normalize
+from keyword_rules import apply_rule_fields
+from review_tagger import TRAINING_DATA, setup_lm
+from vector_metric import EVAL_50_METRIC, score_tagged
+
+_TOKEN = re.compile(r"[a-z0-9$']+")
+
+LABEL_FIELDS = ["detected_services", "sentiment", "sentiment_score", "themes", "project_type",
+                "mentions_price", "mentions_timeline", "confidence"]
+
+
+# =============================================================================
+# Hashed TF-IDF
+# =============================================================================
+
+def hashed_ngrams(text: str, n_features: int) -> np.ndarray:
+    """Bucket ids of the word unigrams and bigrams in `text` (with repeats)."""
+    tokens = _TOKEN.findall((text or "").lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) % n_features for g in grams), dtype=np.int64,
+                       count=len(grams))
+
+
+class HashedTfidf:
+    """TF-IDF over hashed word n-grams; fitted IDF, sublinear TF, L2-normalized rows."""
+
+    def __init__(self, n_features: int = 2**13):
+        self.n_features = n_features
+        self.idf = np.ones(n_features, dtype=np.float32)
+
+    def _tf(self, text: str) -> np.ndarray:
+        counts = np.bincount(hashed_ngrams(text, self.n_features), minlength=self.n_features).astype(np.float32)
+        nonzero = counts > 0
+        counts[nonzero] = 1.0 + np.log(counts[nonzero])
+        return counts
+
+    def fit_transform(self, texts: list[str]) -> np.ndarray:
+        tf = np.vstack([self._tf(t) for t in texts]) if texts else np.zeros((0, self.n_features), np.float32)
+        df = (tf > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1.0).astype(np.float32)
+        return self._normalize(tf * self.idf)
+
+    def transform(self, text: str) -> np.ndarray:
+        return self._normalize((self._tf(text) * self.idf)[None, :])[0]
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+# =============================================================================
+# Labeled pool and index
+# =============================================================================
+
+def labeled_pool(include_test_50: bool = True, test_path: str = "test_reviews_50.json") -> list[dict]:
+    """TRAINING_DATA plus (optionally) the 50 labeled eval reviews, as flat dicts."""
+    pool = [dict(item) for item in TRAINING_DATA]
+    if include_test_50:
+        with open(test_path, "r") as f:
+            for review in json.load(f):
+                pool.append({
+                    "review_text": review["review_text"],
+                    "rating": review.get("rating", 5),
+                    "reviewer_name": review.get("reviewer_name", "Unknown"),
+                    **{field: review["analysis_json"].get(field) for field in LABEL_FIELDS},
+                })
+    return pool
+
+
+def to_demo(item: dict) -> dspy.Example:
+    """A labeled pool item as a dspy demo (project_type None is written "null", as in create_dspy_examples)."""
+    labels = {field: item.get(field) for field in LABEL_FIELDS if field in item}
+    if "project_type" in labels and not labels["project_type"]:
+        labels["project_type"] = "null"
+    return dspy.Example(
+        review_text=item["review_text"],
+        rating=item.get("rating", 5),
+        reviewer_name=item.get("reviewer_name", "Unknown"),
+        **labels,
+    ).with_inputs("review_text", "rating", "reviewer_name")
+
+
+class DemoIndex:
+    """Cosine-similarity top-k over a labeled pool."""
+
+    def __init__(self, pool: list[dict], n_features: int = 2**13):
+        self.pool = pool
+        self.demos = [to_demo(item) for item in pool]
+        self.vectorizer = HashedTfidf(n_features)
+        self.matrix = self.vectorizer.fit_transform([item["review_text"] for item in pool])
+        keys = [normalize(item["review_text"]) for item in pool]
+        self.positions = {}
+        for i, key in enumerate(keys):
+            self.positions.setdefault(key, []).append(i)
+        self.fingerprint = hashlib.sha256(json.dumps([keys, n_features]).encode("utf-8")).hexdigest()[:12]
+
+    def query(self, review_text: str, k: int) -> list[tuple[int, float]]:
+        """(pool index, similarity) of the k nearest pool reviews, best first, excluding the review itself."""
+        if k <= 0 or not self.pool:
+            return []
+        scores = self.matrix @ self.vectorizer.transform(review_text)
+        scores[self.positions.get(normalize(review_text), [])] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def demos_for(self, review_text: str, k: int) -> list:
+        return [self.demos[i] for i, _ in self.query(review_text, k)]
+
+
+class KNNReviewTagger(dspy.Module):
+    """Wraps a ReviewTagger and hands its predictor the k nearest labeled demos per review."""
+
+    def __init__(self, tagger, index: DemoIndex, k: int = 2):
+        super().__init__()
+        self.tagger = tagger
+        self.index = index
+        self.k = k
+        # Demos depend only on the inputs, the pool and k; prediction_cache folds this into its key
+        self.cache_fingerprint = {"knn_k": k, "pool": index.fingerprint}
+
+    def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
+        demos = self.index.demos_for(review_text, self.k)
+        # Per-call demos override the predictor's own, so concurrent reviews don't share state
+        result = self.tagger.tagger(review_text=review_text, rating=rating, reviewer_name=reviewer_name,
+                                    demos=demos)
+        if getattr(self.tagger, "rule_fields", False):
+            apply_rule_fields(result, review_text)
+        return result
+
+
+# =============================================================================
+# K sweep report
+# =============================================================================
+
+def run_knn_report(model_name: str, k_values: list[int], concurrency: int = 8,
+                   output_path: str = "knn_report.json") -> dict:
+    """Accuracy and prompt tokens per review for each K on test_reviews_50.json (leave-one-out)."""
+    from eval_50_reviews import ReviewTagger
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+    index = DemoIndex(labeled_pool())
+
+    start = time.perf_counter()
+    for review in reviews:
+        index.query(review["review_text"], max(k_values))
+    query_ms = (time.perf_counter() - start) / len(reviews) * 1000
+
+    setup_lm(model_name)
+    lm = dspy.settings.lm.copy(cache=False)
+    dspy.configure(lm=lm)
+
+    print("\n" + "=" * 70)
+    print(f"k-NN Demo Report ({model_name}, {len(reviews)} reviews, pool {len(index.pool)}, "
+          f"{query_ms:.3f} ms/query)")
+    print("=" * 70)
+
+    report = {"model": model_name, "reviews": len(reviews), "pool": len(index.pool), "query_ms": query_ms,
+              "runs": []}
+    for k in k_values:
+        tagger = KNNReviewTagger(ReviewTagger(), index, k=k)
+        with track_usage() as tracker:
+            tagged_results = tag_many(tagger, reviews, concurrency=concurrency)
+        usage = tracked_usage(tracker)
+        errors = sum(not t.ok for t in tagged_results)
+        accuracy = 0.0
+        if errors < len(tagged_results):
+            _, batch = score_tagged(tagged_results, lambda r: r["analysis_json"], EVAL_50_METRIC)
+            accuracy = batch.mean()["overall"]
+        run = {"k": k, "accuracy": accuracy, "errors": errors,
+               "input_tokens_per_review": usage["input_tokens"] / len(reviews),
+               "output_tokens_per_review": usage["output_tokens"] / len(reviews)}
+        report["runs"].append(run)
+        print(f"  K={k:<3} accuracy {accuracy:.1%} | {run['input_tokens_per_review']:.0f} input tokens/review | "
+              f"{errors} errors")
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="k-NN few-shot demo selection report")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--k", type=int, nargs="+", default=[0, 1, 2, 4], help="Demos per review to compare")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--output", default="knn_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_knn_report(args.model, args.k, concurrency=args.concurrency, output_path=args.output)
@@ -0,0 +1,478 @@
+"""
+Local first-pass classifier: NumPy linear models on hashed n-grams.
+
+Trains one softmax regression per field (sentiment, project_type,
+mentions_price, mentions_timeline). The inputs are the labeled reviews we
+already have: test_reviews_50.json, TRAINING_DATA and, with --labels,
+production tags (stream_batch or retag --export output) joined to the batch
+input by custom_id.
+
+Features are the hashed word 1-2 grams from knn_demos.hashed_ngrams: sublinear
+TF, L2-normalized per review, plus a bias column and a one-hot star rating.
+They are kept as CSR arrays. Training is full-batch Adam with L2 using
+gather / bincount products, so nothing beyond NumPy is needed.
+
+Probabilities are calibrated per field by temperature scaling, fitted on
+out-of-fold logits (K-fold cross-fitting), and the shipped model is then
+refit on every row. The training report shows accuracy, expected
+calibration error (ECE) before and after, and coverage vs accuracy for
+several gate thresholds. All of them are measured on rows that neither the
+weights nor the temperature for that prediction were fitted on: each fold
+is scored with weights from the other folds and a temperature fitted on
+the other folds' out-of-fold logits.
+
+FirstPassTagger puts the classifier in front of ReviewTagger. A review whose
+calibrated confidence (the lowest top-class probability over the four
+fields) reaches the threshold is answered locally. Everything else goes to
+the LM. Locally answered reviews get sentiment_score from the class
+probabilities (the training mean score of each sentiment, weighted). They
+carry no detected_services or themes, which only the LM extracts.
+
+Usage:
+    python local_classifier.py train                                    # test_reviews_50 + TRAINING_DATA
+    python local_classifier.py train --labels batch_output.jsonl        # + production tags
+    python local_classifier.py tag --output first_pass.jsonl            # whole backlog on CPU
+    python stream_batch.py --first-pass local_classifier.npz --first-pass-threshold 0.9
+"""
+
+import json
+import time
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+
+import dspy
+import numpy as np
+
+from knn_demos import hashed_ngrams, labeled_pool
+from review_store import PROJECT_TYPES, SENTIMENTS
+from stream_batch import DEFAULT_INPUT, read_requests
+
+DEFAULT_MODEL_PATH = "local_classifier.npz"
+FIELDS = {
+    "sentiment": SENTIMENTS,
+    "project_type": PROJECT_TYPES,
+    "mentions_price": (False, True),
+    "mentions_timeline": (False, True),
+}
+DEFAULT_SENTIMENT_SCORES = {"positive": 0.85, "negative": -0.85, "neutral": 0.0, "mixed": 0.0}
+GATE_THRESHOLDS = (0.5, 0.7, 0.8, 0.9, 0.95)
+RATINGS = 5
+
+
+# =============================================================================
+# Sparse features
+# =============================================================================
+
+@dataclass
+class SparseRows:
+    """CSR matrix: row i holds (indices, values)[indptr[i]:indptr[i + 1]]; every row is non-empty (bias)."""
+    indptr: np.ndarray
+    indices: np.ndarray
+    values: np.ndarray
+    n_cols: int
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def dot(self, weights: np.ndarray) -> np.ndarray:
+        """X @ W for W of shape (n_cols, k)."""
+        return np.add.reduceat(weights[self.indices] * self.values[:, None], self.indptr[:-1], axis=0)
+
+    def tdot(self, grad: np.ndarray) -> np.ndarray:
+        """X.T @ G for G of shape (rows, k)."""
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        out = np.empty((self.n_cols, grad.shape[1]), dtype=np.float32)
+        for k in range(grad.shape[1]):
+            out[:, k] = np.bincount(self.indices, weights=self.values * grad[rows, k], minlength=self.n_cols)
+        return out
+
+    def take(self, rows: np.ndarray) -> "SparseRows":
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths) + np.repeat(self.indptr[rows], lengths)
+        return SparseRows(indptr, self.indices[positions], self.values[positions], self.n_cols)
+
+
+def featurize(texts: list[str], ratings: list, n_features: int) -> SparseRows:
+    """Hashed n-gram TF (1 + log count, L2-normalized) plus bias and rating one-hot columns."""
+    indptr, indices, values = [0], [], []
+    for text, rating in zip(texts, ratings):
+        buckets, counts = np.unique(hashed_ngrams(text, n_features), return_counts=True)
+        tf = (1.0 + np.log(counts)).astype(np.float32)
+        if len(tf):
+            tf /= np.linalg.norm(tf)
+        extra = [n_features]  # bias
+        try:
+            if 1 <= int(rating) <= RATINGS:
+                extra.append(n_features + int(rating))
+        except (TypeError, ValueError):
+            pass
+        indices.append(buckets)
+        indices.append(np.array(extra, dtype=np.int64))
+        values.append(tf)
+        values.append(np.ones(len(extra), dtype=np.float32))
+        indptr.append(indptr[-1] + len(buckets) + len(extra))
+    return SparseRows(np.array(indptr, dtype=np.int64), np.concatenate(indices) if indices else np.zeros(0, np.int64),
+                      np.concatenate(values) if values else np.zeros(0, np.float32), n_features + 1 + RATINGS)
+
+
+# =============================================================================
+# Softmax regression + temperature scaling
+# =============================================================================
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    z = logits - logits.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def fit_softmax(X: SparseRows, y: np.ndarray, n_classes: int, epochs: int = 200, lr: float = 0.1,
+                l2: float = 1e-4) -> np.ndarray:
+    """Full-batch Adam on mean cross-entropy + L2; returns weights of shape (n_cols, n_classes)."""
+    weights = np.zeros((X.n_cols, n_classes), dtype=np.float32)
+    m, v = np.zeros_like(weights), np.zeros_like(weights)
+    target = np.eye(n_classes, dtype=np.float32)[y]
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        grad = X.tdot((softmax(X.dot(weights)) - target) / len(y)) + l2 * weights
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        weights -= lr * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+    return weights
+
+
+def nll(logits: np.ndarray, y: np.ndarray) -> float:
+    probs = softmax(logits)
+    return float(-np.log(np.maximum(probs[np.arange(len(y)), y], 1e-12)).mean())
+
+
+TEMPERATURE_GRID = np.logspace(-1.5, 1.5, 121)
+
+
+def fit_temperature(logits: np.ndarray, y: np.ndarray) -> float:
+    """Temperature minimizing NLL on out-of-sample logits (grid over 0.03..30); 1.0 without rows."""
+    if len(y) == 0:
+        return 1.0
+    return float(TEMPERATURE_GRID[np.argmin([nll(logits / t, y) for t in TEMPERATURE_GRID])])
+
+
+def at_grid_edge(temperature: float) -> bool:
+    """True when fit_temperature hit an end of its grid (the best temperature may lie beyond it)."""
+    return temperature in (float(TEMPERATURE_GRID[0]), float(TEMPERATURE_GRID[-1]))
+
+
+def expected_calibration_error(probs: np.ndarray, y: np.ndarray, bins: int = 10) -> float:
+    """Mean |accuracy - confidence| over equal-width confidence bins, weighted by bin size."""
+    if len(y) == 0:
+        return 0.0
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == y
+    which = np.minimum((confidence * bins).astype(int), bins - 1)
+    ece = 0.0
+    for b in range(bins):
+        mask = which == b
+        if mask.any():
+            ece += mask.mean() * abs(correct[mask].mean() - confidence[mask].mean())
+    return float(ece)
+
+
+def encode_label(field: str, value):
+    """Class index of a label for `field`, or None when it isn't one of the field's classes."""
+    classes = FIELDS[field]
+    if classes == (False, True):
+        if isinstance(value, bool):
+            return int(value)
+        return int(str(value).lower() in ("true", "1", "yes")) if value is not None else None
+    if field == "project_type" and (value is None or str(value).lower() in ("null", "none", "")):
+        return classes.index(None)
+    value = str(value).lower()
+    return classes.index(value) if value in classes else None
+
+
+# =============================================================================
+# Classifier
+# =============================================================================
+
+class LocalClassifier:
+    """Per-field calibrated softmax regressions over shared hashed n-gram features."""
+
+    def __init__(self, n_features: int = 2**18):
+        self.n_features = n_features
+        self.weights = {}
+        self.temperatures = {field: 1.0 for field in FIELDS}
+        self.sentiment_scores = dict(DEFAULT_SENTIMENT_SCORES)
+        self.meta = {}
+
+    def predict_proba(self, texts: list[str], ratings: list, chunk: int = 8192) -> dict:
+        """{field: (n, classes) calibrated probabilities}."""
+        out = {field: [] for field in self.weights}
+        for start in range(0, len(texts), chunk):
+            X = featurize(texts[start:start + chunk], ratings[start:start + chunk], self.n_features)
+            for field, weights in self.weights.items():
+                out[field].append(softmax(X.dot(weights) / self.temperatures[field]))
+        return {field: np.vstack(parts) if parts else np.zeros((0, len(FIELDS[field])))
+                for field, parts in out.items()}
+
+    def predict(self, texts: list[str], ratings: list) -> list[dict]:
+        """One ReviewAnalysis-shaped dict per review; `confidence` is the lowest top-class probability."""
+        probs = self.predict_proba(texts, ratings)
+        scores = np.array([self.sentiment_scores.get(s, 0.0) for s in SENTIMENTS])
+        sentiment_score = probs["sentiment"] @ scores
+        confidence = np.min([p.max(axis=1) for p in probs.values()], axis=0)
+        labels = {field: [FIELDS[field][i] for i in p.argmax(axis=1)] for field, p in probs.items()}
+        return [{
+            "detected_services": [],
+            "sentiment": labels["sentiment"][i],
+            "sentiment_score": round(float(sentiment_score[i]), 3),
+            "themes": [],
+            "project_type": labels["project_type"][i],
+            "mentions_price": labels["mentions_price"][i],
+            "mentions_timeline": labels["mentions_timeline"][i],
+            "confidence": round(float(confidence[i]), 4),
+        } for i in range(len(texts))]
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        meta = {"n_features": self.n_features, "temperatures": self.temperatures,
+                "sentiment_scores": self.sentiment_scores, **self.meta}
+        np.savez_compressed(path, meta=np.array(json.dumps(meta)),
+                            **{f"weights_{field}": w.astype(np.float16) for field, w in self.weights.items()})
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "LocalClassifier":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            classifier = cls(meta.pop("n_features"))
+            classifier.temperatures = meta.pop("temperatures")
+            classifier.sentiment_scores = meta.pop("sentiment_scores")
+            classifier.meta = meta
+            classifier.weights = {field: data[f"weights_{field}"].astype(np.float32) for field in FIELDS}
+        return classifier
+
+
+def labeled_items(labels_path: str | None = None, input_path: str = DEFAULT_INPUT,
+                  include_test_50: bool = True) -> list[dict]:
+    """Labeled pool (TRAINING_DATA, test_reviews_50.json) plus production tags joined to their review text."""
+    items = labeled_pool(include_test_50=include_test_50)
+    if labels_path:
+        tags = {}
+        with open(labels_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("analysis"):
+                    tags[record["custom_id"]] = record["analysis"]
+        for request in read_requests(input_path):
+            analysis = tags.get(request.get("custom_id"))
+            if analysis is not None and "review_text" in request:
+                items.append({"review_text": request["review_text"], "rating": request["rating"], **analysis})
+    return items
+
+
+def _fit(X: SparseRows, labels: np.ndarray, rows: np.ndarray, n_classes: int, epochs: int,
+         l2: float) -> np.ndarray:
+    """Weights fitted on the labeled rows among `rows` (zeros when there are none)."""
+    rows = rows[labels[rows] >= 0]
+    if not len(rows):
+        return np.zeros((X.n_cols, n_classes), dtype=np.float32)
+    return fit_softmax(X.take(rows), labels[rows], n_classes, epochs=epochs, l2=l2)
+
+
+def train(items: list[dict], n_features: int = 2**18, folds: int = 5, epochs: int = 200,
+          l2: float = 1e-4, seed: int = 0) -> tuple[LocalClassifier, dict]:
+    """
+    Fit and calibrate every field; returns (classifier, report).
+
+    Each row gets out-of-fold logits from weights fitted on the other folds.
+    The shipped temperature is fitted on all of them, and the shipped
+    weights on every row. The report's accuracy, ECE and gate figures score
+    each fold with its out-of-fold logits and a temperature fitted on the
+    other folds only, so no number is measured on rows used for fitting.
+    """
+    folds = max(2, min(folds, len(items)))
+    fold_of = np.empty(len(items), dtype=np.int64)
+    fold_of[np.random.default_rng(seed).permutation(len(items))] = np.arange(len(items)) % folds
+    X = featurize([it["review_text"] for it in items], [it.get("rating", 5) for it in items], n_features)
+    all_rows = np.arange(len(items))
+
+    classifier = LocalClassifier(n_features)
+    report = {"items": len(items), "folds": folds, "fields": {}}
+    oof_probs, oof_labels = {}, {}
+    for field, classes in FIELDS.items():
+        labels = np.array([-1 if (c := encode_label(field, it.get(field))) is None else c for it in items])
+        logits = np.zeros((len(items), len(classes)), dtype=np.float32)
+        for k in range(folds):
+            held = all_rows[fold_of == k]
+            weights = _fit(X, labels, all_rows[fold_of != k], len(classes), epochs, l2)
+            logits[held] = X.take(held).dot(weights)
+
+        # Calibrated out-of-fold probabilities: each fold's temperature comes from the other folds
+        probs = np.empty_like(logits)
+        for k in range(folds):
+            fit_rows = all_rows[(fold_of != k) & (labels >= 0)]
+            probs[fold_of == k] = softmax(logits[fold_of == k] / fit_temperature(logits[fit_rows], labels[fit_rows]))
+        oof_probs[field], oof_labels[field] = probs, labels
+
+        labeled = labels >= 0
+        temperature = fit_temperature(logits[labeled], labels[labeled])
+        if at_grid_edge(temperature):
+            print(f"  ⚠ {field}: temperature {temperature:.2f} is at the end of the search grid; "
+                  f"calibration is unreliable (too few or separable labels?)")
+        classifier.weights[field] = _fit(X, labels, all_rows, len(classes), epochs, l2)
+        classifier.temperatures[field] = temperature
+
+        y = labels[labeled]
+        report["fields"][field] = {
+            "labeled": int(labeled.sum()), "temperature": temperature,
+            "temperature_at_grid_edge": at_grid_edge(temperature),
+            "accuracy": float((probs[labeled].argmax(axis=1) == y).mean()) if len(y) else None,
+            "ece_raw": expected_calibration_error(softmax(logits[labeled]), y),
+            "ece_calibrated": expected_calibration_error(probs[labeled], y),
+        }
+
+    # Mean sentiment_score per sentiment class, for locally answered reviews
+    for sentiment in SENTIMENTS:
+        values = [float(it["sentiment_score"]) for it in items
+                  if str(it.get("sentiment")).lower() == sentiment and it.get("sentiment_score") is not None]
+        if values:
+            classifier.sentiment_scores[sentiment] = float(np.mean(values))
+
+    # Gate: share of reviews answered locally, and their per-field accuracy, per threshold (out of fold)
+    report["gate"] = []
+    if len(items):
+        confidence = np.min([p.max(axis=1) for p in oof_probs.values()], axis=0)
+        for threshold in GATE_THRESHOLDS:
+            covered = confidence >= threshold
+            correct = [(oof_probs[f].argmax(axis=1) == oof_labels[f])[covered & (oof_labels[f] >= 0)] for f in FIELDS]
+            hits = np.concatenate(correct) if covered.any() else np.zeros(0)
+            report["gate"].append({"threshold": threshold, "coverage": float(covered.mean()),
+                                   "accuracy": float(hits.mean()) if len(hits) else None})
+
+    classifier.meta = {"trained": datetime.now().isoformat(timespec="seconds"), "items": len(items)}
+    return classifier, report
+
+
+def print_train_report(report: dict):
+    print(f"\n{report['items']} labeled reviews, {report['folds']}-fold cross-fitted "
+          f"(accuracy, ECE and gate are out of fold)")
+    print(f"\n{'Field':<20} {'Labeled':>8} {'Acc':>7} {'Temp':>7} {'ECE raw':>8} {'ECE cal':>8}")
+    for field, r in report["fields"].items():
+        accuracy = f"{r['accuracy']:.1%}" if r["accuracy"] is not None else "-"
+        edge = "!" if r["temperature_at_grid_edge"] else " "
+        print(f"{field:<20} {r['labeled']:>8} {accuracy:>7} {r['temperature']:>6.2f}{edge} "
+              f"{r['ece_raw']:>8.3f} {r['ece_calibrated']:>8.3f}")
+    if report["gate"]:
+        print(f"\n{'Gate threshold':<16} {'Answered locally':>17} {'Field accuracy':>15}")
+        for g in report["gate"]:
+            accuracy = f"{g['accuracy']:.1%}" if g["accuracy"] is not None else "-"
+            print(f"{g['threshold']:<16} {g['coverage']:>16.0%} {accuracy:>15}")
+
+
+# =============================================================================
+# Gate in front of the LM tagger
+# =============================================================================
+
+class FirstPassTagger(dspy.Module):
+    """Answers confident reviews with the local classifier; the rest go to `tagger`."""
+
+    def __init__(self, tagger, classifier: LocalClassifier, threshold: float = 0.9):
+        super().__init__()
+        self.tagger = tagger
+        self.classifier = classifier
+        self.threshold = threshold
+        self.counts = {"local": 0, "lm": 0}
+        self._lock = threading.Lock()
+        # Answers depend on the classifier and threshold; prediction_cache folds this into its key
+        self.cache_fingerprint = {"first_pass": classifier.meta.get("trained"), "threshold": threshold}
+
+    def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
+        analysis = self.classifier.predict([review_text], [rating])[0]
+        local = analysis["confidence"] >= self.threshold
+        with self._lock:
+            self.counts["local" if local else "lm"] += 1
+        if local:
+            return dspy.Prediction(**analysis)
+        return self.tagger(review_text=review_text, rating=rating, reviewer_name=reviewer_name)
+
+    def summary(self) -> dict:
+        reviews = sum(self.counts.values())
+        return {**self.counts, "threshold": self.threshold,
+                "local_share": self.counts["local"] / reviews if reviews else 0.0}
+
+    def print_summary(self):
+        s = self.summary()
+        print(f"First pass: {s['local']} answered locally, {s['lm']} sent to the LM "
+              f"({s['local_share']:.0%} local at threshold {s['threshold']})")
+
+
+def tag_backlog(model_path: str, input_path: str, output_path: str, threshold: float = 0.9,
+                chunk: int = 4096, limit: int | None = None) -> dict:
+    """Classify every request in `input_path`; writes {"custom_id", "analysis", "confident"} per line."""
+    classifier = LocalClassifier.load(model_path)
+    counts = {"reviews": 0, "confident": 0, "unparsable": 0}
+    start = time.perf_counter()
+
+    def flush(batch, out):
+        for request, analysis in zip(batch, classifier.predict([r["review_text"] for r in batch],
+                                                               [r["rating"] for r in batch])):
+            confident = analysis["confidence"] >= threshold
+            counts["confident"] += confident
+            out.write(json.dumps({"custom_id": request["custom_id"], "analysis": analysis, "confident": confident},
+                                 ensure_ascii=False) + "\n")
+        counts["reviews"] += len(batch)
+
+    with open(output_path, "w", encoding="utf-8") as out:
+        batch = []
+        for request in read_requests(input_path, limit=limit):
+            if "review_text" not in request:
+                counts["unparsable"] += 1
+                continue
+            batch.append(request)
+            if len(batch) >= chunk:
+                flush(batch, out)
+                batch = []
+        if batch:
+            flush(batch, out)
+
+    elapsed = time.perf_counter() - start
+    share = counts["confident"] / counts["reviews"] if counts["reviews"] else 0.0
+    print(f"✓ {counts['reviews']} reviews classified in {elapsed:.1f}s "
+          f"({counts['reviews'] / elapsed if elapsed else 0:.0f}/s) → {output_path}")
+    print(f"  {counts['confident']} ({share:.0%}) at confidence >= {threshold}; "
+          f"{counts['reviews'] - counts['confident']} need the LM"
+          + (f"; {counts['unparsable']} unparsable lines" if counts["unparsable"] else ""))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NumPy linear first-pass classifier for review tags")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_cmd = sub.add_parser("train", help="Fit and calibrate on the labeled reviews")
+    train_cmd.add_argument("--labels", help="Production tags JSONL (stream_batch / retag --export output)")
+    train_cmd.add_argument("--input", default=DEFAULT_INPUT, help="Batch request JSONL the --labels ids refer to")
+    train_cmd.add_argument("--features", type=int, default=18, help="log2 of the hashed feature count")
+    train_cmd.add_argument("--epochs", type=int, default=200, help="Full-batch Adam steps per field")
+    train_cmd.add_argument("--l2", type=float, default=1e-4, help="L2 penalty")
+    train_cmd.add_argument("--folds", type=int, default=5, help="Cross-fitting folds for calibration and the report")
+    train_cmd.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Where to save the classifier")
+    train_cmd.add_argument("--report", default="local_classifier_report.json", help="Training report JSON path")
+    tag_cmd = sub.add_parser("tag", help="Classify the batch input and flag reviews that need the LM")
+    tag_cmd.add_argument("--input", default=DEFAULT_INPUT, help="Batch request JSONL")
+    tag_cmd.add_argument("--output", default="first_pass.jsonl", help="Output JSONL keyed by custom_id")
+    tag_cmd.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Trained classifier")
+    tag_cmd.add_argument("--threshold", type=float, default=0.9, help="Confidence needed to skip the LM")
+    tag_cmd.add_argument("--limit", type=int, help="Only classify the first N input lines")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        start = time.perf_counter()
+        items = labeled_items(args.labels, args.input)
+        classifier, report = train(items, n_features=2**args.features, folds=args.folds, epochs=args.epochs,
+                                   l2=args.l2)
+        print_train_report(report)
+        classifier.save(args.model)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Trained in {time.perf_counter() - start:.1f}s → {args.model} (report {args.report})")
+    else:
+        tag_backlog(args.model, args.input, args.output, threshold=args.threshold, limit=args.limit)
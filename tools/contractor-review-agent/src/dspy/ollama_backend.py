@@ -0,0 +1,241 @@
+"""
+Ollama backend with pooled connections, keep_alive and explicit warmup.
+
+OllamaLM talks to Ollama's /api/chat directly instead of going through a
+fresh litellm call per request:
+
+- one pooled HTTP client per endpoint, shared by every OllamaLM and copy,
+  so calls reuse keep-alive connections
+- `keep_alive` on every request so the model stays loaded between calls and runs
+- warmup() loads the model on every reachable endpoint before any timing
+  starts; unreachable ones are marked down like a failed request would
+- requests round-robin across the endpoints in OLLAMA_HOSTS; an endpoint that
+  refuses the connection is skipped for RETRY_DOWN_AFTER seconds
+- read timeouts, dropped connections and 5xx responses are retried up to
+  num_retries times (3, like dspy.LM) with exponential backoff
+
+Endpoints default to OLLAMA_HOSTS (comma separated), else OLLAMA_HOST, else
+http://localhost:11434. keep_alive defaults to OLLAMA_KEEP_ALIVE, else 30m.
+
+setup_lm returns an OllamaLM for every Ollama model name, already warmed up.
+
+Usage:
+    OLLAMA_HOSTS=http://gpu1:11434,http://gpu2:11434 python review_tagger.py --compare --models gemma2:9b
+
+    lm = OllamaLM("ollama/gemma2:9b")
+    lm.warmup()                 # {"http://localhost:11434": 4.2}
+    dspy.configure(lm=lm)
+"""
+
+import os
+import time
+import threading
+from types import SimpleNamespace
+
+import dspy
+import httpx
+from pydantic import BaseModel
+
+DEFAULT_HOSTS = "http://localhost:11434"
+DEFAULT_KEEP_ALIVE = "30m"
+RETRY_DOWN_AFTER = 30.0
+RETRY_BACKOFF = 1.0      # seconds before the first retry, doubled for each further one
+
+# DSPy / OpenAI-style kwargs → Ollama "options"
+OPTION_NAMES = {"temperature": "temperature", "max_tokens": "num_predict", "top_p": "top_p", "top_k": "top_k",
+                "stop": "stop", "seed": "seed", "num_ctx": "num_ctx"}
+
+
+def ollama_hosts(value: str | list | None = None) -> list[str]:
+    """Endpoint URLs from a comma-separated string or list (default OLLAMA_HOSTS, read at call time)."""
+    if value is None:
+        value = os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or DEFAULT_HOSTS
+    if isinstance(value, str):
+        value = value.split(",")
+    hosts = []
+    for host in value:
+        host = host.strip().rstrip("/")
+        if host:
+            hosts.append(host if "://" in host else f"http://{host}")
+    return hosts
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def client_for(host: str, timeout: float = 300.0) -> httpx.Client:
+    """The process-wide pooled client for an endpoint."""
+    with _CLIENTS_LOCK:
+        if host not in _CLIENTS:
+            _CLIENTS[host] = httpx.Client(
+                base_url=host,
+                timeout=httpx.Timeout(timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=300),
+            )
+        return _CLIENTS[host]
+
+
+class EndpointPool:
+    """Round-robin over Ollama endpoints with per-endpoint call counts."""
+
+    def __init__(self, hosts: list[str]):
+        if not hosts:
+            raise ValueError("No Ollama endpoints configured")
+        self.hosts = hosts
+        self.stats = {host: {"calls": 0, "errors": 0, "seconds": 0.0} for host in hosts}
+        self.down_until = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def order(self) -> list[str]:
+        """Endpoints to try, starting with the next one in the rotation; unreachable ones go last."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.hosts)
+        rotation = self.hosts[start:] + self.hosts[:start]
+        now = time.monotonic()
+        return sorted(rotation, key=lambda host: self.down_until.get(host, 0.0) > now)
+
+    def record(self, host: str, seconds: float, error: bool = False, unreachable: bool = False):
+        with self._lock:
+            entry = self.stats[host]
+            entry["calls"] += 1
+            entry["errors"] += error or unreachable
+            entry["seconds"] += seconds
+            if unreachable:
+                self.down_until[host] = time.monotonic() + RETRY_DOWN_AFTER
+
+
+def _format(response_format):
+    """Ollama's `format` for a response_format: "json", a JSON schema, or None."""
+    if response_format is None:
+        return None
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        return response_format.model_json_schema()
+    if isinstance(response_format, dict):
+        if response_format.get("type") == "json_schema":
+            return response_format.get("json_schema", {}).get("schema", "json")
+        if response_format.get("type") == "json_object":
+            return "json"
+    return None
+
+
+class OllamaLM(dspy.BaseLM):
+    """DSPy LM for Ollama's chat API over pooled connections, pinned in memory with keep_alive."""
+
+    def __init__(self, model: str, hosts: str | list | None = None, keep_alive: str | int | None = None,
+                 temperature: float = 0.1, max_tokens: int = 4000, num_retries: int = 3, **kwargs):
+        if not model.startswith("ollama/"):
+            model = f"ollama/{model}"
+        super().__init__(model=model, cache=False, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        self.name = model.split("/", 1)[1]
+        self.keep_alive = keep_alive if keep_alive is not None else os.getenv("OLLAMA_KEEP_ALIVE", DEFAULT_KEEP_ALIVE)
+        self.num_retries = num_retries
+        self.pool = EndpointPool(ollama_hosts(hosts))
+        self.warmup_seconds = {}
+
+    def _post(self, path: str, payload: dict) -> dict:
+        """POST with up to num_retries retries, with backoff, on timeouts, dropped connections and 5xx."""
+        for attempt in range(self.num_retries + 1):
+            try:
+                return self._post_once(path, payload)
+            except (httpx.TimeoutException, httpx.RemoteProtocolError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    raise
+                if attempt == self.num_retries:
+                    raise
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    def _post_once(self, path: str, payload: dict) -> dict:
+        """POST to the next endpoint, moving on to the others if it can't be reached."""
+        last_error = None
+        for host in self.pool.order():
+            start = time.perf_counter()
+            try:
+                response = client_for(host).post(path, json=payload)
+                response.raise_for_status()
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                self.pool.record(host, time.perf_counter() - start, unreachable=True)
+                last_error = e
+                continue
+            except httpx.HTTPError:
+                self.pool.record(host, time.perf_counter() - start, error=True)
+                raise
+            self.pool.record(host, time.perf_counter() - start)
+            return response.json()
+        raise ConnectionError(f"No Ollama endpoint reachable ({', '.join(self.pool.hosts)}): {last_error}")
+
+    def warmup(self) -> dict:
+        """Load the model on every reachable endpoint (an empty generate) and pin it; returns seconds per endpoint."""
+        for host in self.pool.hosts:
+            start = time.perf_counter()
+            try:
+                response = client_for(host).post("/api/generate",
+                                                 json={"model": self.name, "keep_alive": self.keep_alive})
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # Same as a failed request: skipped by _post until RETRY_DOWN_AFTER has passed
+                self.pool.record(host, time.perf_counter() - start, unreachable=True)
+                continue
+            response.raise_for_status()
+            self.warmup_seconds[host] = time.perf_counter() - start
+        if not self.warmup_seconds:
+            raise ConnectionError(f"No Ollama endpoint reachable ({', '.join(self.pool.hosts)})")
+        return dict(self.warmup_seconds)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt or ""}]
+        settings = {**self.kwargs, **kwargs}
+        payload = {
+            "model": self.name,
+            "messages": [{"role": m["role"], "content": m.get("content") or ""} for m in messages],
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {OPTION_NAMES[k]: v for k, v in settings.items() if k in OPTION_NAMES and v is not None},
+        }
+        output_format = _format(settings.get("response_format"))
+        if output_format is not None:
+            payload["format"] = output_format
+
+        data = self._post("/api/chat", payload)
+        prompt_tokens = data.get("prompt_eval_count") or 0
+        completion_tokens = data.get("eval_count") or 0
+        return SimpleNamespace(
+            id=data.get("created_at"),
+            model=self.model,
+            choices=[SimpleNamespace(index=0, finish_reason=data.get("done_reason", "stop"),
+                                     message=SimpleNamespace(content=data.get("message", {}).get("content", "")))],
+            usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                   "total_tokens": prompt_tokens + completion_tokens},
+            _hidden_params={"response_cost": 0.0},
+            # Server-side seconds, for profiler.py's per-stage breakdown
+            server_timing={key: (data.get(f"{key}_duration") or 0) / 1e9
+                           for key in ("total", "load", "prompt_eval", "eval")},
+        )
+
+    def summary(self) -> dict:
+        return {"model": self.name, "keep_alive": self.keep_alive, "warmup_seconds": dict(self.warmup_seconds),
+                "endpoints": {host: dict(stats) for host, stats in self.pool.stats.items()}}
+
+    def print_summary(self):
+        for host, stats in self.pool.stats.items():
+            mean = stats["seconds"] / stats["calls"] if stats["calls"] else 0.0
+            warm = self.warmup_seconds.get(host)
+            print(f"Ollama {host}: {stats['calls']} calls ({stats['errors']} errors), {mean:.2f}s mean"
+                  + (f", warmup {warm:.1f}s" if warm is not None else ""))
+
+
+def print_ollama_stats(lm):
+    """Print per-endpoint stats if `lm` is an OllamaLM."""
+    if isinstance(lm, OllamaLM):
+        lm.print_summary()
+
+
+def setup_ollama(model_name: str, warmup: bool = True) -> OllamaLM:
+    """An OllamaLM for `model_name`, loaded and pinned on every endpoint before it is returned."""
+    lm = OllamaLM(model_name)
+    if warmup:
+        loaded = lm.warmup()
+        print(f"✓ Warmed up {lm.name} on {len(loaded)}/{len(lm.pool.hosts)} endpoint(s) in "
+              f"{max(loaded.values()):.1f}s (keep_alive={lm.keep_alive})")
+    return lm
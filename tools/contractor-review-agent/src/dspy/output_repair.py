@@ -0,0 +1,331 @@
+"""
+Local repair and schema coercion of tagger outputs.
+
+Slightly malformed LM output (prose around the JSON, code fences, single
+quotes, Python True/False/None, trailing commas, "True"/"null" strings,
+"New Construction", scores out of range) is fixed locally instead of being
+scored as wrong or re-asked. Every repair is written to a JSONL log with
+the raw and repaired output.
+
+Two entry points:
+    repair_analysis(text)      near-JSON → validated ReviewAnalysis dict (raw JSON prompts)
+    RepairingChatAdapter       dspy ChatAdapter that coerces parsed fields and, when its
+                               [[ ## field ## ]] parse fails, recovers the fields locally
+                               before DSPy falls back to re-asking the LM
+
+Usage:
+    python eval_50_reviews.py --repair
+    python stream_batch.py --repair --mode raw --model gemma2:9b
+"""
+
+import re
+import ast
+import json
+import threading
+from datetime import datetime
+
+from dspy.adapters.chat_adapter import ChatAdapter
+from dspy.utils.exceptions import AdapterParseError
+from pydantic import ValidationError
+
+from review_tagger import ReviewAnalysis
+
+DEFAULT_LOG_PATH = "repair_log.jsonl"
+
+SENTIMENTS = ("positive", "negative", "neutral", "mixed")
+PROJECT_TYPES = ("repair", "maintenance", "consultation", "new_construction")
+NULL_STRINGS = ("null", "none", "", "n/a", "na", "unknown", "unclear")
+TRUE_STRINGS = ("true", "1", "yes", "y")
+FALSE_STRINGS = ("false", "0", "no", "n")
+BOOL_FIELDS = ("mentions_price", "mentions_timeline")
+LIST_FIELDS = ("detected_services", "themes")
+# Required ReviewAnalysis fields without a default
+REQUIRED_FIELDS = ("sentiment", "sentiment_score", "mentions_price", "mentions_timeline", "confidence")
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_LENIENT_HEADER = re.compile(r"\[\[\s*##\s*(\w+)\s*##\s*\]\]")
+
+
+# =============================================================================
+# Near-JSON
+# =============================================================================
+
+def _first_object(text: str) -> str | None:
+    """The first balanced {...} block, ignoring braces inside strings."""
+    start = text.find("{")
+    while start != -1:
+        depth, quote, escaped = 0, None, False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if quote:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == quote:
+                    quote = None
+            elif ch in "\"'":
+                quote = ch
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
+def repair_json(text: str) -> tuple[dict | None, list[str]]:
+    """Parse a JSON object out of near-JSON text; returns (object or None, fixes applied)."""
+    fixes = []
+    if not isinstance(text, str):
+        return None, fixes
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+        fixes.append("code_fence")
+    block = _first_object(text)
+    if block is None:
+        return None, fixes
+    if block.strip() != text.strip():
+        fixes.append("surrounding_text")
+
+    try:
+        value = json.loads(block)
+        return (value, fixes) if isinstance(value, dict) else (None, fixes)
+    except json.JSONDecodeError:
+        pass
+
+    cleaned = _TRAILING_COMMA.sub(r"\1", block)
+    if cleaned != block:
+        fixes.append("trailing_comma")
+    try:
+        value = json.loads(cleaned)
+        return (value, fixes) if isinstance(value, dict) else (None, fixes)
+    except json.JSONDecodeError:
+        pass
+
+    # Python-style dict: single quotes, True/False/None (map JSON literals so both styles work)
+    pythonish = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", re.sub(r"\bnull\b", "None", cleaned)))
+    try:
+        value = ast.literal_eval(pythonish)
+    except (ValueError, SyntaxError):
+        return None, fixes
+    fixes.append("python_literal")
+    return (value, fixes) if isinstance(value, dict) else (None, fixes)
+
+
+# =============================================================================
+# Schema coercion
+# =============================================================================
+
+def _to_float(value) -> float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = re.search(r"-?\d+(?:\.\d+)?", value)
+        if match:
+            number = float(match.group())
+            return number / 100 if value.strip().endswith("%") else number
+    return None
+
+
+def _to_list(value) -> list | None:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped.lower() in NULL_STRINGS or stripped == "[]":
+            return []
+        if stripped.startswith("["):
+            try:
+                parsed = json.loads(stripped.replace("'", '"'))
+                if isinstance(parsed, list):
+                    return [str(v).strip() for v in parsed if str(v).strip()]
+            except json.JSONDecodeError:
+                pass
+        return [part.strip(" \"'[]") for part in stripped.split(",") if part.strip(" \"'[]")]
+    return None
+
+
+def coerce_fields(data: dict) -> tuple[dict, list[str]]:
+    """Coerce ReviewAnalysis fields present in `data` to their types, enums and ranges."""
+    out, fixes = dict(data), []
+
+    def fix(field, value, note):
+        if out.get(field) != value or type(out.get(field)) is not type(value):
+            out[field] = value
+            fixes.append(f"{field}:{note}")
+
+    for field in BOOL_FIELDS:
+        value = out.get(field)
+        if field in out and not isinstance(value, bool):
+            text = str(value).strip().lower()
+            if text in TRUE_STRINGS:
+                fix(field, True, "bool")
+            elif text in FALSE_STRINGS or text in NULL_STRINGS:
+                fix(field, False, "bool")
+
+    if isinstance(out.get("sentiment"), str):
+        sentiment = out["sentiment"].strip().strip("\"'").lower()
+        if sentiment in SENTIMENTS:
+            fix("sentiment", sentiment, "enum")
+
+    if "project_type" in out:
+        value = out["project_type"]
+        text = "" if value is None else str(value).strip().strip("\"'").lower().replace(" ", "_").replace("-", "_")
+        if text in PROJECT_TYPES:
+            fix("project_type", text, "enum")
+        elif text in NULL_STRINGS or text.strip("_") in NULL_STRINGS:
+            fix("project_type", None, "null")
+        else:
+            fix("project_type", None, "unknown_enum")
+
+    for field, low, high in (("sentiment_score", -1.0, 1.0), ("confidence", 0.0, 1.0)):
+        if field not in out:
+            continue
+        number = _to_float(out[field])
+        if number is None:
+            continue
+        if field == "confidence" and 1.0 < number <= 100.0:
+            number /= 100.0  # "85" meaning 85%
+        clamped = min(high, max(low, number))
+        fix(field, clamped, "clamped" if clamped != number else "float")
+
+    for field in LIST_FIELDS:
+        if field in out:
+            value = _to_list(out[field])
+            if value is not None:
+                fix(field, value, "list")
+
+    return out, fixes
+
+
+def repair_analysis(raw) -> tuple[dict | None, list[str]]:
+    """Raw LM text (or dict) → validated ReviewAnalysis dict, or None; plus the fixes applied."""
+    fixes = []
+    if isinstance(raw, dict):
+        data = raw
+    else:
+        try:
+            data = json.loads(raw)
+        except (TypeError, json.JSONDecodeError):
+            data, fixes = repair_json(raw)
+    if not isinstance(data, dict):
+        return None, fixes
+    data, coerced = coerce_fields({k: v for k, v in data.items() if k in ReviewAnalysis.model_fields})
+    try:
+        return ReviewAnalysis.model_validate(data).model_dump(), fixes + coerced
+    except ValidationError:
+        return None, fixes + coerced
+
+
+# =============================================================================
+# Logging
+# =============================================================================
+
+class RepairLog:
+    """JSONL log of raw vs repaired outputs plus running counts."""
+
+    def __init__(self, path: str | None = DEFAULT_LOG_PATH):
+        self.path = path
+        self.counts = {"clean": 0, "coerced": 0, "repaired": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, raw, repaired=None, fixes: list | None = None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if outcome == "clean" or self.path is None:
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "outcome": outcome,
+                    "fixes": fixes or [],
+                    "raw": raw,
+                    "repaired": repaired,
+                }, ensure_ascii=False, default=str) + "\n")
+
+    def print_summary(self):
+        c = self.counts
+        print(f"Repair: {c['clean']} clean, {c['coerced']} coerced, {c['repaired']} repaired, "
+              f"{c['failed']} unrecoverable" + (f" (log: {self.path})" if self.path else ""))
+
+
+# =============================================================================
+# DSPy adapter
+# =============================================================================
+
+class RepairingChatAdapter(ChatAdapter):
+    """ChatAdapter that coerces output fields and repairs unparsable completions locally."""
+
+    def __init__(self, log: RepairLog | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.log = log or RepairLog()
+
+    def parse(self, signature, completion: str) -> dict:
+        try:
+            fields = super().parse(signature, completion)
+        except (AdapterParseError, ValueError):
+            fields = self._recover(signature, completion)
+            if fields is None:
+                self.log.record("failed", completion)
+                raise
+            fields, fixes = fields
+            self.log.record("repaired", completion, fields, fixes)
+            return fields
+
+        coerced, fixes = coerce_fields(fields)
+        coerced = self._signature_values(signature, coerced)
+        # Drop no-op fixes (e.g. "null" → None → "null")
+        fixes = [fix for fix in fixes if coerced.get(fix.split(":")[0]) != fields.get(fix.split(":")[0])]
+        if fixes:
+            self.log.record("coerced", completion, coerced, fixes)
+        else:
+            self.log.record("clean", completion)
+        return coerced
+
+    def _recover(self, signature, completion: str) -> tuple[dict, list] | None:
+        """Fields from lenient [[ ## headers ## ]] or an embedded JSON object, if all required ones are there."""
+        found, fixes = {}, []
+        parts = _LENIENT_HEADER.split(completion)
+        for name, value in zip(parts[1::2], parts[2::2]):
+            if name in signature.output_fields and name not in found:
+                found[name] = value.strip()
+        if found:
+            fixes.append("lenient_headers")
+            for name, value in list(found.items()):
+                if name in LIST_FIELDS:
+                    found[name] = _to_list(value)
+
+        data, json_fixes = repair_json(completion)
+        if data:
+            fixes += json_fixes + ["json_body"]
+            for name, value in data.items():
+                found.setdefault(name, value)
+
+        required = [name for name in REQUIRED_FIELDS if name in signature.output_fields]
+        if any(name not in found for name in required):
+            return None
+
+        fields, coerced = coerce_fields(found)
+        for name in signature.output_fields:
+            if name not in fields:
+                default = ReviewAnalysis.model_fields.get(name)
+                fields[name] = default.get_default(call_default_factory=True) if default else ""
+                fixes.append(f"{name}:default")
+        return self._signature_values(signature, fields), fixes + coerced
+
+    @staticmethod
+    def _signature_values(signature, fields: dict) -> dict:
+        values = {name: fields.get(name) for name in signature.output_fields}
+        # Signatures declare project_type as a str; keep the "null" spelling the LM is asked for
+        if "project_type" in values and values["project_type"] is None:
+            values["project_type"] = "null"
+        return values
@@ -0,0 +1,211 @@
+"""
+Multi-review packing: tag K reviews per LM call.
+
+Every single-review call repeats the full signature instructions and the
+compiled demos. The packed tagger sends K reviews in one list-in/list-out
+call so that fixed prompt cost is paid once per K reviews. Each returned item
+is validated against ReviewAnalysis; items that are missing or fail to parse
+are retried one at a time with the regular single-review tagger.
+
+Usage:
+    python packed_tagger.py --k 1 5 10 20                # report on test_reviews_50.json
+    python packed_tagger.py --model gemma2:9b --k 5 10 --concurrency 2
+"""
+
+import json
+import time
+import argparse
+import threading
+
+import dspy
+from dspy import InputField, OutputField, Signature
+from dspy.utils.usage_tracker import track_usage
+from pydantic import BaseModel, ValidationError
+
+from batch_tagging import iter_tagged, tracked_usage
+from review_tagger import ReviewAnalysis, ReviewTaggingSignature, setup_lm
+from vector_metric import EVAL_50_METRIC, score_records
+
+PACKING_RULES = """
+You will receive several reviews at once, each with an integer `id`.
+Return `analyses` as a JSON list with exactly one object per review, in the same order.
+Each object has the review's `id` plus: detected_services, sentiment, sentiment_score, themes,
+project_type (null if unclear), mentions_price, mentions_timeline, confidence."""
+
+
+class ReviewItem(BaseModel):
+    """One review inside a packed request."""
+    id: int
+    review_text: str
+    rating: int = 5
+    reviewer_name: str = "Unknown"
+
+
+class PackedReviewTaggingSignature(Signature):
+    """Extract structured information from several contractor reviews at once."""
+
+    reviews: list[ReviewItem] = InputField(desc="Reviews to analyze, each with an id")
+    analyses: list[dict] = OutputField(desc="One analysis object per review, same order, each with its id")
+
+
+def make_packed_signature(base_signature=ReviewTaggingSignature):
+    """Packed signature whose instructions are the base signature's rules plus the packing contract."""
+    return PackedReviewTaggingSignature.with_instructions(base_signature.instructions + "\n" + PACKING_RULES)
+
+
+def validate_item(item) -> ReviewAnalysis | None:
+    """Validate one packed output item; None if it doesn't fit ReviewAnalysis."""
+    if not isinstance(item, dict):
+        return None
+    item = dict(item)
+    # The signature tells the LM to write null for unknown project types; some write it as a string
+    if str(item.get("project_type")).lower() in ("null", "none", ""):
+        item["project_type"] = None
+    try:
+        return ReviewAnalysis.model_validate(item)
+    except ValidationError:
+        return None
+
+
+def pack_demos(demos: list, k: int) -> list:
+    """Fold single-review demos into one packed demo of up to k reviews."""
+    demos = demos[:k]
+    if not demos:
+        return []
+    reviews = [
+        ReviewItem(id=i, review_text=d["review_text"], rating=d.get("rating", 5),
+                   reviewer_name=d.get("reviewer_name", "Unknown"))
+        for i, d in enumerate(demos)
+    ]
+    analyses = [
+        {"id": i, **{field: d.get(field) for field in ReviewAnalysis.model_fields if d.get(field) is not None}}
+        for i, d in enumerate(demos)
+    ]
+    return [dspy.Example(reviews=reviews, analyses=analyses).with_inputs("reviews")]
+
+
+class PackedReviewTagger(dspy.Module):
+    """Tags reviews K at a time, falling back to `single_tagger` per item on bad output."""
+
+    def __init__(self, single_tagger, k: int = 5, base_signature=ReviewTaggingSignature, demos: list | None = None):
+        super().__init__()
+        self.k = k
+        self.single_tagger = single_tagger
+        self.packed = dspy.ChainOfThought(make_packed_signature(base_signature))
+        self.packed.predict.demos = pack_demos(demos or [], k)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def forward(self, reviews: list[dict]) -> list:
+        """Tag one chunk of up to K reviews; returns one prediction per review."""
+        items = [
+            ReviewItem(id=i, review_text=r["review_text"], rating=r.get("rating", 5),
+                       reviewer_name=r.get("reviewer_name", "Unknown"))
+            for i, r in enumerate(reviews)
+        ]
+        try:
+            analyses = self.packed(reviews=items).analyses or []
+        except Exception:
+            analyses = []
+
+        by_id = {}
+        for item in analyses:
+            if isinstance(item, dict) and isinstance(item.get("id"), int) and (valid := validate_item(item)):
+                by_id[item["id"]] = valid
+
+        predictions = []
+        for i, review in enumerate(reviews):
+            if i in by_id:
+                predictions.append(dspy.Prediction(**by_id[i].model_dump()))
+                continue
+            with self._lock:
+                self.retries += 1
+            predictions.append(self.single_tagger(
+                review_text=review["review_text"],
+                rating=review.get("rating", 5),
+                reviewer_name=review.get("reviewer_name", "Unknown"),
+            ))
+        return predictions
+
+    def tag_many(self, reviews: list, concurrency: int = 4) -> list:
+        """Tag all reviews in chunks of K, with up to `concurrency` chunks in flight. Failed chunks yield None."""
+        chunks = [reviews[i:i + self.k] for i in range(0, len(reviews), self.k)]
+        predictions = []
+        for tagged in iter_tagged(self, chunks, concurrency=concurrency, inputs=lambda chunk: {"reviews": chunk}):
+            predictions.extend(tagged.prediction if tagged.ok else [None] * len(tagged.review))
+        return predictions
+
+
+# =============================================================================
+# K sweep report
+# =============================================================================
+
+def run_packing_report(model_name: str, k_values: list[int], concurrency: int = 4,
+                       demos_path: str | None = None, output_path: str = "packed_report.json"):
+    """Accuracy vs tokens-per-review vs throughput for each K on test_reviews_50.json."""
+    from eval_50_reviews import ReviewTagger as Eval50Tagger, ReviewTaggingSignature as Eval50Signature
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+
+    demos = []
+    if demos_path:
+        with open(demos_path, "r") as f:
+            demos = json.load(f)["tagger.predict"]["demos"]
+
+    # Fresh requests only: DSPy's own response cache would hide tokens and latency
+    lm = setup_lm(model_name).copy(cache=False)
+    dspy.configure(lm=lm)
+
+    print("\n" + "=" * 70)
+    print(f"Packed Tagging Report ({model_name}, {len(reviews)} reviews)")
+    print("=" * 70)
+
+    report = {"model": model_name, "reviews": len(reviews), "runs": []}
+    for k in k_values:
+        tagger = PackedReviewTagger(Eval50Tagger(), k=k, base_signature=Eval50Signature, demos=demos)
+        start = time.perf_counter()
+        with track_usage() as tracker:
+            predictions = tagger.tag_many(reviews, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        usage = tracked_usage(tracker)
+
+        scored = [(p, r["analysis_json"]) for p, r in zip(predictions, reviews) if p is not None]
+        accuracy = 0.0
+        if scored:
+            batch = score_records([p for p, _ in scored], [e for _, e in scored], EVAL_50_METRIC)
+            accuracy = batch.mean()["overall"]
+
+        run = {
+            "k": k,
+            "accuracy": accuracy,
+            "failed": len(reviews) - len(scored),
+            "item_retries": tagger.retries,
+            "lm_calls": usage["calls"],
+            "input_tokens_per_review": usage["input_tokens"] / len(reviews),
+            "output_tokens_per_review": usage["output_tokens"] / len(reviews),
+            "reviews_per_second": len(reviews) / elapsed if elapsed else 0.0,
+            "time": elapsed,
+        }
+        report["runs"].append(run)
+        print(f"  K={k:<3} accuracy {accuracy:.1%} | "
+              f"{run['input_tokens_per_review']:.0f} in / {run['output_tokens_per_review']:.0f} out tokens/review | "
+              f"{run['reviews_per_second']:.2f} reviews/s | {tagger.retries} retries")
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packed multi-review tagging report")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini or Ollama)")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10, 20], help="Reviews per LM call to compare")
+    parser.add_argument("--concurrency", type=int, default=4, help="Packed calls in flight")
+    parser.add_argument("--demos", help="Pack demos from a compiled program, e.g. ../../optimized_tagger.json")
+    parser.add_argument("--output", default="packed_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_packing_report(args.model, args.k, concurrency=args.concurrency, demos_path=args.demos,
+                       output_path=args.output)
@@ -0,0 +1,260 @@
+"""
+Parallel few-shot optimization driver with memoized predictions.
+
+Does what run_optimization does (baseline → BootstrapFewShot → optimized
+evaluation) but every phase runs on a worker pool, and every (program state,
+example) prediction goes through a PredictionCache memo keyed like
+CachedTagger's. A prediction is therefore computed once per run (or once
+ever, with the on-disk cache): the zero-shot candidate reuses the baseline
+evaluation and the final evaluation reuses the candidate search.
+
+Phases:
+    baseline    zero-shot ReviewTagger on the validation set
+    bootstrap   labeled-few-shot teacher on every training example; predictions
+                scoring >= --threshold become bootstrapped demos
+    candidates  zero-shot, labeled-only and --candidates random demo sets,
+                all (candidate, validation example) pairs in one pool
+    optimized   best candidate on the validation set (answered from the memo)
+
+Usage:
+    python parallel_optimize.py                              # TRAINING_DATA, 7/3 split
+    python parallel_optimize.py --pool test50 --candidates 8 --concurrency 16
+    python parallel_optimize.py --model fake/x?latency=0.2 --no-cache
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import asdict, dataclass
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+
+from batch_tagging import iter_tagged, tracked_usage
+from knn_demos import labeled_pool, to_demo
+from prediction_cache import DEFAULT_CACHE_PATH, PredictionCache, cache_key, print_cache_stats
+from review_tagger import ReviewTagger, create_dspy_examples, setup_lm
+from vector_metric import TAGGER_METRIC, score_records
+
+
+@dataclass
+class Phase:
+    """Wall clock, memo traffic and LM requests (DSPy cache hits excluded) of one optimization phase."""
+    name: str
+    seconds: float = 0.0
+    predictions: int = 0
+    lm_calls: int = 0
+    memo_hits: int = 0
+    memo_misses: int = 0
+    errors: int = 0
+
+
+class MemoizedRunner:
+    """Runs (program, example) pairs, answering repeats from a PredictionCache.
+
+    Identical pairs in flight at the same time are predicted once: later
+    callers wait for the first one and read its result from the memo. If it
+    failed, the next caller predicts the pair itself.
+    """
+
+    def __init__(self, memo: PredictionCache):
+        self.memo = memo
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, program, example):
+        inputs = example.inputs().toDict()
+        key = cache_key(program, dspy.settings.lm, inputs)
+        with self._lock:
+            running = self._inflight.get(key)
+            if running is None:
+                self._inflight[key] = threading.Event()
+        if running is not None:
+            running.wait()
+            return self(program, example)
+
+        try:
+            cached = self.memo.get(key)
+            if cached is not None:
+                return dspy.Prediction(**cached)
+            prediction = program(**inputs)
+            self.memo.put(key, prediction.toDict())
+            return prediction
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+
+def with_demos(program, demos: list):
+    """Copy of `program` with `demos` on every predictor."""
+    copy = program.deepcopy()
+    for _, predictor in copy.named_predictors():
+        predictor.demos = list(demos)
+    return copy
+
+
+def run_pairs(runner: MemoizedRunner, pairs: list, phase: Phase, concurrency: int) -> list:
+    """Predict every (program, example) pair concurrently; None where the call failed."""
+    stats_before = runner.memo.stats()
+    start = time.perf_counter()
+    predictions = []
+    with track_usage() as tracker:
+        for tagged in iter_tagged(runner, pairs, concurrency=concurrency,
+                                  inputs=lambda pair: {"program": pair[0], "example": pair[1]}):
+            predictions.append(tagged.prediction if tagged.ok else None)
+            phase.errors += not tagged.ok
+    stats_after = runner.memo.stats()
+    phase.seconds += time.perf_counter() - start
+    phase.predictions += len(pairs)
+    phase.memo_hits += stats_after["hits"] - stats_before["hits"]
+    phase.memo_misses += stats_after["misses"] - stats_before["misses"]
+    # Every real request, including ChatAdapter's JSON fallbacks; DSPy cache hits report no usage
+    phase.lm_calls += tracked_usage(tracker)["calls"]
+    return predictions
+
+
+def score(predictions: list, examples: list) -> list[float]:
+    """Per-example accuracy_metric score (0 for failed predictions)."""
+    ok = [i for i, p in enumerate(predictions) if p is not None]
+    scores = [0.0] * len(examples)
+    if ok:
+        batch = score_records([predictions[i] for i in ok], [examples[i] for i in ok], TAGGER_METRIC)
+        for i, value in zip(ok, batch.overall.tolist()):
+            scores[i] = value
+    return scores
+
+
+def load_split(pool: str, val_fraction: float = 0.3, seed: int = 0) -> tuple[list, list]:
+    """(trainset, valset). "training" keeps run_optimization's 7/3 split of TRAINING_DATA."""
+    if pool == "training":
+        examples = create_dspy_examples()
+        return examples[:7], examples[7:]
+    examples = [to_demo(item) for item in labeled_pool()]
+    random.Random(seed).shuffle(examples)
+    n_val = max(1, int(len(examples) * val_fraction))
+    return examples[n_val:], examples[:n_val]
+
+
+def run_parallel_optimization(
+    model_name: str = "gemini-2.0-flash",
+    pool: str = "training",
+    num_candidates: int = 6,
+    max_bootstrapped_demos: int = 4,
+    max_labeled_demos: int = 4,
+    threshold: float = 0.7,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    seed: int = 0,
+    output_path: str = "optimized_tagger.json",
+):
+    """Baseline, parallel bootstrap, parallel candidate search and final evaluation, timed per phase."""
+    print("\n" + "=" * 60)
+    print("Parallel Few-Shot Optimization")
+    print("=" * 60)
+
+    setup_lm(model_name)
+    train_set, val_set = load_split(pool, seed=seed)
+    print(f"\nTraining set: {len(train_set)} examples")
+    print(f"Validation set: {len(val_set)} examples")
+
+    # Without the on-disk cache the memo still spans all phases of this run
+    memo = PredictionCache(DEFAULT_CACHE_PATH if use_cache else ":memory:")
+    runner = MemoizedRunner(memo)
+    rng = random.Random(seed)
+    student = ReviewTagger()
+    phases = []
+
+    # 1. Baseline
+    phase = Phase("baseline")
+    phases.append(phase)
+    baseline_scores = score(run_pairs(runner, [(student, ex) for ex in val_set], phase, concurrency), val_set)
+    baseline_avg = sum(baseline_scores) / len(baseline_scores)
+    print(f"\n--- Baseline: {baseline_avg:.2%} ({phase.seconds:.1f}s) ---")
+
+    # 2. Bootstrap: a labeled-few-shot teacher per training example (without that example as a demo)
+    phase = Phase("bootstrap")
+    phases.append(phase)
+    teachers = []
+    for ex in train_set:
+        others = [other for other in train_set if other is not ex]
+        teachers.append(with_demos(student, rng.sample(others, min(max_labeled_demos, len(others)))))
+    teacher_predictions = run_pairs(runner, list(zip(teachers, train_set)), phase, concurrency)
+    bootstrapped = []
+    for ex, prediction, value in zip(train_set, teacher_predictions, score(teacher_predictions, train_set)):
+        if prediction is not None and value >= threshold:
+            bootstrapped.append(dspy.Example(augmented=True, **ex.inputs().toDict(), **prediction.toDict()))
+    print(f"\n--- Bootstrapped {len(bootstrapped)}/{len(train_set)} demos ({phase.seconds:.1f}s) ---")
+
+    # 3. Candidate demo sets, evaluated together
+    phase = Phase("candidates")
+    phases.append(phase)
+    candidates = {"zero-shot": [], "labeled": train_set[:max_labeled_demos]}
+    for i in range(num_candidates):
+        demos = rng.sample(bootstrapped, min(max_bootstrapped_demos, len(bootstrapped)))
+        used = {id(d) for d in demos}
+        fill = [ex for ex in rng.sample(train_set, len(train_set)) if id(ex) not in used]
+        candidates[f"bootstrap-{i}"] = demos + fill[:max(0, max_labeled_demos - len(demos))]
+    programs = {name: with_demos(student, demos) for name, demos in candidates.items()}
+
+    pairs = [(program, ex) for program in programs.values() for ex in val_set]
+    predictions = run_pairs(runner, pairs, phase, concurrency)
+    candidate_scores = {}
+    for j, name in enumerate(programs):
+        chunk = predictions[j * len(val_set):(j + 1) * len(val_set)]
+        candidate_scores[name] = sum(score(chunk, val_set)) / len(val_set)
+        print(f"  {name:<14} {candidate_scores[name]:.2%} ({len(candidates[name])} demos)")
+    best = max(candidate_scores, key=candidate_scores.get)
+
+    # 4. Optimized evaluation: every pair was already predicted in the candidate phase
+    phase = Phase("optimized")
+    phases.append(phase)
+    optimized_tagger = programs[best]
+    optimized_scores = score(run_pairs(runner, [(optimized_tagger, ex) for ex in val_set], phase, concurrency),
+                             val_set)
+    optimized_avg = sum(optimized_scores) / len(optimized_scores)
+
+    print("\n" + "=" * 60)
+    print(f"BEST: {best} | Baseline {baseline_avg:.2%} → Optimized {optimized_avg:.2%} "
+          f"({optimized_avg - baseline_avg:+.2%})")
+    print("=" * 60)
+    print(f"\n{'Phase':<12} {'Time':>8} {'Predictions':>12} {'Memo hits':>10} {'Misses':>7} {'LM calls':>9} "
+          f"{'Errors':>7}")
+    for p in phases:
+        print(f"{p.name:<12} {p.seconds:>7.1f}s {p.predictions:>12} {p.memo_hits:>10} {p.memo_misses:>7} "
+              f"{p.lm_calls:>9} {p.errors:>7}")
+    print_cache_stats(memo)
+
+    optimized_tagger.save(output_path)
+    phases_path = os.path.splitext(output_path)[0] + "_phases.json"
+    with open(phases_path, "w") as f:
+        json.dump({"model": model_name, "pool": pool, "best": best, "baseline": baseline_avg,
+                   "optimized": optimized_avg, "candidates": candidate_scores,
+                   "phases": [asdict(p) for p in phases]}, f, indent=2)
+    print(f"\n✓ Saved optimized model to {output_path} (phase timings in {phases_path})")
+    return optimized_tagger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel few-shot optimization with memoized predictions")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--pool", choices=["training", "test50"], default="training",
+                        help="training = TRAINING_DATA 7/3 split; test50 = TRAINING_DATA + test_reviews_50, 70/30")
+    parser.add_argument("--candidates", type=int, default=6, help="Random bootstrapped demo sets to try")
+    parser.add_argument("--max-bootstrapped-demos", type=int, default=4)
+    parser.add_argument("--max-labeled-demos", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=0.7, help="Min teacher score to keep a demo")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--no-cache", action="store_true", help="Memoize in memory only (not prediction_cache)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="optimized_tagger.json", help="Where to save the best program")
+    args = parser.parse_args()
+
+    run_parallel_optimization(
+        args.model, pool=args.pool, num_candidates=args.candidates,
+        max_bootstrapped_demos=args.max_bootstrapped_demos, max_labeled_demos=args.max_labeled_demos,
+        threshold=args.threshold, concurrency=args.concurrency, use_cache=not args.no_cache,
+        seed=args.seed, output_path=args.output,
+    )
@@ -0,0 +1,201 @@
+"""
+Persistent, content-addressed prediction cache for ReviewTagger.
+
+Predictions are stored in a local SQLite file keyed by a hash of everything
+that can change the LM output: model name, temperature, the signature
+instructions and fields, the loaded demos, a non-default adapter (prompt
+layout) and the review inputs. Editing the prompt, swapping demos or changing
+the adapter therefore never returns a stale answer.
+
+Usage:
+    from prediction_cache import PredictionCache, CachedTagger
+
+    cache = PredictionCache("prediction_cache.sqlite", max_entries=100_000)
+    tagger = CachedTagger(ReviewTagger(), cache)
+    pred = tagger(review_text="...", rating=5, reviewer_name="Kayla")
+    print(cache.stats())
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import dspy
+
+DEFAULT_CACHE_PATH = "prediction_cache.sqlite"
+
+
+def _stable_json(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+
+
+def program_fingerprint(program) -> list:
+    """Describe every predictor's signature (instructions + fields) and demos."""
+    fingerprint = []
+    for name, predictor in program.named_predictors():
+        signature = predictor.signature
+        fields = [
+            [
+                field_name,
+                str(field.annotation),
+                (field.json_schema_extra or {}).get("__dspy_field_type"),
+                (field.json_schema_extra or {}).get("desc"),
+            ]
+            for field_name, field in signature.fields.items()
+        ]
+        demos = [demo.toDict() if hasattr(demo, "toDict") else dict(demo) for demo in predictor.demos]
+        entry = [name, signature.instructions, fields, demos]
+        # Predictors that call the LM differently (e.g. structured_output.StructuredPredict) say how
+        if getattr(predictor, "cache_fingerprint", None) is not None:
+            entry.append(predictor.cache_fingerprint)
+        fingerprint.append(entry)
+    # Wrappers that choose demos per call (e.g. knn_demos.KNNReviewTagger) describe how they choose them
+    extra = getattr(program, "cache_fingerprint", None)
+    if extra is not None:
+        fingerprint.append(extra)
+    return fingerprint
+
+
+def prompt_version(program) -> str:
+    """Short hash of the program fingerprint; changes whenever instructions, fields or demos change."""
+    return hashlib.sha256(_stable_json(program_fingerprint(program)).encode("utf-8")).hexdigest()[:12]
+
+
+def lm_fingerprint(lm) -> dict:
+    """Model name and sampling temperature of the LM that will answer."""
+    if lm is None:
+        return {"model": None, "temperature": None}
+    return {"model": lm.model, "temperature": lm.kwargs.get("temperature")}
+
+
+def adapter_fingerprint(adapter) -> dict | None:
+    """Class and settings of a configured adapter (None for DSPy's default ChatAdapter)."""
+    if adapter is None:
+        return None
+    return {"class": type(adapter).__name__, **(getattr(adapter, "cache_fingerprint", None) or {})}
+
+
+def cache_key(program, lm, inputs: dict, adapter=None) -> str:
+    """SHA-256 over the LM, adapter (default: the configured one), program fingerprint and review inputs."""
+    key = {
+        "lm": lm_fingerprint(lm),
+        "program": program_fingerprint(program),
+        "inputs": inputs,
+    }
+    adapter = adapter_fingerprint(adapter if adapter is not None else dspy.settings.adapter)
+    if adapter is not None:
+        # Only present for a swapped adapter, so keys cached under the default layout stay valid
+        key["adapter"] = adapter
+    payload = _stable_json(key)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """SQLite-backed prediction store with hit/miss counters and LRU eviction."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_last_used ON predictions(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE predictions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            existed = self._conn.execute("SELECT 1 FROM predictions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, _stable_json(value), now, now),
+            )
+            if not existed:
+                self._size += 1
+            if self._size > self.max_entries:
+                overflow = self._size - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+                self._size = self.max_entries
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions")
+            self._conn.commit()
+            self._size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedTagger(dspy.Module):
+    """Wraps a tagger so identical (LM, prompt, demos, inputs) calls are answered from disk."""
+
+    def __init__(self, tagger, cache: PredictionCache | None, enabled: bool = True):
+        super().__init__()
+        self.tagger = tagger
+        self.cache = cache
+        self.enabled = enabled and cache is not None
+
+    def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
+        inputs = {"review_text": review_text, "rating": rating, "reviewer_name": reviewer_name}
+        if not self.enabled:
+            return self.tagger(**inputs)
+
+        key = cache_key(self.tagger, dspy.settings.lm, inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dspy.Prediction(**cached)
+
+        prediction = self.tagger(**inputs)
+        self.cache.put(key, prediction.toDict())
+        return prediction
+
+
+def print_cache_stats(cache: PredictionCache | None):
+    """One-line cache summary for the end of an eval run."""
+    if cache is None:
+        return
+    s = cache.stats()
+    print(f"Cache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.0%} hit rate), "
+          f"{s['entries']}/{s['max_entries']} entries, {s['evictions']} evicted")
@@ -0,0 +1,235 @@
+"""
+Opt-in per-stage profiling of tagging runs via DSPy callbacks.
+
+StageProfiler is a dspy callback that times every module forward (e.g.
+ReviewTagger, ChainOfThought, Predict), adapter format (prompt building), LM
+call and adapter parse (output parsing). It also records the prompt and
+completion tokens of each LM call. Eval loops wrap their scoring in
+`stage("metric")`. Ollama responses carry server-side timings (see
+ollama_backend.py), so an Ollama LM call is split further into model load,
+prompt eval, generation and network/queue time.
+
+At the end of a run, the profiler prints per-stage percentiles and
+log-scale histograms. It writes a Chrome trace JSON (open it in
+chrome://tracing or https://ui.perfetto.dev) with one track per worker
+thread.
+
+Nothing is recorded unless a profiler is active:
+
+    with profiled("profile_trace.json"):
+        run_evaluation(...)
+
+Usage:
+    python eval_50_reviews.py --models gemma2:9b --profile profile_trace.json
+    python review_tagger.py --compare --models "fake/x?latency=0.05" --profile profile_trace.json
+"""
+
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+import dspy
+import numpy as np
+from dspy.utils.callback import BaseCallback
+
+# Histogram buckets: powers of two from 0.125 ms to ~4.4 min
+BUCKET_EDGES_MS = [0.125 * 2 ** i for i in range(22)]
+SERVER_STAGES = (("load", "lm.load"), ("prompt_eval", "lm.prompt_eval"), ("eval", "lm.generate"))
+
+_ACTIVE = None
+
+
+class StageProfiler(BaseCallback):
+    """Collects timed spans (stage, start, duration, thread, tokens) from DSPy callbacks and stage()."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._open = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ spans
+
+    def _thread(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads) + 1)
+
+    def begin(self, key, stage: str, **extra):
+        self._open[key] = (stage, time.perf_counter(), self._thread(), extra)
+
+    def end(self, key, **args) -> dict | None:
+        opened = self._open.pop(key, None)
+        if opened is None:
+            return None
+        stage, start, thread, extra = opened
+        span = {"stage": stage, "start": start - self.origin, "duration": time.perf_counter() - start,
+                "thread": thread, "args": args}
+        with self._lock:
+            self.spans.append(span)
+        if extra.get("lm") is not None:
+            self._lm_details(span, extra)
+        return span
+
+    def add(self, stage: str, start: float, duration: float, thread: int, **args):
+        with self._lock:
+            self.spans.append({"stage": stage, "start": start, "duration": duration, "thread": thread, "args": args})
+
+    # -------------------------------------------------------------- callbacks
+
+    def on_module_start(self, call_id, instance, inputs):
+        self.begin(call_id, f"module.{type(instance).__name__}")
+
+    def on_module_end(self, call_id, outputs, exception=None):
+        self.end(call_id, error=type(exception).__name__ if exception else None)
+
+    def on_adapter_format_start(self, call_id, instance, inputs):
+        self.begin(call_id, "format")
+
+    def on_adapter_format_end(self, call_id, outputs, exception=None):
+        self.end(call_id)
+
+    def on_adapter_parse_start(self, call_id, instance, inputs):
+        self.begin(call_id, "parse")
+
+    def on_adapter_parse_end(self, call_id, outputs, exception=None):
+        self.end(call_id, error=type(exception).__name__ if exception else None)
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self.begin(call_id, "lm", lm=instance, messages=inputs.get("messages"), prompt=inputs.get("prompt"))
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        self.end(call_id, error=type(exception).__name__ if exception else None)
+
+    def _lm_details(self, span: dict, extra: dict):
+        """Tokens (and Ollama server timings) from the LM's history entry for this call."""
+        lm, messages = extra["lm"], extra["messages"]
+        entry = None
+        for candidate in reversed(getattr(lm, "history", [])[-64:]):
+            if candidate.get("messages") is messages and candidate.get("prompt") is extra["prompt"]:
+                entry = candidate
+                break
+        if entry is None:
+            return
+        usage = entry.get("usage") or {}
+        span["args"].update(model=entry.get("model"), prompt_tokens=usage.get("prompt_tokens"),
+                            completion_tokens=usage.get("completion_tokens"))
+
+        timing = getattr(entry.get("response"), "server_timing", None)
+        if not timing:
+            return
+        cursor = span["start"]
+        for key, stage in SERVER_STAGES:
+            seconds = timing.get(key) or 0.0
+            self.add(stage, cursor, seconds, span["thread"])
+            cursor += seconds
+        self.add("lm.network", cursor, max(0.0, span["duration"] - timing.get("total", 0.0)), span["thread"])
+
+    # ---------------------------------------------------------------- reports
+
+    def summary(self) -> dict:
+        """Per stage: calls, total/mean/percentile seconds, histogram counts and token totals."""
+        by_stage = {}
+        for span in self.spans:
+            by_stage.setdefault(span["stage"], []).append(span)
+        result = {}
+        for stage, spans in sorted(by_stage.items()):
+            durations = np.array([s["duration"] for s in spans])
+            prompt_tokens = sum(s["args"].get("prompt_tokens") or 0 for s in spans)
+            completion_tokens = sum(s["args"].get("completion_tokens") or 0 for s in spans)
+            result[stage] = {
+                "calls": len(spans),
+                "errors": sum(1 for s in spans if s["args"].get("error")),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "p50": float(np.percentile(durations, 50)),
+                "p90": float(np.percentile(durations, 90)),
+                "p99": float(np.percentile(durations, 99)),
+                "max": float(durations.max()),
+                "histogram_ms": np.histogram(durations * 1000, bins=[0] + BUCKET_EDGES_MS + [math.inf])[0].tolist(),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            }
+        return result
+
+    def print_summary(self, histograms: bool = True):
+        summary = self.summary()
+        if not summary:
+            print("Profile: no spans recorded")
+            return
+        print(f"\n{'Stage':<28} {'Calls':>6} {'Total':>9} {'Mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'Tokens in/out':>16}")
+        for stage, s in summary.items():
+            tokens = f"{s['prompt_tokens']}/{s['completion_tokens']}" if s["prompt_tokens"] else ""
+            print(f"{stage:<28} {s['calls']:>6} {s['total']:>8.2f}s {s['mean'] * 1000:>7.1f}ms "
+                  f"{s['p50'] * 1000:>7.1f}ms {s['p90'] * 1000:>7.1f}ms {s['p99'] * 1000:>7.1f}ms {tokens:>16}")
+        if not histograms:
+            return
+        labels = ["<0.125ms"] + [f"<{edge:g}ms" if edge < 1000 else f"<{edge / 1000:g}s" for edge in BUCKET_EDGES_MS[1:]]
+        labels.append(f">={BUCKET_EDGES_MS[-1] / 1000:g}s")
+        for stage, s in summary.items():
+            counts = s["histogram_ms"]
+            nonzero = [i for i, c in enumerate(counts) if c]
+            peak = max(counts)
+            print(f"\n  {stage}")
+            for i in range(nonzero[0], nonzero[-1] + 1):
+                print(f"    {labels[i]:>10} {'█' * math.ceil(30 * counts[i] / peak) if counts[i] else '':<30} {counts[i]}")
+
+    def chrome_trace(self) -> dict:
+        """Trace Event Format: one complete ("X") event per span, microseconds, one tid per worker thread."""
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": f"worker {tid}"}}
+                  for tid in sorted(set(self._threads.values()))]
+        for span in sorted(self.spans, key=lambda s: s["start"]):
+            events.append({
+                "name": span["stage"],
+                "cat": span["stage"].split(".")[0],
+                "ph": "X",
+                "ts": round(span["start"] * 1e6, 1),
+                "dur": round(span["duration"] * 1e6, 1),
+                "pid": 1,
+                "tid": span["thread"],
+                "args": {k: v for k, v in span["args"].items() if v is not None},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+@contextmanager
+def stage(name: str, **args):
+    """Time a block as `name` on the active profiler (no-op when none is active)."""
+    profiler = _ACTIVE
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add(name, start - profiler.origin, time.perf_counter() - start, profiler._thread(), **args)
+
+
+@contextmanager
+def profiled(trace_path: str | None = "profile_trace.json", histograms: bool = True):
+    """Profile everything inside the block; prints the summary and writes the trace at the end."""
+    global _ACTIVE
+    profiler = StageProfiler()
+    previous = dspy.settings.get("callbacks", []) or []
+    dspy.configure(callbacks=[*previous, profiler])
+    _ACTIVE = profiler
+    try:
+        yield profiler
+    finally:
+        _ACTIVE = None
+        dspy.configure(callbacks=previous)
+        print("\n" + "=" * 70)
+        print("Profile")
+        print("=" * 70)
+        profiler.print_summary(histograms=histograms)
+        if trace_path:
+            profiler.save_trace(trace_path)
+            print(f"\n✓ Trace saved to {trace_path} (open in chrome://tracing or ui.perfetto.dev)")
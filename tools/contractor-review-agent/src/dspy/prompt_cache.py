@@ -0,0 +1,270 @@
+"""
+Prompt-prefix layout and provider context caching for the tagger.
+
+Every tagging call resends the same static block: the signature instructions
+and field layout plus the compiled demos. By default ChatAdapter sends those
+demos as alternating user/assistant turns. PrefixCacheAdapter instead folds
+them into one system message, so a call is exactly
+
+    [system: instructions + field layout + demos]   byte-identical on every call
+    [user:   this review's inputs]                  the only part that changes
+
+Providers can then reuse the static prefix:
+
+- Gemini: when the prefix is long enough for an explicit cache
+  (GEMINI_MIN_CACHE_TOKENS), the system message is marked with
+  cache_control. litellm then stores it once as cachedContent and later
+  calls reference it. Shorter prefixes rely on Gemini's implicit prefix
+  caching, which needs nothing but a stable prefix. In both cases the cached
+  part shows up as usage.prompt_tokens_details.cached_tokens.
+- Ollama: the runner keeps each slot's KV cache and skips prompt eval for the
+  longest matching token prefix, as long as the model stays loaded
+  (keep_alive, see ollama_backend.py). Ollama only counts the tokens it
+  evaluated, so this report estimates the cached tokens from how far
+  prompt_eval_count drops compared with the uncached run.
+
+Demos that change per review (knn_demos.py) are part of the prefix and
+defeat caching. The adapter counts distinct prefixes, so this shows up in the
+stats.
+
+The report tags test_reviews_50.json twice. The uncached run puts a
+per-request nonce at the start of the prompt, so no provider can reuse a
+prefix. The cached run uses the stable layout. The report compares input,
+cached and uncached tokens and latency.
+
+Usage:
+    python prompt_cache.py                                          # gemini-2.0-flash
+    python prompt_cache.py --model gemma2:9b --demos ../../optimized_tagger.json
+    python prompt_cache.py --model "fake/x?latency=0.05"
+    python eval_50_reviews.py --prefix-cache                        # stable layout in a normal eval
+"""
+
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from collections import Counter
+
+import dspy
+import numpy as np
+from dspy.adapters import ChatAdapter
+from dspy.utils.usage_tracker import track_usage
+
+from batch_tagging import tag_many
+from review_tagger import setup_lm
+from vector_metric import EVAL_50_METRIC, score_records
+
+# Smallest prefix worth an explicit cachedContent (Gemini rejects shorter ones); ~4 chars per token
+GEMINI_MIN_CACHE_TOKENS = 4096
+DEMOS_HEADER = "Worked examples of this task follow. Each shows the inputs and then the expected response."
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def is_gemini(lm) -> bool:
+    return str(getattr(lm, "model", "")).startswith("gemini/")
+
+
+class PrefixCacheAdapter(ChatAdapter):
+    """ChatAdapter that puts instructions and demos in one byte-stable system message ahead of the inputs."""
+
+    def __init__(self, cache_control: bool = False, min_cache_tokens: int = GEMINI_MIN_CACHE_TOKENS,
+                 nonce: bool = False):
+        super().__init__()
+        self.cache_control = cache_control
+        self.min_cache_tokens = min_cache_tokens
+        self.nonce = nonce
+        # The prompt layout changes the LM's answer; prediction_cache folds this into its key
+        self.cache_fingerprint = {"cache_control": cache_control, "min_cache_tokens": min_cache_tokens,
+                                  "nonce": nonce}
+        self.prefixes = Counter()
+        self.prefix_tokens = 0
+        self.marked = 0
+        self._lock = threading.Lock()
+
+    def format(self, signature, demos, inputs):
+        messages = super().format(signature, demos, inputs)
+        system, turns, request = messages[0], messages[1:-1], messages[-1]
+
+        prefix = system["content"]
+        if turns:
+            examples = []
+            for i in range(0, len(turns) - 1, 2):
+                examples.append(f"--- Example {i // 2 + 1} ---\n\n{turns[i]['content']}\n\n{turns[i + 1]['content']}")
+            prefix = "\n\n".join([prefix, DEMOS_HEADER, *examples])
+        if self.nonce:
+            # Uncached baseline: a unique first line means no provider can match a cached prefix
+            prefix = f"Request {uuid.uuid4().hex[:12]}\n\n{prefix}"
+
+        tokens = estimate_tokens(prefix)
+        mark = self.cache_control and tokens >= self.min_cache_tokens
+        with self._lock:
+            self.prefixes[hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]] += 1
+            self.prefix_tokens = tokens
+            self.marked += mark
+
+        layout = {"role": "system", "content": prefix}
+        if mark:
+            layout["cache_control"] = {"type": "ephemeral"}
+        return [layout, request]
+
+    def summary(self) -> dict:
+        return {"calls": sum(self.prefixes.values()), "distinct_prefixes": len(self.prefixes),
+                "prefix_tokens": self.prefix_tokens, "explicit_cache_calls": self.marked}
+
+    def print_summary(self):
+        s = self.summary()
+        stable = "byte-stable" if s["distinct_prefixes"] == 1 else f"{s['distinct_prefixes']} distinct"
+        print(f"Prompt prefix: ~{s['prefix_tokens']} tokens, {stable} over {s['calls']} calls"
+              + (f", {s['explicit_cache_calls']} marked for explicit caching" if s["explicit_cache_calls"] else ""))
+
+
+def prefix_cache_adapter(lm, nonce: bool = False) -> PrefixCacheAdapter:
+    """The stable-prefix adapter for `lm`; Gemini also gets explicit cachedContent for long prefixes."""
+    return PrefixCacheAdapter(cache_control=is_gemini(lm) and not nonce, nonce=nonce)
+
+
+def print_prefix_stats(adapter):
+    """Print prefix stats if `adapter` is a PrefixCacheAdapter."""
+    if isinstance(adapter, PrefixCacheAdapter):
+        adapter.print_summary()
+
+
+def cached_tokens(usage: dict) -> int | None:
+    """Provider-reported cached prompt tokens from a usage dict (None when the provider reports none)."""
+    details = usage.get("prompt_tokens_details")
+    if details is None:
+        return None
+    value = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return value or 0
+
+
+def cache_usage(tracker) -> dict:
+    """Calls, input/output tokens and provider-reported cached tokens recorded by a track_usage() tracker."""
+    usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "reported": False}
+    for tokens in (entry for model_entries in tracker.usage_data.values() for entry in model_entries):
+        usage["calls"] += 1
+        usage["input_tokens"] += tokens.get("prompt_tokens") or 0
+        usage["output_tokens"] += tokens.get("completion_tokens") or 0
+        cached = cached_tokens(tokens)
+        if cached is not None:
+            usage["cached_tokens"] += cached
+            usage["reported"] = True
+    return usage
+
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def run_prefix_cache_report(model_name: str = "gemini-2.0-flash", demos_path: str | None = None,
+                            concurrency: int = 4, output_path: str = "prefix_cache_report.json") -> dict:
+    """Tag test_reviews_50.json without and with a cacheable prefix; compare tokens and latency."""
+    from eval_50_reviews import ReviewTagger as Eval50Tagger
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+
+    program = Eval50Tagger()
+    demos = []
+    if demos_path:
+        with open(demos_path, "r") as f:
+            demos = [dspy.Example(**demo) for demo in json.load(f)["tagger.predict"]["demos"]]
+        for _, predictor in program.named_predictors():
+            predictor.demos = demos
+
+    # Fresh requests only: DSPy's own response cache would hide tokens and latency
+    lm = setup_lm(model_name).copy(cache=False)
+    dspy.configure(lm=lm)
+    previous_adapter = dspy.settings.adapter
+
+    print("\n" + "=" * 70)
+    print(f"Prefix Cache Report ({model_name}, {len(reviews)} reviews, {len(demos)} demos)")
+    print("=" * 70)
+
+    report = {"model": model_name, "reviews": len(reviews), "runs": {}}
+    try:
+        for mode in ("uncached", "cached"):
+            adapter = prefix_cache_adapter(lm, nonce=mode == "uncached")
+            dspy.configure(adapter=adapter)
+            start = time.perf_counter()
+            with track_usage() as tracker:
+                # One call first so an explicit cache is created once, not by every worker at the same time
+                results = tag_many(program, reviews[:1], concurrency=1) + \
+                    tag_many(program, reviews[1:], concurrency=concurrency)
+            wall_time = time.perf_counter() - start
+            usage = cache_usage(tracker)
+
+            latencies = np.array([r.elapsed for r in results])
+            scored = [(r.prediction, review["analysis_json"]) for r, review in zip(results, reviews) if r.ok]
+            accuracy = score_records([p for p, _ in scored], [e for _, e in scored],
+                                     EVAL_50_METRIC).mean()["overall"] if scored else 0.0
+            run = {
+                **usage,
+                **adapter.summary(),
+                "accuracy": accuracy,
+                "errors": len(reviews) - len(scored),
+                "latency_mean": float(latencies.mean()),
+                "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p90": float(np.percentile(latencies, 90)),
+                "wall_time": wall_time,
+            }
+            report["runs"][mode] = run
+            print(f"\n  {mode}: {run['calls']} calls, {run['input_tokens']} input tokens, "
+                  f"{run['latency_mean'] * 1000:.0f}ms mean / {run['latency_p90'] * 1000:.0f}ms p90, "
+                  f"accuracy {accuracy:.1%}")
+            adapter.print_summary()
+    finally:
+        dspy.configure(adapter=previous_adapter)
+
+    uncached, cached = report["runs"]["uncached"], report["runs"]["cached"]
+    if cached["reported"]:
+        cached_input, source = cached["cached_tokens"], "reported by the provider"
+    else:
+        # Ollama (and the fake LM) only count evaluated tokens; the nonce line adds ~5 tokens per call
+        nonce_tokens = 5 * uncached["calls"]
+        cached_input = max(0, uncached["input_tokens"] - nonce_tokens - cached["input_tokens"])
+        source = "estimated from the drop in evaluated prompt tokens"
+    total_input = cached["input_tokens"] if cached["reported"] else cached["input_tokens"] + cached_input
+    report["comparison"] = {
+        "input_tokens": total_input,
+        "cached_input_tokens": cached_input,
+        "uncached_input_tokens": total_input - cached_input,
+        "cached_fraction": cached_input / total_input if total_input else 0.0,
+        "cached_tokens_source": source,
+        "latency_mean_saved": uncached["latency_mean"] - cached["latency_mean"],
+        "latency_p50_saved": uncached["latency_p50"] - cached["latency_p50"],
+        "speedup": uncached["latency_mean"] / cached["latency_mean"] if cached["latency_mean"] else 0.0,
+    }
+
+    c = report["comparison"]
+    print(f"\n{'':<24} {'Uncached':>12} {'Cached':>12}")
+    print(f"{'Input tokens':<24} {uncached['input_tokens']:>12} {total_input:>12}")
+    print(f"{'  of which cached':<24} {uncached['cached_tokens']:>12} {cached_input:>12}")
+    print(f"{'Mean latency':<24} {uncached['latency_mean'] * 1000:>10.0f}ms {cached['latency_mean'] * 1000:>10.0f}ms")
+    print(f"{'p50 latency':<24} {uncached['latency_p50'] * 1000:>10.0f}ms {cached['latency_p50'] * 1000:>10.0f}ms")
+    print(f"{'p90 latency':<24} {uncached['latency_p90'] * 1000:>10.0f}ms {cached['latency_p90'] * 1000:>10.0f}ms")
+    print(f"{'Wall time':<24} {uncached['wall_time']:>11.2f}s {cached['wall_time']:>11.2f}s")
+    print(f"\n{c['cached_fraction']:.0%} of input tokens served from cache ({source}); "
+          f"{c['latency_mean_saved'] * 1000:+.0f}ms mean latency saved ({c['speedup']:.2f}x)")
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cached vs uncached prompt-prefix report on test_reviews_50.json")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--demos", help="Demos from a compiled program, e.g. ../../optimized_tagger.json")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max LM calls in flight")
+    parser.add_argument("--output", default="prefix_cache_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_prefix_cache_report(args.model, demos_path=args.demos, concurrency=args.concurrency,
+                            output_path=args.output)
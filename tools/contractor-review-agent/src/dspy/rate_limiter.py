@@ -0,0 +1,265 @@
+"""
+Client-side rate limiting with AIMD concurrency for Gemini calls.
+
+RateLimitedLM wraps a dspy LM. Every call first takes one request from a
+requests-per-minute token bucket and an estimated token count from a
+tokens-per-minute bucket, then a slot from an AIMD concurrency limit:
+
+    success  -> limit += 1 / limit           (about +1 per round of calls)
+    429      -> limit *= 0.5, at most once per round of calls
+
+A throttled call is retried after the server's Retry-After (or
+exponential backoff). Every worker pauses until then, not only the one that
+got the 429. The inner LM's own retries are turned off so throttling is
+seen here. The limiter state is shared per model, so copies of the LM and
+separate setup_lm calls all draw on the same quota.
+
+Quotas default to GEMINI_RPM / GEMINI_TPM from the environment, read when a
+model's limiter is first created (so after load_dotenv()).
+
+setup_lm wraps every Gemini LM (and fake LMs that simulate 429s) this way.
+
+Usage:
+    from rate_limiter import rate_limited
+
+    lm = rate_limited(dspy.LM("gemini/gemini-2.0-flash"), "gemini-2.0-flash")
+    ...
+    lm.limiter.print_summary()
+"""
+
+import os
+import re
+import time
+import random
+import threading
+
+import dspy
+
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+
+_RETRY_DELAY = re.compile(r"(?:retryDelay\W+|retry in )(\d+(?:\.\d+)?)s", re.IGNORECASE)
+_THROTTLE_TEXT = ("429", "resource_exhausted", "rate limit", "ratelimit", "quota")
+
+
+def is_throttle(error: Exception) -> bool:
+    """True for 429 / quota responses (litellm, google-genai or fake_lm)."""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _THROTTLE_TEXT)
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Server-suggested wait: a retry_after attribute, a Retry-After header, or Gemini's retryDelay."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        match = _RETRY_DELAY.search(str(error))
+        value = match.group(1) if match else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _usage_tokens(response) -> int | None:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+    total = get("total_tokens")
+    if total is None:
+        total = (get("prompt_tokens") or 0) + (get("completion_tokens") or 0)
+    return total
+
+
+def _estimate_tokens(prompt, messages) -> int:
+    text = prompt or "".join(str(m.get("content", "")) for m in messages or [])
+    return len(text) // 4
+
+
+class TokenBucket:
+    """Refills at `per_minute / 60` per second up to `capacity`; acquire blocks until there is enough."""
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Take `amount` (capped at capacity), sleeping as needed; returns seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def adjust(self, amount: float):
+        """Give back (positive) or charge (negative) tokens after the fact; may go into debt."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AIMDConcurrency:
+    """A semaphore whose limit grows by ~1 per round of successes and halves on throttling."""
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, decrease: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self.peak = float(initial)
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a slot; returns the start time to pass back to release()."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, outcome: str, started: float):
+        """outcome is "success", "throttle" or "error" (errors leave the limit alone)."""
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == "success":
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self.peak = max(self.peak, self.limit)
+            elif outcome == "throttle" and started > self._last_decrease:
+                # Calls sent before the last decrease were sized for the old limit; don't punish twice
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = time.monotonic()
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """Request/token buckets, AIMD concurrency and a shared Retry-After pause for one model."""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None, initial_concurrency: int = 4,
+                 max_concurrency: int = 64, max_retries: int = 6):
+        # Read at construction, not import, so values load_dotenv() sets after the import still apply
+        rpm = rpm if rpm is not None else int(os.getenv("GEMINI_RPM", DEFAULT_RPM))
+        tpm = tpm if tpm is not None else int(os.getenv("GEMINI_TPM", DEFAULT_TPM))
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AIMDConcurrency(initial=initial_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "gave_up": 0, "queue_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def call(self, fn, estimated_tokens: int):
+        """Run fn() under the limits, retrying throttled calls."""
+        for attempt in range(self.max_retries + 1):
+            waited = max(0.0, self.paused_until - time.monotonic())
+            if waited:
+                time.sleep(waited)
+            waited += self.requests.acquire(1) + self.tokens.acquire(estimated_tokens)
+            self._count("queue_seconds", waited)
+
+            started = self.concurrency.acquire()
+            try:
+                response = fn()
+            except Exception as e:
+                if not is_throttle(e):
+                    self.concurrency.release("error", started)
+                    raise
+                self.concurrency.release("throttle", started)
+                self._count("throttled")
+                if attempt == self.max_retries:
+                    self._count("gave_up")
+                    raise
+                self._count("retries")
+                delay = retry_after_seconds(e)
+                self.pause(delay if delay is not None else min(2 ** attempt, 60) * random.uniform(0.5, 1.0))
+                continue
+
+            self.concurrency.release("success", started)
+            self._count("calls")
+            actual = _usage_tokens(response)
+            if actual is not None:
+                self.tokens.adjust(estimated_tokens - actual)
+            return response
+
+    def summary(self) -> dict:
+        return {**self.stats, "concurrency_limit": round(self.concurrency.limit, 2),
+                "peak_concurrency_limit": round(self.concurrency.peak, 2)}
+
+    def print_summary(self):
+        s = self.summary()
+        print(f"Rate limit: {s['calls']} calls, {s['throttled']} throttled ({s['retries']} retried, "
+              f"{s['gave_up']} gave up), concurrency limit {s['concurrency_limit']:.1f} "
+              f"(peak {s['peak_concurrency_limit']:.1f}), {s['queue_seconds']:.1f}s waited for quota across workers")
+
+
+def print_rate_limit_stats(lm):
+    """Print the limiter summary if `lm` is rate limited."""
+    if isinstance(lm, RateLimitedLM):
+        lm.limiter.print_summary()
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def rate_limited(lm, model_name: str):
+    """Wrap a cloud LM with the shared limiter for `model_name`."""
+    return RateLimitedLM(lm, limiter_for(model_name))
+
+
+def limiter_for(model_name: str, **kwargs) -> RateLimiter:
+    """The process-wide RateLimiter for a model (created on first use with `kwargs`)."""
+    with _LIMITERS_LOCK:
+        if model_name not in _LIMITERS:
+            _LIMITERS[model_name] = RateLimiter(**kwargs)
+        return _LIMITERS[model_name]
+
+
+class RateLimitedLM(dspy.BaseLM):
+    """Wraps an LM so every request goes through a RateLimiter."""
+
+    def __init__(self, lm, limiter: RateLimiter | None = None, expected_output_tokens: int = 400):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False, num_retries=0, **lm.kwargs)
+        # Throttling must surface here, not be retried inside the wrapped LM
+        self.lm = lm.copy(num_retries=0)
+        self.limiter = limiter or limiter_for(lm.model)
+        self.expected_output_tokens = expected_output_tokens
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        estimated = _estimate_tokens(prompt, messages) + self.expected_output_tokens
+        return self.limiter.call(lambda: self.lm.forward(prompt=prompt, messages=messages, **kwargs), estimated)
+
+    def copy(self, **kwargs):
+        """Copy with updated settings on the wrapped LM; the limiter stays shared."""
+        new_instance = super().copy(**kwargs)
+        new_instance.lm = self.lm.copy(**kwargs)
+        return new_instance
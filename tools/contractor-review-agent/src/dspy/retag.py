@@ -0,0 +1,289 @@
+"""
+Incremental re-tagging driven by a content/prompt/model manifest.
+
+The manifest (SQLite) keeps, per review id (the batch custom_id), the hashes
+the current analysis was produced from plus the analysis itself:
+
+    text_hash       review text, rating and reviewer name
+    prompt_version  prediction_cache.prompt_version of the tagger (signature
+                    instructions, fields, demos); in raw mode a hash of the
+                    batch prompt template with the review cut out
+    model           model name and temperature
+
+A retag run streams the batch input, compares each review's current hash
+tuple with the manifest and sends only new or changed reviews to the LM.
+Everything else is left as it is. A failed review keeps its old entry and
+hashes, so the next run retries it. --export writes the manifest out as
+stream_batch-style JSONL keyed by custom_id. After a run (or --export) the
+manifest's analyses are summarized on a ReviewStore (review_store.py), which
+--store also saves.
+
+Usage:
+    python retag.py --dry-run                         # how many reviews changed, and why
+    python retag.py --model gemini-2.0-flash           # re-tag only what changed
+    python retag.py --mode raw --model gemma2:9b --limit 500
+    python retag.py --export batch_output.jsonl        # current analyses for every review
+    python retag.py --export batch_output.jsonl --store store/batch_output
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from itertools import chain
+from typing import Iterator
+
+import dspy
+
+from batch_tagging import iter_tagged
+from fake_lm import FakeLM
+from ollama_backend import OllamaLM
+from prediction_cache import CachedTagger, PredictionCache, lm_fingerprint, print_cache_stats, prompt_version
+from review_store import ReviewStore
+from review_tagger import ReviewTagger, setup_lm
+from stream_batch import (DEFAULT_INPUT, REVIEW_PATTERN, RawLMTagger, dspy_inputs, raw_inputs, read_requests,
+                          to_analysis)
+
+DEFAULT_MANIFEST_PATH = "retag_manifest.sqlite"
+HASH_FIELDS = ("text_hash", "prompt_version", "model")
+REASONS = ("new", "text_changed", "prompt_changed", "model_changed")
+
+
+def _hash(value) -> str:
+    payload = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def text_hash(request: dict) -> str:
+    """Hash of the review inputs (the whole prompt when the review block can't be found)."""
+    if "review_text" in request:
+        return _hash([request["review_text"], request["rating"], request["reviewer_name"]])
+    return _hash(request.get("prompt"))
+
+
+def raw_prompt_version(request: dict) -> str:
+    """Hash of the batch prompt template: the prompt with the trailing review block removed."""
+    prompt = request.get("prompt", "")
+    match = REVIEW_PATTERN.search(prompt)
+    return _hash([prompt[:match.start()] if match else prompt, request.get("temperature")])
+
+
+def model_version(lm) -> str:
+    fingerprint = lm_fingerprint(lm)
+    return f"{fingerprint['model']}@{fingerprint['temperature']}"
+
+
+def planned_lm(model_name: str):
+    """An unconnected LM with the model name and temperature setup_lm(model_name) configures.
+
+    Enough for model_version, so --dry-run (or a run with nothing to do) needs
+    no API key, Ollama server or warmup.
+    """
+    if model_name.startswith("fake/"):
+        return FakeLM(model_name)
+    if model_name.startswith("ollama/") or ":" in model_name:
+        return OllamaLM(model_name)
+    return dspy.LM(model=f"gemini/{model_name}", temperature=0.1)
+
+
+def change_reason(old: dict | None, new: dict) -> str | None:
+    """Why a review needs re-tagging (first differing hash), or None when it is up to date."""
+    if old is None:
+        return "new"
+    for field, reason in zip(HASH_FIELDS, REASONS[1:]):
+        if old[field] != new[field]:
+            return reason
+    return None
+
+
+class ReviewManifest:
+    """SQLite table of review id → hashes + analysis, with batched commits."""
+
+    def __init__(self, path: str = DEFAULT_MANIFEST_PATH, commit_every: int = 200):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            " review_id TEXT PRIMARY KEY,"
+            " text_hash TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " analysis TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def hashes(self) -> dict:
+        """{review_id: {text_hash, prompt_version, model}} for every review in the manifest."""
+        with self._lock:
+            rows = self._conn.execute("SELECT review_id, text_hash, prompt_version, model FROM reviews").fetchall()
+        return {row[0]: dict(zip(HASH_FIELDS, row[1:])) for row in rows}
+
+    def put(self, review_id: str, hashes: dict, analysis: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reviews (review_id, text_hash, prompt_version, model, analysis, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (review_id, *(hashes[field] for field in HASH_FIELDS), json.dumps(analysis, ensure_ascii=False),
+                 time.time()),
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def records(self) -> Iterator[dict]:
+        """{"custom_id", "analysis"} for every review, streamed in insertion order."""
+        with self._lock:
+            for review_id, analysis in self._conn.execute("SELECT review_id, analysis FROM reviews ORDER BY rowid"):
+                yield {"custom_id": review_id, "analysis": json.loads(analysis)}
+
+    def export(self, output_path: str) -> int:
+        """Write the records as JSONL; returns the count."""
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            for record in self.records():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def store(self) -> ReviewStore:
+        """Every current analysis as a ReviewStore, for column-wise aggregation and scoring."""
+        return ReviewStore.from_records(self.records())
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+def changed_requests(requests: Iterator[dict], known: dict, current_hashes, counts: Counter) -> Iterator[dict]:
+    """Yield only requests whose hash tuple differs from the manifest, counting reasons as it goes."""
+    for request in requests:
+        if request.get("custom_id") is None:
+            counts["unparsable"] += 1
+            continue
+        hashes = current_hashes(request)
+        reason = change_reason(known.get(request["custom_id"]), hashes)
+        counts[reason or "unchanged"] += 1
+        if reason is not None:
+            request["hashes"] = hashes
+            yield request
+
+
+def run_retag(
+    input_path: str = DEFAULT_INPUT,
+    manifest_path: str = DEFAULT_MANIFEST_PATH,
+    model_name: str = "gemini-2.0-flash",
+    mode: str = "dspy",
+    concurrency: int = 8,
+    limit: int | None = None,
+    use_cache: bool = True,
+    dry_run: bool = False,
+    store_dir: str | None = None,
+) -> Counter:
+    """Re-tag the reviews in `input_path` whose text, prompt version or model changed since the last run."""
+    manifest = ReviewManifest(manifest_path)
+    known = manifest.hashes()
+
+    cache = None
+    if mode == "raw":
+        tagger, inputs = RawLMTagger(), raw_inputs
+        version = raw_prompt_version
+    else:
+        program = ReviewTagger()
+        current_prompt = prompt_version(program)
+        cache = PredictionCache() if use_cache and not dry_run else None
+        tagger, inputs = CachedTagger(program, cache), dspy_inputs
+        version = lambda request: current_prompt
+    current_model = model_version(planned_lm(model_name))
+
+    def current_hashes(request):
+        return {"text_hash": text_hash(request), "prompt_version": version(request), "model": current_model}
+
+    counts = Counter()
+    todo = changed_requests(read_requests(input_path, limit=limit), known, current_hashes, counts)
+    print(f"Manifest {manifest_path}: {len(known)} reviews tagged before this run")
+
+    first = None if dry_run else next(todo, None)
+    if dry_run:
+        for _ in todo:
+            pass
+    else:
+        try:
+            if first is not None:
+                # Set up (and warm up) the LM only once there is something to tag
+                lm = setup_lm(model_name)
+                if model_version(lm) != current_model:
+                    raise ValueError(f"setup_lm configured {model_version(lm)}, expected {current_model}")
+                todo = chain([first], todo)
+            for tagged in iter_tagged(tagger, todo, concurrency=concurrency, inputs=inputs):
+                request = tagged.review
+                if tagged.ok:
+                    manifest.put(request["custom_id"], request["hashes"], to_analysis(tagged.prediction))
+                    counts["retagged"] += 1
+                else:
+                    counts["errors"] += 1
+                done = counts["retagged"] + counts["errors"]
+                if done % 100 == 0:
+                    print(f"  {done} re-tagged ({counts['errors']} errors)")
+        except KeyboardInterrupt:
+            print("\nInterrupted; finished reviews are saved, rerun to continue")
+        finally:
+            manifest.flush()
+
+    changed = sum(counts[reason] for reason in REASONS)
+    reasons = ", ".join(f"{counts[reason]} {reason}" for reason in REASONS)
+    print(f"\n{counts['unchanged']} unchanged, {changed} to re-tag ({reasons})"
+          + (f", {counts['unparsable']} unparsable lines" if counts["unparsable"] else ""))
+    if not dry_run:
+        print(f"✓ {counts['retagged']} re-tagged, {counts['errors']} errors → {manifest_path}")
+        print_cache_stats(cache)
+        save_store(manifest, store_dir)
+    manifest.close()
+    return counts
+
+
+def save_store(manifest: ReviewManifest, store_dir: str | None = None):
+    """Summarize the manifest's analyses on a ReviewStore and save it to `store_dir`, if given."""
+    store = manifest.store()
+    store.print_summary()
+    if store_dir:
+        store.save(store_dir)
+        print(f"✓ Store → {store_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-tag only reviews whose text, prompt or model changed")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Gemini batch request JSONL")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Manifest SQLite path")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--mode", choices=["dspy", "raw"], default="dspy",
+                        help="dspy: ReviewTagger; raw: send the batch prompt verbatim")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--limit", type=int, help="Only look at the first N input lines")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    parser.add_argument("--dry-run", action="store_true", help="Count changed reviews without tagging")
+    parser.add_argument("--export", metavar="PATH", help="Write the manifest's analyses as JSONL and exit")
+    parser.add_argument("--store", metavar="DIR", help="Also save the analyses as a ReviewStore (review_store.py)")
+    args = parser.parse_args()
+
+    if args.export:
+        manifest = ReviewManifest(args.manifest)
+        print(f"✓ {manifest.export(args.export)} analyses → {args.export}")
+        save_store(manifest, args.store)
+        manifest.close()
+    else:
+        run_retag(args.input, args.manifest, model_name=args.model, mode=args.mode, concurrency=args.concurrency,
+                  limit=args.limit, use_cache=not args.no_cache, dry_run=args.dry_run, store_dir=args.store)
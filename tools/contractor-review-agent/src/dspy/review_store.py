@@ -0,0 +1,448 @@
+"""
+Compact columnar store for review analyses (and optionally review texts).
+
+A 65K-review run held as dspy.Example / ReviewAnalysis / dicts costs
+hundreds of MB. ReviewStore keeps one NumPy array per field instead:
+
+    sentiment, project_type     int8 codes (SENTIMENTS / PROJECT_TYPES, -1 missing or invalid)
+    mentions_price/_timeline    bits of one uint8 `flags` column (FLAG_* masks)
+    sentiment_score, confidence float32 (NaN missing)
+    detected_services, themes   interned: a vocabulary plus CSR offsets/ids (int32)
+    ids, review texts           one UTF-8 blob plus int64 offsets
+    rating                      int8 (-1 unknown)
+
+save() writes one .npy per column plus store.json (counts and vocabularies).
+load() memory-maps the columns, so opening a store costs nearly nothing and
+pages are read only as columns are touched.
+
+Aggregation (summary) and evaluation (score_stores, scored with
+vector_metric.score_columns) work on whole columns without building
+per-review objects. Scores are widened back to float64 through their
+shortest decimal form (0.9f → 0.9), so with normalized enums the results
+match the scalar metrics row for row.
+
+Usage:
+    python review_store.py build batch_output.jsonl store/batch_output     # stream_batch / retag output
+    python review_store.py build test_reviews_50.json store/test50          # ground truth + texts
+    python review_store.py summary store/batch_output
+    python review_store.py score store/predictions store/test50             # rows aligned by id
+
+    store = ReviewStore.load("store/batch_output")
+    store.summary()["sentiment"]       # {"positive": 51234, ...}
+"""
+
+import os
+import sys
+import json
+import argparse
+from array import array
+from typing import Iterable, Literal, get_args, get_origin
+
+import numpy as np
+
+from review_tagger import ReviewAnalysis
+from vector_metric import EVAL_50_METRIC, Columns, MetricSpec, score_columns
+
+
+def _choices(annotation) -> tuple:
+    """Values a Literal (or Optional Literal) annotation allows; None comes last when it is optional."""
+    if get_origin(annotation) is Literal:
+        return get_args(annotation)
+    return tuple(value for arg in get_args(annotation)
+                 for value in ((None,) if arg is type(None) else _choices(arg)))
+
+
+SENTIMENTS = _choices(ReviewAnalysis.model_fields["sentiment"].annotation)
+PROJECT_TYPES = _choices(ReviewAnalysis.model_fields["project_type"].annotation)
+FLAG_PRICE = 1
+FLAG_TIMELINE = 2
+FLAG_PRESENT = 4   # the row has an analysis (not an error)
+
+COLUMNS = ("id_offsets", "id_blob", "text_offsets", "text_blob", "rating", "sentiment", "project_type", "flags",
+           "sentiment_score", "confidence", "services_offsets", "services_ids", "themes_offsets", "themes_ids")
+_SENTIMENT_CODES = {name: code for code, name in enumerate(SENTIMENTS)}
+_PROJECT_CODES = {name: code for code, name in enumerate(PROJECT_TYPES)}
+
+
+def _widen(column) -> np.ndarray:
+    """float32 → float64 through the shortest decimal repr, so 0.9f comes back as 0.9, not 0.8999999761."""
+    return np.asarray(column).astype(str).astype(np.float64)
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class _Strings:
+    """Append-only UTF-8 blob + offsets."""
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, text: str | None):
+        self.blob += (text or "").encode("utf-8")
+        self.offsets.append(len(self.blob))
+
+
+class _Interned:
+    """CSR lists of interned strings."""
+
+    def __init__(self, vocab: dict):
+        self.vocab = vocab
+        self.offsets = array("i", [0])
+        self.ids = array("i")
+
+    def append(self, values):
+        if isinstance(values, list):
+            for value in values:
+                self.ids.append(self.vocab.setdefault(str(value), len(self.vocab)))
+        self.offsets.append(len(self.ids))
+
+
+class StoreBuilder:
+    """Streams rows into compact arrays; finish() returns the ReviewStore."""
+
+    def __init__(self, keep_text: bool = True):
+        self.keep_text = keep_text
+        self.ids = _Strings()
+        self.texts = _Strings()
+        self.rating = array("b")
+        self.sentiment = array("b")
+        self.project_type = array("b")
+        self.flags = array("B")
+        self.sentiment_score = array("f")
+        self.confidence = array("f")
+        self.services = _Interned({})
+        self.themes = _Interned({})
+
+    def append(self, review_id: str, analysis: dict | None, review_text: str | None = None,
+               rating: int | None = None):
+        self.ids.append(str(review_id))
+        if self.keep_text:
+            self.texts.append(review_text)
+        self.rating.append(int(rating) if rating is not None else -1)
+
+        analysis = analysis or {}
+        sentiment = analysis.get("sentiment")
+        self.sentiment.append(_SENTIMENT_CODES.get(sentiment.lower() if isinstance(sentiment, str) else None, -1))
+        project = analysis.get("project_type")
+        project = None if project in (None, "null", "none", "") else str(project).lower()
+        self.project_type.append(_PROJECT_CODES.get(project, -1))
+
+        flags = FLAG_PRESENT if analysis else 0
+        if str(analysis.get("mentions_price")).lower() in ("true", "1", "yes"):
+            flags |= FLAG_PRICE
+        if str(analysis.get("mentions_timeline")).lower() in ("true", "1", "yes"):
+            flags |= FLAG_TIMELINE
+        self.flags.append(flags)
+
+        self.sentiment_score.append(_float(analysis.get("sentiment_score")))
+        self.confidence.append(_float(analysis.get("confidence")))
+        self.services.append(analysis.get("detected_services"))
+        self.themes.append(analysis.get("themes"))
+
+    def finish(self) -> "ReviewStore":
+        def np_array(values, dtype):
+            return np.frombuffer(values, dtype=dtype).copy() if len(values) else np.zeros(0, dtype=dtype)
+
+        columns = {
+            "id_offsets": np_array(self.ids.offsets, np.int64),
+            "id_blob": np.frombuffer(bytes(self.ids.blob), dtype=np.uint8),
+            "text_offsets": np_array(self.texts.offsets, np.int64) if self.keep_text else np.zeros(1, np.int64),
+            "text_blob": np.frombuffer(bytes(self.texts.blob), dtype=np.uint8),
+            "rating": np_array(self.rating, np.int8),
+            "sentiment": np_array(self.sentiment, np.int8),
+            "project_type": np_array(self.project_type, np.int8),
+            "flags": np_array(self.flags, np.uint8),
+            "sentiment_score": np_array(self.sentiment_score, np.float32),
+            "confidence": np_array(self.confidence, np.float32),
+            "services_offsets": np_array(self.services.offsets, np.int32),
+            "services_ids": np_array(self.services.ids, np.int32),
+            "themes_offsets": np_array(self.themes.offsets, np.int32),
+            "themes_ids": np_array(self.themes.ids, np.int32),
+        }
+        return ReviewStore(columns, list(self.services.vocab), list(self.themes.vocab))
+
+
+class ReviewStore:
+    """Column arrays for N reviews; see the module docstring for the layout."""
+
+    def __init__(self, columns: dict, services_vocab: list, themes_vocab: list):
+        self.columns = columns
+        self.services_vocab = services_vocab
+        self.themes_vocab = themes_vocab
+        self._index = None
+
+    def __len__(self) -> int:
+        return len(self.columns["sentiment"])
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns", {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    # ---------------------------------------------------------------- building
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "ReviewStore":
+        """From {"custom_id", "analysis" | "error"} records (an error or missing analysis is an empty row)."""
+        builder = StoreBuilder(keep_text=False)
+        for record in records:
+            builder.append(record["custom_id"], record.get("analysis"))
+        return builder.finish()
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "ReviewStore":
+        """From stream_batch / retag output, one record per line, streamed."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_records(json.loads(line) for line in f if line.strip())
+
+    @classmethod
+    def from_reviews(cls, reviews, keep_text: bool = True) -> "ReviewStore":
+        """From test_reviews_50-style dicts (id, review_text, rating, analysis_json)."""
+        builder = StoreBuilder(keep_text=keep_text)
+        for review in reviews:
+            builder.append(review["id"], review.get("analysis_json"), review.get("review_text"), review.get("rating"))
+        return builder.finish()
+
+    # ------------------------------------------------------------------- disk
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(column))
+        with open(os.path.join(directory, "store.json"), "w") as f:
+            json.dump({"rows": len(self), "services_vocab": self.services_vocab,
+                       "themes_vocab": self.themes_vocab}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ReviewStore":
+        with open(os.path.join(directory, "store.json"), "r") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name in COLUMNS}
+        return cls(columns, meta["services_vocab"], meta["themes_vocab"])
+
+    def nbytes(self) -> int:
+        vocab = sum(len(s.encode("utf-8")) for s in self.services_vocab + self.themes_vocab)
+        return sum(column.nbytes for column in self.columns.values()) + vocab
+
+    # ----------------------------------------------------------------- access
+
+    def review_id(self, i: int) -> str:
+        start, end = self.id_offsets[i], self.id_offsets[i + 1]
+        return bytes(self.id_blob[start:end]).decode("utf-8")
+
+    def review_text(self, i: int) -> str | None:
+        if len(self.text_offsets) <= i + 1:
+            return None
+        start, end = self.text_offsets[i], self.text_offsets[i + 1]
+        return bytes(self.text_blob[start:end]).decode("utf-8")
+
+    def index_of(self, review_id: str) -> int:
+        """Row of a review id (builds an id → row dict on first use)."""
+        if self._index is None:
+            self._index = {self.review_id(i): i for i in range(len(self))}
+        return self._index[review_id]
+
+    def row(self, i: int) -> dict | None:
+        """One analysis as a dict, for spot checks; bulk code should use the columns."""
+        flags = int(self.flags[i])
+        if not flags & FLAG_PRESENT:
+            return None
+
+        def strings(offsets, ids, vocab):
+            return [vocab[j] for j in ids[offsets[i]:offsets[i + 1]]]
+
+        sentiment, project = int(self.sentiment[i]), int(self.project_type[i])
+        return {
+            "detected_services": strings(self.services_offsets, self.services_ids, self.services_vocab),
+            "sentiment": SENTIMENTS[sentiment] if sentiment >= 0 else None,
+            "sentiment_score": float(_widen(self.sentiment_score[i:i + 1])[0]),
+            "themes": strings(self.themes_offsets, self.themes_ids, self.themes_vocab),
+            "project_type": PROJECT_TYPES[project] if project >= 0 else None,
+            "mentions_price": bool(flags & FLAG_PRICE),
+            "mentions_timeline": bool(flags & FLAG_TIMELINE),
+            "confidence": float(_widen(self.confidence[i:i + 1])[0]),
+        }
+
+    def take(self, rows: np.ndarray) -> "ReviewStore":
+        """A new in-memory store with only `rows`, in that order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = {name: np.asarray(self.columns[name])[rows]
+                   for name in ("rating", "sentiment", "project_type", "flags", "sentiment_score", "confidence")}
+        for prefix in ("id", "text"):
+            offsets, blob = np.asarray(self.columns[f"{prefix}_offsets"]), self.columns[f"{prefix}_blob"]
+            if prefix == "text" and len(offsets) <= 1:
+                columns["text_offsets"], columns["text_blob"] = np.zeros(1, np.int64), np.zeros(0, np.uint8)
+                continue
+            columns[f"{prefix}_offsets"], columns[f"{prefix}_blob"] = _take_ragged(offsets, blob, rows)
+        for prefix in ("services", "themes"):
+            offsets, ids = _take_ragged(np.asarray(self.columns[f"{prefix}_offsets"]), self.columns[f"{prefix}_ids"],
+                                        rows)
+            columns[f"{prefix}_offsets"], columns[f"{prefix}_ids"] = offsets.astype(np.int32), ids
+        return ReviewStore(columns, self.services_vocab, self.themes_vocab)
+
+    # ------------------------------------------------------------ aggregation
+
+    def summary(self) -> dict:
+        """Corpus-level counts and rates computed on the columns."""
+        present = (self.flags & FLAG_PRESENT) > 0
+        n = int(present.sum())
+        sentiment = np.bincount(self.sentiment[present] + 1, minlength=len(SENTIMENTS) + 1)
+        project = np.bincount(self.project_type[present] + 1, minlength=len(PROJECT_TYPES) + 1)
+        services = np.bincount(self.services_ids, minlength=len(self.services_vocab))
+        themes = np.bincount(self.themes_ids, minlength=len(self.themes_vocab))
+
+        def top(counts, vocab, k=10):
+            order = np.argsort(counts)[::-1][:k]
+            return {vocab[j]: int(counts[j]) for j in order if counts[j]}
+
+        return {
+            "rows": len(self),
+            "analyses": n,
+            "errors": len(self) - n,
+            "sentiment": {**{name: int(sentiment[code + 1]) for code, name in enumerate(SENTIMENTS)},
+                          "invalid": int(sentiment[0])},
+            "project_type": {**{str(name): int(project[code + 1]) for code, name in enumerate(PROJECT_TYPES)},
+                             "invalid": int(project[0])},
+            "mentions_price_rate": float(((self.flags[present] & FLAG_PRICE) > 0).mean()) if n else 0.0,
+            "mentions_timeline_rate": float(((self.flags[present] & FLAG_TIMELINE) > 0).mean()) if n else 0.0,
+            "mean_sentiment_score": float(np.nanmean(self.sentiment_score[present])) if n else 0.0,
+            "mean_confidence": float(np.nanmean(self.confidence[present])) if n else 0.0,
+            "top_services": top(services, self.services_vocab),
+            "top_themes": top(themes, self.themes_vocab),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\nStore: {summary['analyses']}/{summary['rows']} analyses ({summary['errors']} errors), "
+              f"{self.nbytes() / 1e6:.2f} MB in columns")
+        print("  sentiment:     " + ", ".join(f"{name} {count}" for name, count in summary["sentiment"].items()))
+        print("  project_type:  " + ", ".join(f"{name} {count}" for name, count in summary["project_type"].items()))
+        print(f"  mentions price {summary['mentions_price_rate']:.1%}, timeline {summary['mentions_timeline_rate']:.1%}"
+              f" | mean sentiment score {summary['mean_sentiment_score']:.2f}, "
+              f"confidence {summary['mean_confidence']:.2f}")
+        print("  top services:  " + ", ".join(f"{name} {count}" for name, count in summary["top_services"].items()))
+
+    def metric_columns(self, side: str, services_map: np.ndarray, vocab_size: int) -> Columns:
+        """vector_metric.Columns for this store; `services_map` maps local service ids to shared ids."""
+        invalid = -1 if side == "pred" else -2
+        present = (self.flags & FLAG_PRESENT) > 0
+        sentiment = np.where(self.sentiment >= 0, self.sentiment, invalid).astype(np.int32)
+        project = np.where(self.project_type >= 0, self.project_type, invalid).astype(np.int32)
+
+        rows = np.repeat(np.arange(len(self)), np.diff(self.services_offsets))
+        bits = np.zeros((len(self), max(1, (vocab_size + 7) // 8) * 8), dtype=bool)
+        if len(rows):
+            bits[rows, services_map[self.services_ids]] = True
+        return Columns(
+            sentiment=np.where(present, sentiment, invalid).astype(np.int32),
+            sentiment_score=_widen(self.sentiment_score),
+            project_type=np.where(present, project, invalid).astype(np.int32),
+            project_alias=np.zeros(len(self), dtype=bool),   # None / "null" share one code already
+            mentions_price=(self.flags & FLAG_PRICE) > 0,
+            mentions_timeline=(self.flags & FLAG_TIMELINE) > 0,
+            services=np.packbits(bits, axis=1),
+            services_valid=present,
+            confidence=_widen(self.confidence),
+        )
+
+
+def _take_ragged(offsets: np.ndarray, values, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gather CSR rows into new (offsets, values)."""
+    lengths = offsets[rows + 1] - offsets[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    if not new_offsets[-1]:
+        return new_offsets, np.zeros(0, dtype=np.asarray(values).dtype)
+    starts = np.repeat(offsets[rows] - new_offsets[:-1], lengths)
+    return new_offsets, np.asarray(values)[starts + np.arange(new_offsets[-1])]
+
+
+def align(pred: ReviewStore, true: ReviewStore) -> tuple[ReviewStore, ReviewStore]:
+    """Both stores restricted to the ids they share, in `true`'s order."""
+    rows_true, rows_pred = [], []
+    for i in range(len(true)):
+        review_id = true.review_id(i)
+        try:
+            rows_pred.append(pred.index_of(review_id))
+            rows_true.append(i)
+        except KeyError:
+            continue
+    return pred.take(rows_pred), true.take(rows_true)
+
+
+def score_stores(pred: ReviewStore, true: ReviewStore, spec: MetricSpec = EVAL_50_METRIC):
+    """vector_metric.BatchScores for row-aligned prediction and ground-truth stores."""
+    if len(pred) != len(true):
+        raise ValueError(f"{len(pred)} predictions vs {len(true)} ground-truth rows; align() them first")
+    shared = {}
+    maps = []
+    for store in (pred, true):
+        maps.append(np.array([shared.setdefault(s.lower(), len(shared)) for s in store.services_vocab] or [0],
+                             dtype=np.int64))
+    scores = score_columns(pred.metric_columns("pred", maps[0], len(shared)),
+                           true.metric_columns("true", maps[1], len(shared)), spec)
+    # Rows without a prediction (errors) get no credit at all
+    missing = (pred.flags & FLAG_PRESENT) == 0
+    for column in (*scores.fields.values(), scores.overall):
+        column[missing] = 0.0
+    return scores
+
+
+def _dict_bytes(value) -> int:
+    """Deep sys.getsizeof of parsed JSON, for comparing against the columns."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_dict_bytes(k) + _dict_bytes(v) for k, v in value.items())
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(_dict_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def estimate_dict_bytes(path: str, rows: int, sample: int = 1000) -> int:
+    """Approximate memory of `rows` records held as Python dicts, from the first `sample` records of `path`."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line, _ in zip(f, range(sample)) if line.strip()]
+        else:
+            records = json.load(f)[:sample]
+    return _dict_bytes(records) * rows // max(1, len(records))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact columnar review/analysis store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build a store from output JSONL or test_reviews_50-style JSON")
+    build.add_argument("source")
+    build.add_argument("directory")
+    build.add_argument("--no-text", action="store_true", help="Don't keep review texts (JSON sources)")
+    summary = sub.add_parser("summary", help="Corpus counts and rates")
+    summary.add_argument("directory")
+    score = sub.add_parser("score", help="EVAL_50 metric of a prediction store against a ground-truth store")
+    score.add_argument("predictions")
+    score.add_argument("ground_truth")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.source.endswith(".jsonl"):
+            store = ReviewStore.from_jsonl(args.source)
+        else:
+            with open(args.source, "r") as f:
+                store = ReviewStore.from_reviews(json.load(f), keep_text=not args.no_text)
+        store.save(args.directory)
+        print(f"✓ {len(store)} rows → {args.directory} ({store.nbytes() / 1e6:.2f} MB in columns, "
+              f"~{estimate_dict_bytes(args.source, len(store)) / 1e6:.1f} MB as Python dicts)")
+    elif args.command == "summary":
+        print(json.dumps(ReviewStore.load(args.directory).summary(), indent=2))
+    else:
+        pred, true = align(ReviewStore.load(args.predictions), ReviewStore.load(args.ground_truth))
+        scores = score_stores(pred, true)
+        print(f"{len(true)} aligned reviews")
+        for name, value in scores.mean().items():
+            print(f"  {name:<20} {value:.1%}")
@@ -8,11 +8,21 @@ Usage:
     python review_tagger.py --optimize      # Run optimization
     python review_tagger.py --evaluate      # Evaluate current model
     python review_tagger.py --test          # Test on a single review
+    python review_tagger.py --compare --concurrency 4   # Compare models, 4 calls in flight
+    python review_tagger.py --evaluate --rule-fields    # Price/timeline flags from keyword rules
+    python review_tagger.py --benchmark                 # Latency/throughput/cost per model
+    python review_tagger.py --compare --models "fake/x?latency=0.05&malformed_rate=0.05"   # Offline
+    python review_tagger.py --compare --sequential      # Drop statistically dominated models early
+    python review_tagger.py --evaluate --profile profile_trace.json   # Per-stage timings + Chrome trace
+    python review_tagger.py --evaluate --mode predict   # Fast mode: no reasoning (see distill.py)
+    python review_tagger.py --evaluate --mode structured   # Schema-constrained JSON (see structured_output.py)
+    python review_tagger.py --optimize      # also trains on active_labels.json (see active_learning.py)
 """
 
 import os
 import json
 import argparse
+from contextlib import nullcontext
 from typing import Literal
 from dotenv import load_dotenv
 
@@ -21,6 +31,15 @@ from dspy import InputField, OutputField, Signature
 from dspy.teleprompt import BootstrapFewShot
 from pydantic import BaseModel, Field
 
+from batch_tagging import tag_many
+from fake_lm import FakeLM
+from keyword_rules import RuleAgreement, apply_rule_fields, slim_signature
+from ollama_backend import print_ollama_stats, setup_ollama
+from rate_limiter import print_rate_limit_stats, rate_limited
+from prediction_cache import CachedTagger, PredictionCache, print_cache_stats
+from profiler import profiled, stage
+from vector_metric import TAGGER_METRIC, score_tagged
+
 # Load environment variables
 load_dotenv()
 
@@ -77,13 +96,40 @@ class ReviewTaggingSignature(Signature):
 # DSPy Module (implements the tagging logic)
 # =============================================================================
 
+# "cot" generates a reasoning paragraph before the fields; "predict" answers the fields directly;
+# "structured" gets the fields as JSON constrained by the ReviewAnalysis schema (structured_output.py)
+TAGGER_MODES = ("cot", "predict", "structured")
+
+
+def make_predictor(signature, mode: str = "cot"):
+    """ChainOfThought, plain Predict or schema-constrained StructuredPredict over `signature`."""
+    if mode not in TAGGER_MODES:
+        raise ValueError(f"Unknown tagger mode {mode!r} (expected one of {', '.join(TAGGER_MODES)})")
+    if mode == "structured":
+        from structured_output import StructuredPredict
+        return StructuredPredict(signature)
+    return dspy.ChainOfThought(signature) if mode == "cot" else dspy.Predict(signature)
+
+
 class ReviewTagger(dspy.Module):
-    """DSPy module for review tagging with Chain-of-Thought reasoning."""
+    """DSPy module for review tagging; the predictor depends on `mode` (see TAGGER_MODES).
+
+    The default mode="cot" uses Chain-of-Thought reasoning for ambiguous cases.
+    With rule_fields=True the LM gets a slimmer signature without
+    mentions_price/mentions_timeline, which are filled in by keyword_rules.
+    With mode="predict" no reasoning is generated (fewer output tokens, lower
+    latency); distill.py gives such a tagger demos from the CoT tagger.
+    mode="structured" gets the fields as JSON constrained by the ReviewAnalysis
+    schema (see structured_output.py).
+    """
 
-    def __init__(self):
+    def __init__(self, rule_fields: bool = False, mode: str = "cot"):
         super().__init__()
-        # Use ChainOfThought for better reasoning on ambiguous cases
-        self.tagger = dspy.ChainOfThought(ReviewTaggingSignature)
+        self.rule_fields = rule_fields
+        self.mode = mode
+        signature = slim_signature(ReviewTaggingSignature) if rule_fields else ReviewTaggingSignature
+        # ChainOfThought by default; Predict or StructuredPredict for the faster modes
+        self.tagger = make_predictor(signature, mode)
 
     def forward(self, review_text: str, rating: int = 5, reviewer_name: str = "Unknown"):
         """Tag a single review."""
@@ -92,6 +138,8 @@ class ReviewTagger(dspy.Module):
             rating=rating,
             reviewer_name=reviewer_name
         )
+        if self.rule_fields:
+            apply_rule_fields(result, review_text)
         return result
 
 
@@ -234,10 +282,22 @@ TRAINING_DATA = [
 ]
 
 
-def create_dspy_examples():
-    """Convert training data to DSPy Example objects."""
+# Labels for reviews picked by active_learning.py, in the TRAINING_DATA format
+ACTIVE_LABELS_PATH = "active_labels.json"
+
+
+def load_active_labels(path: str = ACTIVE_LABELS_PATH) -> list[dict]:
+    """Labeled picks from active_learning.py (empty if none yet)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def create_dspy_examples(items: list[dict] | None = None):
+    """Convert training data (default TRAINING_DATA) to DSPy Example objects."""
     examples = []
-    for item in TRAINING_DATA:
+    for item in TRAINING_DATA if items is None else items:
         # Convert project_type None to "null" string for DSPy
         project_type = item["project_type"] if item["project_type"] else "null"
 
@@ -298,7 +358,7 @@ def accuracy_metric(example, prediction, trace=None):
         true_price = bool(example.mentions_price)
         if pred_price == true_price:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 5. Mentions timeline (boolean)
@@ -307,7 +367,7 @@ def accuracy_metric(example, prediction, trace=None):
         true_timeline = bool(example.mentions_timeline)
         if pred_timeline == true_timeline:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 6. Services detection (partial credit)
@@ -323,7 +383,7 @@ def accuracy_metric(example, prediction, trace=None):
             union = len(pred_services | true_services)
             score += intersection / union if union > 0 else 0
         # One empty, one not = 0 points
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     # 7. Confidence reasonableness (0.5-1.0 range)
@@ -331,7 +391,7 @@ def accuracy_metric(example, prediction, trace=None):
         conf = float(prediction.confidence)
         if 0.5 <= conf <= 1.0:
             score += 1.0
-    except:
+    except (AttributeError, TypeError, ValueError):
         pass
 
     return score / max_score
@@ -341,22 +401,33 @@ def accuracy_metric(example, prediction, trace=None):
 # Main Functions
 # =============================================================================
 
+def classify_model(model_name: str) -> str:
+    """Label a model name as cloud, local (Ollama) or fake."""
+    if model_name.startswith("fake/"):
+        return "fake"
+    if model_name.startswith("ollama/") or ":" in model_name:
+        return "local"
+    return "cloud"
+
+
 def setup_lm(model_name: str = "gemini-2.0-flash"):
-    """Configure DSPy to use a language model (Gemini or Ollama)."""
+    """Configure DSPy to use a language model (Gemini, Ollama, or the offline fake LM)."""
+
+    # Offline fake LM for benchmarking, e.g. "fake/default?latency=0.1&error_rate=0.02"
+    if model_name.startswith("fake/"):
+        lm = FakeLM(model_name)
+        if lm.options["throttle_rate"]:
+            lm = rate_limited(lm, model_name)
+        dspy.configure(lm=lm)
+        print(f"✓ Configured DSPy with fake LM: {model_name}")
+        return lm
 
     # Check if this is an Ollama model
     if model_name.startswith("ollama/") or ":" in model_name:
-        # Ollama model - litellm uses "ollama/" prefix
-        if not model_name.startswith("ollama/"):
-            model_name = f"ollama/{model_name}"
-
-        lm = dspy.LM(
-            model=model_name,
-            api_base="http://localhost:11434",
-            temperature=0.1
-        )
+        # Ollama model - pooled connections, pinned with keep_alive and warmed up (see ollama_backend.py)
+        lm = setup_ollama(model_name)
         dspy.configure(lm=lm)
-        print(f"✓ Configured DSPy with Ollama: {model_name}")
+        print(f"✓ Configured DSPy with Ollama: {lm.model}")
         return lm
 
     # Gemini model
@@ -367,11 +438,12 @@ def setup_lm(model_name: str = "gemini-2.0-flash"):
 
     # Configure DSPy with Gemini via litellm
     # litellm uses "gemini/" prefix for Google AI Studio models
-    lm = dspy.LM(
+    # Rate limited client-side (RPM/TPM buckets + AIMD concurrency, see rate_limiter.py)
+    lm = rate_limited(dspy.LM(
         model=f"gemini/{model_name}",
         api_key=api_key,
         temperature=0.1
-    )
+    ), model_name)
     dspy.configure(lm=lm)
 
     print(f"✓ Configured DSPy with Gemini: {model_name}")
@@ -392,6 +464,12 @@ def run_optimization():
     train_set = examples[:7]
     val_set = examples[7:]
 
+    # Reviews the cheap models disagreed on, labeled by the premium model or a human
+    active = create_dspy_examples(load_active_labels())
+    if active:
+        train_set += active
+        print(f"\nAdded {len(active)} active-learning labels from {ACTIVE_LABELS_PATH}")
+
     print(f"\nTraining set: {len(train_set)} examples")
     print(f"Validation set: {len(val_set)} examples")
 
@@ -407,7 +485,8 @@ def run_optimization():
             rating=ex.rating,
             reviewer_name=ex.reviewer_name
         )
-        score = accuracy_metric(ex, pred)
+        with stage("metric"):
+            score = accuracy_metric(ex, pred)
         baseline_scores.append(score)
         print(f"  {ex.reviewer_name}: {score:.2%}")
 
@@ -438,7 +517,8 @@ def run_optimization():
             rating=ex.rating,
             reviewer_name=ex.reviewer_name
         )
-        score = accuracy_metric(ex, pred)
+        with stage("metric"):
+            score = accuracy_metric(ex, pred)
         optimized_scores.append(score)
         print(f"  {ex.reviewer_name}: {score:.2%}")
 
@@ -459,27 +539,38 @@ def run_optimization():
     return optimized_tagger
 
 
-def run_evaluation():
+def run_evaluation(concurrency: int = 8, use_cache: bool = True, rule_fields: bool = False, mode: str = "cot"):
     """Evaluate the current model on all examples."""
     print("\n" + "="*60)
     print("Full Evaluation")
     print("="*60)
 
     setup_lm("gemini-2.0-flash")
-    tagger = ReviewTagger()
+    cache = PredictionCache() if use_cache else None
+    tagger = CachedTagger(ReviewTagger(rule_fields=rule_fields, mode=mode), cache)
     examples = create_dspy_examples()
 
     scores = []
     results = []
-
-    for i, ex in enumerate(examples, 1):
-        pred = tagger(
-            review_text=ex.review_text,
-            rating=ex.rating,
-            reviewer_name=ex.reviewer_name
-        )
-        score = accuracy_metric(ex, pred)
+    errors = 0
+    rules = RuleAgreement()
+
+    tagged_results = tag_many(tagger, examples, concurrency=concurrency)
+    with stage("metric"):
+        row_scores, _ = score_tagged(tagged_results, lambda ex: ex, TAGGER_METRIC)
+
+    for i, tagged in enumerate(tagged_results, 1):
+        ex = tagged.review
+        if not tagged.ok:
+            errors += 1
+            results.append({"review": i, "reviewer": ex.reviewer_name, "error": tagged.error})
+            print(f"\n[{i}] {ex.reviewer_name}: ERROR: {tagged.error[:60]}")
+            continue
+
+        pred = tagged.prediction
+        score = row_scores[tagged.index]
         scores.append(score)
+        rules.update(ex.review_text, None if rule_fields else pred, ex)
 
         result = {
             "review": i,
@@ -508,21 +599,23 @@ def run_evaluation():
         print(f"    Predicted: sentiment={pred.sentiment}, timeline={pred.mentions_timeline}, price={pred.mentions_price}")
         print(f"    Expected:  sentiment={ex.sentiment}, timeline={ex.mentions_timeline}, price={ex.mentions_price}")
 
-    avg_score = sum(scores) / len(scores)
+    avg_score = sum(scores) / len(scores) if scores else 0
     print("\n" + "="*60)
-    print(f"AVERAGE ACCURACY: {avg_score:.2%}")
+    print(f"AVERAGE ACCURACY: {avg_score:.2%} (errors: {errors})")
     print("="*60)
+    rules.print_summary()
+    print_cache_stats(cache)
 
     # Save detailed results
     with open("evaluation_results.json", "w") as f:
-        json.dump({"average": f"{avg_score:.2%}", "results": results}, f, indent=2)
+        json.dump({"average": f"{avg_score:.2%}", "errors": errors, "results": results}, f, indent=2)
     print("\n✓ Saved detailed results to evaluation_results.json")
 
 
-def test_single_review(review_text: str):
+def test_single_review(review_text: str, mode: str = "cot"):
     """Test the tagger on a single review."""
     setup_lm("gemini-2.0-flash")
-    tagger = ReviewTagger()
+    tagger = ReviewTagger(mode=mode)
 
     print("\n" + "="*60)
     print("Single Review Test")
@@ -543,15 +636,8 @@ def test_single_review(review_text: str):
         print(f"\nReasoning: {result.reasoning}")
 
 
-def compare_models(include_ollama: bool = True):
-    """Compare different models using DSPy."""
-    import time
-
-    print("\n" + "="*60)
-    print("Model Comparison via DSPy")
-    print("="*60)
-
-    # All models to test
+def default_models(include_ollama: bool = True) -> list[tuple[str, str]]:
+    """(model name, type) pairs compared by default."""
     models = [
         ("gemini-2.0-flash", "cloud"),
         ("gemini-2.5-flash-lite-preview-06-17", "cloud"),  # 2.5 Flash-Lite
@@ -562,37 +648,73 @@ def compare_models(include_ollama: bool = True):
             ("gemma2:9b", "local"),
             ("qwen2.5:14b", "local"),
         ])
+    return models
+
+
+def compare_models(
+    include_ollama: bool = True,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    rule_fields: bool = False,
+    model_names: list[str] | None = None,
+    mode: str = "cot",
+):
+    """Compare different models using DSPy."""
+    import time
+
+    print("\n" + "="*60)
+    print("Model Comparison via DSPy")
+    print("="*60)
+
+    if model_names:
+        models = [(name, classify_model(name)) for name in model_names]
+    else:
+        models = default_models(include_ollama)
 
     examples = create_dspy_examples()  # All 10 examples
+    cache = PredictionCache() if use_cache else None
 
     results = {}
 
     for model_name, model_type in models:
         print(f"\n--- Testing {model_name} ({model_type}) ---")
-        start_time = time.time()
         try:
             setup_lm(model_name)
-            tagger = ReviewTagger()
+            start_time = time.time()  # after setup so Ollama model loads aren't timed
+            tagger = CachedTagger(ReviewTagger(rule_fields=rule_fields, mode=mode), cache)
 
             scores = []
-            for ex in examples:
-                pred = tagger(
-                    review_text=ex.review_text,
-                    rating=ex.rating,
-                    reviewer_name=ex.reviewer_name
-                )
-                score = accuracy_metric(ex, pred)
+            errors = 0
+            rules = RuleAgreement()
+            tagged_results = tag_many(tagger, examples, concurrency=concurrency)
+            with stage("metric"):
+                row_scores, batch = score_tagged(tagged_results, lambda ex: ex, TAGGER_METRIC)
+
+            for tagged in tagged_results:
+                ex = tagged.review
+                if not tagged.ok:
+                    errors += 1
+                    print(f"    {ex.reviewer_name}: ERROR: {tagged.error[:60]}")
+                    continue
+                score = row_scores[tagged.index]
                 scores.append(score)
+                rules.update(ex.review_text, None if rule_fields else tagged.prediction, ex)
                 print(f"    {ex.reviewer_name}: {score:.2%}")
 
-            avg = sum(scores) / len(scores)
+            avg = sum(scores) / len(scores) if scores else 0
             elapsed = time.time() - start_time
             results[model_name] = {
                 "accuracy": avg,
                 "time": elapsed,
-                "type": model_type
+                "type": model_type,
+                "errors": errors,
+                "field_accuracy": batch.mean(),
+                "rule_agreement": rules.summary()
             }
-            print(f"  Average: {avg:.2%} ({elapsed:.1f}s)")
+            print(f"  Average: {avg:.2%} ({elapsed:.1f}s, errors: {errors})")
+            rules.print_summary()
+            print_rate_limit_stats(dspy.settings.lm)
+            print_ollama_stats(dspy.settings.lm)
 
         except Exception as e:
             print(f"  Error: {e}")
@@ -607,6 +729,7 @@ def compare_models(include_ollama: bool = True):
     for model, data in sorted(results.items(), key=lambda x: x[1]["accuracy"] if x[1] else 0, reverse=True):
         if data:
             print(f"{model:<35} {data['type']:<8} {data['accuracy']:.1%}      {data['time']:.1f}s")
+    print_cache_stats(cache)
 
     # Save results
     with open("dspy_model_comparison.json", "w") as f:
@@ -624,17 +747,48 @@ if __name__ == "__main__":
     parser.add_argument("--evaluate", action="store_true", help="Evaluate on all examples")
     parser.add_argument("--test", type=str, help="Test on a single review text")
     parser.add_argument("--compare", action="store_true", help="Compare different models")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Latency/throughput/cost benchmark of the compared models (see benchmark.py)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight during evaluation")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    parser.add_argument("--rule-fields", action="store_true",
+                        help="Compute mentions_price/mentions_timeline with keyword rules instead of the LM")
+    parser.add_argument("--models", nargs="+",
+                        help="Models for --compare (e.g. fake/default?latency=0.05 for offline runs)")
+    parser.add_argument("--sequential", action="store_true",
+                        help="--compare in interleaved mini-batches, dropping dominated models (sequential_compare.py)")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level for --sequential")
+    parser.add_argument("--profile", metavar="TRACE_JSON",
+                        help="Time format/LM/parse/metric stages and write a Chrome trace here (profiler.py)")
+    parser.add_argument("--mode", choices=TAGGER_MODES, default="cot",
+                        help="cot = reasoning before the fields; predict = fast mode without reasoning; "
+                        "structured = JSON constrained by the ReviewAnalysis schema")
 
     args = parser.parse_args()
+    eval_options = dict(
+        concurrency=args.concurrency,
+        use_cache=not args.no_cache,
+        rule_fields=args.rule_fields,
+        mode=args.mode,
+    )
 
-    if args.optimize:
-        run_optimization()
-    elif args.evaluate:
-        run_evaluation()
-    elif args.test:
-        test_single_review(args.test)
-    elif args.compare:
-        compare_models()
-    else:
-        # Default: run evaluation
-        run_evaluation()
+    with profiled(args.profile) if args.profile else nullcontext():
+        if args.optimize:
+            run_optimization()
+        elif args.evaluate:
+            run_evaluation(**eval_options)
+        elif args.test:
+            test_single_review(args.test, mode=args.mode)
+        elif args.compare and args.sequential:
+            from sequential_compare import run_sequential_comparison
+            run_sequential_comparison(args.models or [name for name, _ in default_models()], dataset="training",
+                                      batch_size=2, alpha=args.alpha, min_reviews=4, concurrency=args.concurrency,
+                                      use_cache=not args.no_cache, mode=args.mode, rule_fields=args.rule_fields)
+        elif args.compare:
+            compare_models(model_names=args.models, **eval_options)
+        elif args.benchmark:
+            from benchmark import run_benchmark
+            run_benchmark(args.models, concurrency=args.concurrency, rule_fields=args.rule_fields, mode=args.mode)
+        else:
+            # Default: run evaluation
+            run_evaluation(**eval_options)
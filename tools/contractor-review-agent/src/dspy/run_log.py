@@ -0,0 +1,96 @@
+"""
+Append-only JSONL run log for resumable evaluations.
+
+The first line describes the run (models and options). Every per-review
+prediction and score is appended and flushed as soon as it completes, so a
+crash loses at most the calls that were in flight. Reopening the log by run
+id gives back the options and the (model, review) pairs already done.
+
+Record types:
+    {"type": "run", "run_id": ..., "created": ..., "models": [...], "options": {...}}
+    {"type": "review", "model": ..., "review_id": ..., "prediction": {...}, "score": ..., "elapsed": ...}
+    {"type": "review", "model": ..., "review_id": ..., "error": "...", "elapsed": ...}
+    {"type": "segment", "model": ..., "time": ...}      # wall clock of one session on one model
+
+Usage:
+    log = RunLog.create(models=["gemini-2.0-flash"], options={...})
+    log.append({"type": "review", ...})
+    log = RunLog.open(log.run_id)          # later, to resume
+"""
+
+import os
+import json
+import threading
+from datetime import datetime
+
+DEFAULT_RUN_DIR = "eval_runs"
+
+
+class RunLog:
+    """One evaluation run's JSONL log."""
+
+    def __init__(self, path: str, header: dict, records: list[dict]):
+        self.path = path
+        self.header = header
+        self.records = records
+        self._lock = threading.Lock()
+
+    @property
+    def run_id(self) -> str:
+        return self.header["run_id"]
+
+    @classmethod
+    def create(cls, models: list, options: dict, run_dir: str = DEFAULT_RUN_DIR) -> "RunLog":
+        os.makedirs(run_dir, exist_ok=True)
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(run_dir, f"{run_id}.jsonl")
+        if os.path.exists(path):
+            raise ValueError(f"Run log {path} already exists")
+        header = {"type": "run", "run_id": run_id, "created": datetime.now().isoformat(timespec="seconds"),
+                  "models": models, "options": options}
+        log = cls(path, header, [])
+        log._write(header)
+        return log
+
+    @classmethod
+    def open(cls, run_id: str, run_dir: str = DEFAULT_RUN_DIR) -> "RunLog":
+        path = os.path.join(run_dir, f"{run_id}.jsonl")
+        if not os.path.exists(path):
+            raise ValueError(f"No run log {path}")
+        with open(path, "rb") as f:
+            data = f.read()
+        # A crash mid-write can leave a partial last line; drop it so appends start on a clean line
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(len(complete))
+        lines = [json.loads(line) for line in complete.decode("utf-8").splitlines() if line.strip()]
+        if not lines or lines[0].get("type") != "run":
+            raise ValueError(f"{path} is not a run log")
+        return cls(path, lines[0], lines[1:])
+
+    def _write(self, record: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, record: dict):
+        with self._lock:
+            self._write(record)
+            self.records.append(record)
+
+    def completed(self, model: str) -> dict:
+        """{review_id: record} of successful predictions for `model` (latest record wins)."""
+        done = {}
+        for record in self.records:
+            if record.get("type") == "review" and record["model"] == model:
+                if record.get("error") is None:
+                    done[record["review_id"]] = record
+                else:
+                    done.pop(record["review_id"], None)
+        return done
+
+    def elapsed(self, model: str) -> float:
+        """Total wall clock spent on `model` across sessions."""
+        return sum(r["time"] for r in self.records if r.get("type") == "segment" and r["model"] == model)
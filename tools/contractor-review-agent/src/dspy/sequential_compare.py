@@ -0,0 +1,229 @@
+"""
+Sequential model comparison with early stopping.
+
+All models tag the same shuffled reviews in interleaved mini-batches. After
+each mini-batch every remaining model is compared with the current leader
+on the reviews both have scored (paired per-review score differences). A
+model whose whole confidence interval for (leader - model) lies above 0 is
+statistically dominated and gets no more reviews.
+
+The intervals are normal approximations, Bonferroni-corrected over every
+look and every challenger (z for alpha / (2 * looks * (models - 1))), so
+repeated peeking keeps the overall error rate at or below --alpha.
+
+The report states how many LM calls were skipped. With --verify, every
+model also tags the reviews it skipped, and the report checks the ranking
+against full-data accuracy.
+
+Usage:
+    python sequential_compare.py --models gemini-2.0-flash gemma2:9b qwen2.5:14b --alpha 0.05
+    python sequential_compare.py --models "fake/a?latency=0" "fake/b?malformed_rate=0.4" --verify
+    python eval_50_reviews.py --sequential --alpha 0.1 --mode predict
+    python review_tagger.py --compare --sequential
+"""
+
+import json
+import math
+import random
+import argparse
+from dataclasses import dataclass, field
+from statistics import NormalDist
+
+import dspy
+import numpy as np
+
+from batch_tagging import tag_many
+from prediction_cache import CachedTagger, PredictionCache, print_cache_stats
+from review_tagger import TAGGER_MODES, create_dspy_examples, setup_lm
+from vector_metric import EVAL_50_METRIC, TAGGER_METRIC, score_records
+
+
+@dataclass
+class ModelTrack:
+    """Per-review scores of one model, in review order, and when it was dropped."""
+    name: str
+    lm: object
+    scores: list = field(default_factory=list)
+    errors: int = 0
+    dropped_after: int | None = None
+    dropped_by: str | None = None
+    verify_scores: list = field(default_factory=list)
+
+    @property
+    def active(self) -> bool:
+        return self.dropped_after is None
+
+    @property
+    def accuracy(self) -> float:
+        return float(np.mean(self.scores)) if self.scores else 0.0
+
+
+def mean_interval(values, z: float) -> tuple[float, float, float]:
+    """(mean, low, high) of a normal-approximation interval."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float(values.mean()) if len(values) else 0.0, -math.inf, math.inf
+    mean = float(values.mean())
+    half = z * float(values.std(ddof=1)) / math.sqrt(len(values))
+    return mean, mean - half, mean + half
+
+
+def load_dataset(dataset: str, mode: str = "cot", rule_fields: bool = False):
+    """(items, tagger, expected, metric) for "test50" (test_reviews_50.json) or "training" (TRAINING_DATA)."""
+    if dataset == "test50":
+        from eval_50_reviews import ReviewTagger as Eval50Tagger
+        with open("test_reviews_50.json", "r") as f:
+            reviews = json.load(f)
+        return (reviews, Eval50Tagger(rule_fields=rule_fields, mode=mode), lambda review: review["analysis_json"],
+                EVAL_50_METRIC)
+    from review_tagger import ReviewTagger
+    return create_dspy_examples(), ReviewTagger(rule_fields=rule_fields, mode=mode), lambda ex: ex, TAGGER_METRIC
+
+
+def score_batch(tagger, items: list, expected, metric, lm, concurrency: int) -> tuple[list[float], int]:
+    """Per-item scores for one model (0 where the call failed) and the error count."""
+    with dspy.context(lm=lm):
+        results = tag_many(tagger, items, concurrency=concurrency)
+    scores = [0.0] * len(items)
+    ok = [r for r in results if r.ok]
+    if ok:
+        batch = score_records([r.prediction for r in ok], [expected(r.review) for r in ok], metric)
+        for r, value in zip(ok, batch.overall.tolist()):
+            scores[r.index] = value
+    return scores, len(items) - len(ok)
+
+
+def run_sequential_comparison(
+    model_names: list[str],
+    dataset: str = "test50",
+    batch_size: int = 5,
+    alpha: float = 0.05,
+    min_reviews: int = 10,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    seed: int = 0,
+    verify: bool = False,
+    mode: str = "cot",
+    rule_fields: bool = False,
+    output_path: str = "sequential_comparison.json",
+) -> dict:
+    """Compare models on interleaved mini-batches, dropping those the leader dominates at level `alpha`."""
+    items, program, expected, metric = load_dataset(dataset, mode=mode, rule_fields=rule_fields)
+    items = list(items)
+    random.Random(seed).shuffle(items)
+    n_items = len(items)
+
+    looks = math.ceil(n_items / batch_size)
+    z = NormalDist().inv_cdf(1 - alpha / (2 * looks * max(1, len(model_names) - 1)))
+
+    print("\n" + "=" * 70)
+    print(f"Sequential Comparison ({len(model_names)} models, {n_items} {dataset} reviews, {mode} mode, "
+          f"batches of {batch_size}, alpha={alpha}, z={z:.2f})")
+    print("=" * 70)
+
+    cache = PredictionCache() if use_cache else None
+    tagger = CachedTagger(program, cache)
+    tracks = [ModelTrack(name, setup_lm(name)) for name in model_names]
+
+    seen = 0
+    for start in range(0, n_items, batch_size):
+        active = [t for t in tracks if t.active]
+        if len(active) == 1:
+            break
+        batch = items[start:start + batch_size]
+        for track in active:
+            scores, errors = score_batch(tagger, batch, expected, metric, track.lm, concurrency)
+            track.scores.extend(scores)
+            track.errors += errors
+        seen += len(batch)
+
+        leader = max(active, key=lambda t: t.accuracy)
+        line = ", ".join(f"{t.name} {t.accuracy:.1%}" for t in active)
+        print(f"\n  after {seen:3d}: {line}")
+        if seen < min_reviews:
+            continue
+        for track in active:
+            if track is leader:
+                continue
+            diff, low, high = mean_interval(np.subtract(leader.scores, track.scores), z)
+            if low > 0:
+                track.dropped_after, track.dropped_by = seen, leader.name
+                print(f"    ✗ dropped {track.name}: {leader.name} leads by {diff:+.1%} (CI {low:+.1%}..{high:+.1%})")
+
+    skipped = sum(n_items - len(t.scores) for t in tracks)
+    survivors = sorted((t for t in tracks if t.active), key=lambda t: t.accuracy, reverse=True)
+    dropped = sorted((t for t in tracks if not t.active), key=lambda t: t.dropped_after, reverse=True)
+    ranking = survivors + dropped
+    winner = ranking[0]
+
+    print("\n" + "=" * 70)
+    print("RANKING")
+    print("=" * 70)
+    print(f"\n{'Model':<36} {'Reviews':>8} {'Accuracy':>9} {'CI':>17} {'Errors':>7}  Status")
+    for track in ranking:
+        mean, low, high = mean_interval(track.scores, z)
+        status = "kept" if track.active else f"dropped after {track.dropped_after} (by {track.dropped_by})"
+        print(f"{track.name:<36} {len(track.scores):>8} {mean:>8.1%} {f'{low:.1%}..{high:.1%}':>17} "
+              f"{track.errors:>7}  {status}")
+    total_calls = n_items * len(tracks)
+    print(f"\nSkipped {skipped}/{total_calls} LM calls ({skipped / total_calls:.0%}) by early stopping")
+    if len(survivors) > 1:
+        print(f"{len(survivors)} models were never separated at alpha={alpha}; their order is by point estimate")
+
+    confirmed = None
+    if verify and dropped:
+        for track in tracks:
+            rest = items[len(track.scores):]
+            if not rest:
+                continue
+            track.verify_scores, errors = score_batch(tagger, rest, expected, metric, track.lm, concurrency)
+            track.errors += errors
+        full = {t.name: float(np.mean(t.scores + t.verify_scores)) for t in tracks}
+        confirmed = all(full[t.name] < full[t.dropped_by] for t in dropped)
+        print(f"\nVerify (full data): " + ", ".join(f"{name} {acc:.1%}" for name, acc in full.items()))
+        print(f"{'✓' if confirmed else '✗'} Every dropped model scores below the model that dropped it: {confirmed}")
+    elif dropped:
+        print(f"Ranking stands at alpha={alpha}: the CI of (leader - dropped model) was entirely above 0 "
+              f"(run with --verify to check on the skipped reviews)")
+    print_cache_stats(cache)
+
+    report = {
+        "dataset": dataset, "mode": mode, "rule_fields": rule_fields, "reviews": n_items, "batch_size": batch_size,
+        "alpha": alpha, "z": z,
+        "winner": winner.name, "skipped_calls": skipped, "total_calls": total_calls, "ranking_confirmed": confirmed,
+        "models": [
+            {"model": t.name, "reviews": len(t.scores), "accuracy": t.accuracy, "errors": t.errors,
+             "interval": mean_interval(t.scores, z)[1:], "dropped_after": t.dropped_after,
+             "dropped_by": t.dropped_by,
+             "full_accuracy": float(np.mean(t.scores + t.verify_scores)) if t.verify_scores else None}
+            for t in ranking
+        ],
+    }
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequential model comparison with early stopping")
+    parser.add_argument("--models", nargs="+", required=True, help="Models to compare (Gemini, Ollama or fake/...)")
+    parser.add_argument("--dataset", choices=["test50", "training"], default="test50",
+                        help="test50 = test_reviews_50.json; training = TRAINING_DATA")
+    parser.add_argument("--batch-size", type=int, default=5, help="Reviews per interleaved mini-batch")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Overall significance level")
+    parser.add_argument("--min-reviews", type=int, default=10, help="Never drop a model before this many reviews")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    parser.add_argument("--seed", type=int, default=0, help="Review shuffle seed")
+    parser.add_argument("--verify", action="store_true", help="Also tag skipped reviews to confirm the ranking")
+    parser.add_argument("--mode", choices=TAGGER_MODES, default="cot", help="Tagger mode (see review_tagger.py)")
+    parser.add_argument("--rule-fields", action="store_true",
+                        help="Compute mentions_price/mentions_timeline with keyword rules instead of the LM")
+    parser.add_argument("--output", default="sequential_comparison.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_sequential_comparison(args.models, dataset=args.dataset, batch_size=args.batch_size, alpha=args.alpha,
+                              min_reviews=args.min_reviews, concurrency=args.concurrency,
+                              use_cache=not args.no_cache, seed=args.seed, verify=args.verify, mode=args.mode,
+                              rule_fields=args.rule_fields, output_path=args.output)
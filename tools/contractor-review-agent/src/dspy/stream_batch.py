@@ -0,0 +1,395 @@
+"""
+Streaming, resumable runner for batch_input_65000.jsonl.
+
+Reads the Gemini batch request file one line at a time, tags each request
+through the DSPy ReviewTagger (or sends the original prompt to a raw LM), and
+appends one result per line to an output JSONL keyed by `custom_id`.
+
+A small checkpoint file next to the output records the byte offsets of the
+next unprocessed input line and of the output written so far, so a crash or
+Ctrl-C resumes exactly where it stopped. It also records the input and every
+option that changes the results (mode, models, cascade threshold, dedup,
+repair, first pass). Resuming with different ones is refused (use --restart),
+so one output never mixes setups.
+
+A request that fails is written as {"custom_id", "error"} and counts as
+processed; resuming does not retry it. To retry failures, filter the error
+lines' custom_ids and run them again, or keep the backlog in retag.py, whose
+manifest retries failed reviews on the next run.
+
+With --cascade-local, each review goes to a local model first and only
+low-confidence or invalid results are re-tagged by --model (see cascade.py).
+
+With --dedup, near-duplicate reviews are grouped on the fly and only one
+representative per group is sent to the LM (see dedup.py). The dedup index
+lives in memory, so after a resume duplicates of earlier lines are tagged
+on their own.
+
+With --first-pass, a local NumPy classifier (see local_classifier.py) answers
+reviews it is confident about, and only the rest reach the LM.
+
+With --repair, malformed outputs (prose around the JSON, Python literals,
+out-of-range scores, ...) are fixed locally and logged to repair_log.jsonl
+instead of being written as errors (see output_repair.py).
+
+At the end the whole output is loaded into a ReviewStore (review_store.py)
+and summarized on its columns. --store also saves it for later aggregation
+or scoring.
+
+Usage:
+    python stream_batch.py --output batch_output.jsonl
+    python stream_batch.py --dedup --dedup-threshold 0.85
+    python stream_batch.py --mode raw --model gemma2:9b --concurrency 4
+    python stream_batch.py --cascade-local gemma2:9b --escalate-below 0.8
+    python stream_batch.py --mode raw --model gemma2:9b --repair
+    python stream_batch.py --first-pass local_classifier.npz --first-pass-threshold 0.9
+    python stream_batch.py --output batch_output.jsonl --restart   # ignore checkpoint
+    python stream_batch.py --store store/batch_output               # keep the columnar store
+"""
+
+import os
+import re
+import json
+import argparse
+from datetime import datetime, timezone
+from typing import Iterator
+
+import dspy
+
+from batch_tagging import iter_tagged
+from cascade import CascadeTagger, setup_cascade
+from dedup import FanOutTagger, NearDuplicateIndex, dedup_requests, print_dedup_stats
+from output_repair import RepairingChatAdapter, RepairLog, repair_analysis
+from prediction_cache import CachedTagger, PredictionCache, print_cache_stats
+from review_store import ReviewStore
+from review_tagger import ReviewAnalysis, ReviewTagger, setup_lm
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(__file__), "..", "..", "batch_input_65000.jsonl")
+ANALYSIS_FIELDS = list(ReviewAnalysis.model_fields)
+
+# Matches the tail of the production prompt: Review from <name> (<n>★):\n"<text>"
+REVIEW_PATTERN = re.compile(r'Review from (?P<name>.*?) \((?P<rating>\d)★\):\n"(?P<text>.*)"\s*$', re.DOTALL)
+
+
+# =============================================================================
+# Input / Checkpoint
+# =============================================================================
+
+def parse_request(line: str) -> dict:
+    """Turn one batch request line into tagger inputs plus the original prompt."""
+    data = json.loads(line)
+    request = data["request"]
+    prompt = "".join(part.get("text", "") for part in request["contents"][0]["parts"])
+
+    parsed = {
+        "custom_id": data["custom_id"],
+        "prompt": prompt,
+        "temperature": request.get("generationConfig", {}).get("temperature", 0.1),
+    }
+
+    # Raw mode only needs the prompt; the DSPy tagger needs the review pulled back out
+    match = REVIEW_PATTERN.search(prompt)
+    if match:
+        parsed["review_text"] = match.group("text")
+        parsed["rating"] = int(match.group("rating"))
+        parsed["reviewer_name"] = match.group("name")
+    return parsed
+
+
+def read_requests(path: str, start_offset: int = 0, limit: int | None = None) -> Iterator[dict]:
+    """Yield parsed requests from `start_offset`, each tagged with the offset just past its line."""
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        count = 0
+        while limit is None or count < limit:
+            raw = f.readline()
+            if not raw:
+                break
+            count += 1
+            end_offset = f.tell()
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            try:
+                request = parse_request(line)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                request = {"custom_id": None, "parse_error": str(e)}
+            request["end_offset"] = end_offset
+            yield request
+
+
+def load_checkpoint(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Write the checkpoint atomically so a crash never leaves it half-written."""
+    checkpoint["updated_at"] = datetime.now(timezone.utc).isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# =============================================================================
+# Taggers
+# =============================================================================
+
+class RawLMTagger:
+    """Sends the production prompt verbatim and validates the JSON reply (repairing it when given a RepairLog)."""
+
+    def __init__(self, repair_log: RepairLog | None = None):
+        self.repair_log = repair_log
+
+    def __call__(self, prompt: str, temperature: float = 0.1) -> dict:
+        outputs = dspy.settings.lm(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            response_format={"type": "json_object"},
+        )
+        text = outputs[0] if isinstance(outputs[0], str) else outputs[0]["text"]
+        if self.repair_log is None:
+            return ReviewAnalysis.model_validate_json(text).model_dump()
+
+        analysis, fixes = repair_analysis(text)
+        if analysis is None:
+            self.repair_log.record("failed", text, fixes=fixes)
+            return ReviewAnalysis.model_validate_json(text).model_dump()  # raises the original error
+        self.repair_log.record("coerced" if fixes else "clean", text, analysis, fixes)
+        return analysis
+
+
+def dspy_inputs(request: dict) -> dict:
+    if "parse_error" in request:
+        raise ValueError(request["parse_error"])
+    if "review_text" not in request:
+        raise ValueError("review block not found in prompt")
+    return {
+        "review_text": request["review_text"],
+        "rating": request["rating"],
+        "reviewer_name": request["reviewer_name"],
+    }
+
+
+def raw_inputs(request: dict) -> dict:
+    if "parse_error" in request:
+        raise ValueError(request["parse_error"])
+    return {"prompt": request["prompt"], "temperature": request["temperature"]}
+
+
+def to_analysis(prediction) -> dict:
+    """Keep only the ReviewAnalysis fields (drops chain-of-thought reasoning)."""
+    if isinstance(prediction, dict):
+        return prediction
+    return {field: prediction.get(field) for field in ANALYSIS_FIELDS}
+
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def run_stream(
+    input_path: str,
+    output_path: str,
+    model_name: str = "gemini-2.0-flash",
+    mode: str = "dspy",
+    concurrency: int = 8,
+    limit: int | None = None,
+    checkpoint_every: int = 50,
+    restart: bool = False,
+    use_cache: bool = True,
+    dedup_threshold: float | None = None,
+    cascade_local: str | None = None,
+    escalate_below: float = 0.7,
+    repair: bool = False,
+    first_pass: str | None = None,
+    first_pass_threshold: float = 0.9,
+    store_dir: str | None = None,
+):
+    """Process `input_path` into `output_path`, resuming from the checkpoint when present."""
+    checkpoint_path = f"{output_path}.checkpoint.json"
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+
+    # Everything that changes what gets written for a review; resuming with a different setup is refused
+    run = {
+        "mode": mode,
+        "model": model_name,
+        "cascade_local": cascade_local,
+        "escalate_below": escalate_below if cascade_local else None,
+        "dedup_threshold": dedup_threshold,
+        "repair": repair,
+        "first_pass": os.path.abspath(first_pass) if first_pass else None,
+        "first_pass_threshold": first_pass_threshold if first_pass else None,
+    }
+    if checkpoint:
+        if checkpoint["input"] != os.path.abspath(input_path):
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to {checkpoint['input']}; use --restart")
+        changed = [f"{key} {checkpoint.get(key)!r} → {value!r}" for key, value in run.items()
+                   if checkpoint.get(key) != value]
+        if changed:
+            raise ValueError(f"Checkpoint {checkpoint_path} was written with a different setup "
+                             f"({'; '.join(changed)}); resuming would mix results, use --restart")
+    if checkpoint is None and os.path.exists(output_path) and not restart:
+        raise ValueError(f"{output_path} exists without a checkpoint; use --restart to overwrite")
+
+    if checkpoint is None:
+        checkpoint = {
+            "input": os.path.abspath(input_path),
+            **run,
+            "input_offset": 0,
+            "output_offset": 0,
+            "processed": 0,
+            "errors": 0,
+        }
+        open(output_path, "w").close()
+    else:
+        print(f"Resuming after {checkpoint['processed']} requests (byte {checkpoint['input_offset']})")
+
+    cache = cascade = gate = None
+    repair_log = RepairLog() if repair else None
+    if mode == "raw":
+        if cascade_local or first_pass:
+            raise ValueError("--cascade-local and --first-pass need --mode dspy")
+        setup_lm(model_name)
+        tagger, inputs = RawLMTagger(repair_log), raw_inputs
+    else:
+        cache = PredictionCache() if use_cache else None
+        tagger = ReviewTagger()
+        if cascade_local:
+            local_lm, cloud_lm = setup_cascade(cascade_local, model_name)
+            tagger = cascade = CascadeTagger(tagger, local_lm, cloud_lm, threshold=escalate_below)
+        else:
+            setup_lm(model_name)
+        if repair_log is not None:
+            dspy.configure(adapter=RepairingChatAdapter(repair_log))
+        tagger, inputs = CachedTagger(tagger, cache), dspy_inputs
+        if first_pass:
+            from local_classifier import FirstPassTagger, LocalClassifier
+            tagger = gate = FirstPassTagger(tagger, LocalClassifier.load(first_pass), threshold=first_pass_threshold)
+
+    requests = read_requests(input_path, checkpoint["input_offset"], limit=limit)
+
+    index = fanout = None
+    if dedup_threshold is not None:
+        index = NearDuplicateIndex(threshold=dedup_threshold)
+        fanout = FanOutTagger(tagger)
+        requests = dedup_requests(requests, index, fanout)
+        tagger, base_inputs = fanout, inputs
+
+        def inputs(request):
+            return {**base_inputs(request), "dedup_key": request["custom_id"],
+                    "representative": request["duplicate_of"]}
+
+    since_checkpoint = 0
+
+    # Binary mode so tell()/truncate() are plain byte offsets
+    with open(output_path, "r+b") as out:
+        # Drop anything written after the last checkpoint so resumed output has no duplicates
+        out.truncate(checkpoint["output_offset"])
+        out.seek(checkpoint["output_offset"])
+
+        try:
+            for tagged in iter_tagged(tagger, requests, concurrency=concurrency, inputs=inputs):
+                request = tagged.review
+                record = {"custom_id": request["custom_id"]}
+                if tagged.ok:
+                    record["analysis"] = to_analysis(tagged.prediction)
+                    if fanout is not None and (representative := fanout.pop_representative(request["custom_id"])):
+                        record["duplicate_of"] = representative
+                else:
+                    record["error"] = tagged.error
+                    checkpoint["errors"] += 1
+
+                out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                checkpoint["processed"] += 1
+                checkpoint["input_offset"] = request["end_offset"]
+                since_checkpoint += 1
+
+                if since_checkpoint >= checkpoint_every:
+                    out.flush()
+                    checkpoint["output_offset"] = out.tell()
+                    save_checkpoint(checkpoint_path, checkpoint)
+                    since_checkpoint = 0
+                    print(f"  {checkpoint['processed']} processed ({checkpoint['errors']} errors)")
+        except KeyboardInterrupt:
+            print("\nInterrupted, saving checkpoint (rerun the same command to resume)")
+        finally:
+            out.flush()
+            checkpoint["output_offset"] = out.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    print(f"\n✓ {checkpoint['processed']} requests processed, {checkpoint['errors']} errors → {output_path}")
+    print_cache_stats(cache)
+    if cascade is not None:
+        cascade.print_summary()
+    if gate is not None:
+        gate.print_summary()
+    if index is not None:
+        print_dedup_stats(index, fanout)
+    if repair_log is not None:
+        repair_log.print_summary()
+
+    # Aggregate over the whole output (earlier segments too) on columns, not per-review dicts
+    store = ReviewStore.from_jsonl(output_path)
+    store.print_summary()
+    if store_dir:
+        store.save(store_dir)
+        print(f"✓ Store → {store_dir}")
+    return checkpoint
+
+
+# =============================================================================
+# CLI Entry Point
+# =============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream batch_input_65000.jsonl through the tagger")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Gemini batch request JSONL")
+    parser.add_argument("--output", default="batch_output.jsonl", help="Output JSONL keyed by custom_id")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini or Ollama)")
+    parser.add_argument("--mode", choices=["dspy", "raw"], default="dspy",
+                        help="dspy: ReviewTagger; raw: send the batch prompt verbatim")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--limit", type=int, help="Process at most N more lines")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="Lines between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start over")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk prediction cache")
+    parser.add_argument("--dedup", action="store_true", help="Tag one representative per near-duplicate group")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="Jaccard similarity for --dedup")
+    parser.add_argument("--cascade-local", help="Tag with this local model first, escalating to --model")
+    parser.add_argument("--escalate-below", type=float, default=0.7,
+                        help="Escalate local results with confidence below this (with --cascade-local)")
+    parser.add_argument("--repair", action="store_true",
+                        help="Repair and coerce malformed LM outputs locally, logging to repair_log.jsonl")
+    parser.add_argument("--first-pass", metavar="MODEL_NPZ",
+                        help="Answer confident reviews with this local classifier (local_classifier.py)")
+    parser.add_argument("--first-pass-threshold", type=float, default=0.9,
+                        help="Classifier confidence needed to skip the LM (with --first-pass)")
+    parser.add_argument("--store", metavar="DIR", help="Also save the output as a ReviewStore (review_store.py)")
+
+    args = parser.parse_args()
+
+    try:
+        run_stream(
+            args.input,
+            args.output,
+            model_name=args.model,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            limit=args.limit,
+            checkpoint_every=args.checkpoint_every,
+            restart=args.restart,
+            use_cache=not args.no_cache,
+            dedup_threshold=args.dedup_threshold if args.dedup else None,
+            cascade_local=args.cascade_local,
+            escalate_below=args.escalate_below,
+            repair=args.repair,
+            first_pass=args.first_pass,
+            first_pass_threshold=args.first_pass_threshold,
+            store_dir=args.store,
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
@@ -0,0 +1,216 @@
+"""
+Native structured output: schema-constrained decoding instead of field parsing.
+
+By default DSPy asks the LM to write every output field under a
+`[[ ## field ## ]]` header and parses that text afterwards. When parsing
+fails, ChatAdapter retries the call in JSON mode. StructuredPredict (tagger
+mode "structured") uses the provider's own structured output instead. It
+sends the JSON schema of ReviewAnalysis, cut down to the signature's output
+fields, as response_format:
+
+- Gemini: litellm passes it on as response_schema with
+  response_mime_type=application/json
+- Ollama: OllamaLM sends the schema as the `format` parameter (see
+  ollama_backend._format)
+
+The decoder can only produce valid JSON for the schema, with no headers or
+reasoning. That makes the output shorter, and parsing is one
+model_validate_json. There are no retries: a reply that doesn't validate
+counts as a parse failure.
+
+The report runs cot, predict and structured on test_reviews_50.json through
+benchmark.benchmark_model. It compares the parse-failure rate, the extra LM
+calls (ChatAdapter's JSON fallbacks), output tokens per review, latency and
+accuracy.
+
+Usage:
+    python structured_output.py                                 # gemini-2.0-flash
+    python structured_output.py --model gemma2:9b --repetitions 1
+    python structured_output.py --model "fake/x?latency=0.05&malformed_rate=0.05"
+    python eval_50_reviews.py --mode structured                 # structured mode in a normal eval
+"""
+
+import json
+import argparse
+from typing import Annotated
+
+import dspy
+from pydantic import BaseModel, BeforeValidator, create_model
+
+from review_tagger import ReviewAnalysis
+
+SCHEMA_HEADER = "Respond with only a JSON object holding the output fields, as given by the response schema."
+
+
+def _null(value):
+    # The signature spells "no project type" as the string "null"; schema-constrained decoders emit JSON null
+    return None if isinstance(value, str) and value.lower() in ("null", "none") else value
+
+
+def output_model(signature) -> type[BaseModel]:
+    """ReviewAnalysis restricted to the signature's output fields (e.g. slim_signature drops the flags)."""
+    names = [name for name in signature.output_fields if name in ReviewAnalysis.model_fields]
+    missing = set(signature.output_fields) - set(names)
+    if missing:
+        raise ValueError(f"Output fields not in ReviewAnalysis: {', '.join(sorted(missing))}")
+    fields = {}
+    for name in names:
+        field = ReviewAnalysis.model_fields[name]
+        annotation = Annotated[field.annotation, BeforeValidator(_null)] if name == "project_type" \
+            else field.annotation
+        fields[name] = (annotation, field)
+    return create_model(ReviewAnalysis.__name__, **fields)
+
+
+def _strip(schema):
+    if isinstance(schema, dict):
+        return {key: _strip(value) for key, value in schema.items() if key not in ("title", "default")}
+    if isinstance(schema, list):
+        return [_strip(value) for value in schema]
+    return schema
+
+
+def json_schema(model: type[BaseModel]) -> dict:
+    """The model's JSON schema without titles/defaults and with every field required."""
+    schema = _strip(model.model_json_schema())
+    schema["required"] = list(schema["properties"])
+    return schema
+
+
+def response_format(model: type[BaseModel]) -> dict:
+    """OpenAI-style json_schema response_format (litellm → Gemini response_schema; OllamaLM → format)."""
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": json_schema(model),
+                                                   "strict": True}}
+
+
+def _type_name(annotation) -> str:
+    return annotation.__name__ if isinstance(annotation, type) else str(annotation)
+
+
+def _describe(fields: dict) -> str:
+    return "\n".join(f"{i}. `{name}` ({_type_name(field.annotation)}): "
+                     f"{(field.json_schema_extra or {}).get('desc', '')}"
+                     for i, (name, field) in enumerate(fields.items(), 1))
+
+
+class StructuredPredict(dspy.Predict):
+    """Predict that gets its outputs as schema-constrained JSON and validates them with pydantic."""
+
+    def __init__(self, signature, **config):
+        super().__init__(signature, **config)
+        self.output_model = output_model(self.signature)
+        self.response_format = response_format(self.output_model)
+        self.cache_fingerprint = {"structured_output": self.response_format}
+
+    @staticmethod
+    def _system(signature) -> str:
+        return (f"Your input fields are:\n{_describe(signature.input_fields)}\n"
+                f"Your output fields are:\n{_describe(signature.output_fields)}\n\n"
+                f"{SCHEMA_HEADER}\n\n{signature.instructions}")
+
+    @staticmethod
+    def _inputs(signature, values) -> str:
+        return "\n\n".join(f"[[ ## {name} ## ]]\n{values[name]}" for name in signature.input_fields)
+
+    @staticmethod
+    def _outputs(model: type[BaseModel], demo) -> str:
+        values = {name: demo.get(name) for name in model.model_fields}
+        if "project_type" in values:
+            values["project_type"] = _null(values["project_type"])
+        return json.dumps(values, ensure_ascii=False)
+
+    def format(self, inputs: dict, demos: list | None = None, signature=None) -> list[dict]:
+        """Messages for one call; `demos`/`signature` override the predictor's own, as in dspy.Predict."""
+        signature = signature or self.signature
+        model = self.output_model if signature is self.signature else output_model(signature)
+        messages = [{"role": "system", "content": self._system(signature)}]
+        for demo in self.demos if demos is None else demos:
+            messages.append({"role": "user", "content": self._inputs(signature, demo)})
+            messages.append({"role": "assistant", "content": self._outputs(model, demo)})
+        messages.append({"role": "user", "content": self._inputs(signature, inputs)})
+        return messages
+
+    def forward(self, **kwargs):
+        lm = kwargs.pop("lm", None) or self.lm or dspy.settings.lm
+        config = {**self.config, **kwargs.pop("config", {})}
+        demos = kwargs.pop("demos", None)
+        signature = kwargs.pop("signature", None)
+        if signature is not None:
+            signature = dspy.ensure_signature(signature)
+        model = output_model(signature) if signature is not None else self.output_model
+        response = self.response_format if signature is None else response_format(model)
+        outputs = lm(messages=self.format(kwargs, demos, signature), response_format=response, **config)
+        text = outputs[0] if isinstance(outputs[0], str) else outputs[0]["text"]
+        prediction = dspy.Prediction(**model.model_validate_json(text).model_dump())
+        if dspy.settings.trace is not None:
+            dspy.settings.trace.append((self, kwargs, prediction))
+        return prediction
+
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def run_structured_report(model_name: str = "gemini-2.0-flash", modes: tuple = ("cot", "predict", "structured"),
+                          warmup: int = 3, repetitions: int = 3, concurrency: int = 8,
+                          output_path: str = "structured_output_report.json") -> dict:
+    """Benchmark the field-parsing modes against native structured output on test_reviews_50.json."""
+    from benchmark import benchmark_model
+
+    with open("test_reviews_50.json", "r") as f:
+        reviews = json.load(f)
+
+    print("\n" + "=" * 70)
+    print(f"Structured Output Report ({model_name}, {len(reviews)} reviews)")
+    print("=" * 70)
+
+    report = {"model": model_name, "schema": json_schema(ReviewAnalysis), "modes": {}}
+    for mode in modes:
+        print(f"\n--- {mode} ---")
+        data = benchmark_model(model_name, reviews, warmup=warmup, repetitions=repetitions,
+                               concurrency=concurrency, mode=mode)
+        tagged = data["reviews"] * data["repetitions"]
+        # Calls beyond one per review are ChatAdapter's JSON-mode retries after a parse failure
+        data["fallback_calls_per_review"] = max(0, data["lm_calls"] - tagged) / tagged if tagged else 0.0
+        report["modes"][mode] = data
+
+    print("\n" + "=" * 70)
+    print("STRUCTURED OUTPUT RESULTS")
+    print("=" * 70)
+    print(f"\n{'Mode':<12} {'Accuracy':>9} {'Parse fail':>11} {'Fallbacks':>10} {'Out tok':>8} "
+          f"{'p50':>8} {'p95':>8} {'Err':>5}")
+    print("-" * 78)
+    for mode, data in report["modes"].items():
+        p50, p95 = data["p50_latency"] or 0.0, data["p95_latency"] or 0.0
+        print(f"{mode:<12} {data['accuracy']:>8.1%} {data['parse_failure_rate']:>10.1%} "
+              f"{data['fallback_calls_per_review']:>9.1%} {data['output_tokens_per_review']:>8.0f} "
+              f"{p50:>7.2f}s {p95:>7.2f}s {data['errors']:>5}")
+
+    if "cot" in report["modes"] and "structured" in report["modes"]:
+        cot, structured = report["modes"]["cot"], report["modes"]["structured"]
+        if cot["output_tokens_per_review"]:
+            report["output_tokens_saved"] = 1 - structured["output_tokens_per_review"] / cot["output_tokens_per_review"]
+            print(f"\nStructured output: {report['output_tokens_saved']:.0%} fewer output tokens than CoT, "
+                  f"parse failures {cot['parse_failure_rate']:.1%} → {structured['parse_failure_rate']:.1%}"
+                  + (f", p50 latency {cot['p50_latency']:.2f}s → {structured['p50_latency']:.2f}s"
+                     if cot["p50_latency"] and structured["p50_latency"] else ""))
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Saved to {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Field parsing vs native structured output on test_reviews_50.json")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model name (Gemini, Ollama or fake/...)")
+    parser.add_argument("--modes", nargs="+", default=["cot", "predict", "structured"],
+                        choices=["cot", "predict", "structured"], help="Tagger modes to compare")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed warmup calls per mode")
+    parser.add_argument("--repetitions", type=int, default=3, help="Timed passes over the reviews per mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max LM calls in flight")
+    parser.add_argument("--output", default="structured_output_report.json", help="Report JSON path")
+    args = parser.parse_args()
+
+    run_structured_report(args.model, modes=tuple(args.modes), warmup=args.warmup, repetitions=args.repetitions,
+                          concurrency=args.concurrency, output_path=args.output)
@@ -0,0 +1,250 @@
+"""
+Vectorized accuracy_metric over columnar prediction arrays.
+
+Encodes predictions and ground truth once into NumPy columns (interned enum
+codes, float scores, boolean flags, service-set bitsets) and scores a whole
+batch in one pass. Per-row results are bit-for-bit identical to the scalar
+`accuracy_metric` in review_tagger.py (TAGGER_METRIC) and eval_50_reviews.py
+(EVAL_50_METRIC); rows where the scalar metric would raise score zero for the
+offending field.
+
+Usage:
+    from vector_metric import EVAL_50_METRIC, score_records
+
+    scores = score_records(predictions, expected, EVAL_50_METRIC)
+    print(scores.mean())            # {'sentiment': 0.94, ..., 'overall': 0.87}
+    scores.overall[3]               # == eval_50_reviews.accuracy_metric(predictions[3], expected[3])
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+TRUTHY = ("true", "1", "yes")
+
+
+@dataclass(frozen=True)
+class MetricSpec:
+    """Which scalar accuracy_metric to reproduce."""
+    score_tolerance: float
+    lowercase_sentiment: bool
+    none_matches_null: bool
+    score_confidence: bool
+    # Ground truth services are iterated without a truthiness check (None raises -> 0 credit)
+    strict_true_services: bool
+
+    @property
+    def fields(self) -> list[str]:
+        fields = ["sentiment", "sentiment_score", "project_type", "mentions_price", "mentions_timeline",
+                  "detected_services"]
+        return fields + ["confidence"] if self.score_confidence else fields
+
+
+# review_tagger.accuracy_metric: 7 fields, exact sentiment, score within 0.1
+TAGGER_METRIC = MetricSpec(score_tolerance=0.1, lowercase_sentiment=False, none_matches_null=False,
+                           score_confidence=True, strict_true_services=False)
+# eval_50_reviews.accuracy_metric: 6 fields, case-insensitive sentiment, score within 0.15
+EVAL_50_METRIC = MetricSpec(score_tolerance=0.15, lowercase_sentiment=True, none_matches_null=True,
+                            score_confidence=False, strict_true_services=True)
+
+_INVALID_PRED = -1
+_INVALID_TRUE = -2
+
+
+class Interner:
+    """Maps hashable values to dense integer ids."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, value) -> int:
+        return self.ids.setdefault(value, len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@dataclass
+class Columns:
+    """One side (predictions or ground truth) of a batch, column-major."""
+    sentiment: np.ndarray          # int32 interned codes
+    sentiment_score: np.ndarray    # float64, NaN where unparsable
+    project_type: np.ndarray       # int32 interned codes
+    project_alias: np.ndarray      # bool: pred "none" / truth "null" (EVAL_50 alias rule)
+    mentions_price: np.ndarray     # bool
+    mentions_timeline: np.ndarray  # bool
+    services: np.ndarray           # uint8 bitset rows, shape (n, ceil(vocab/8))
+    services_valid: np.ndarray     # bool: False where the scalar metric would raise
+    confidence: np.ndarray         # float64, NaN where unparsable
+
+
+@dataclass
+class BatchScores:
+    """Per-row credit for each field plus the overall score."""
+    fields: dict
+    overall: np.ndarray
+
+    def mean(self) -> dict:
+        means = {name: float(col.mean()) if len(col) else 0.0 for name, col in self.fields.items()}
+        means["overall"] = float(self.overall.mean()) if len(self.overall) else 0.0
+        return means
+
+
+def _get(record, field, default=None):
+    # dicts, dspy.Example and dspy.Prediction all expose .get()
+    get = getattr(record, "get", None)
+    if get is not None:
+        return get(field, default)
+    return getattr(record, field, default)
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _service_ids(value, interner: Interner, strict: bool = False) -> list[int] | None:
+    # Same normalization as the scalar metric, including its truthiness check
+    if not value and not strict:
+        return []
+    try:
+        return sorted({interner(s.lower()) for s in value})
+    except (AttributeError, TypeError):
+        return None
+
+
+def encode(records, spec: MetricSpec, side: str, interner: Interner, services_interner: Interner) -> tuple:
+    """
+    Normalize records into column arrays.
+
+    `side` is "pred" or "true"; the two sides are normalized slightly
+    differently, exactly as the scalar metrics do. Service ids are returned
+    as lists so both sides can be packed once the shared vocabulary is known.
+    """
+    is_pred = side == "pred"
+    invalid = _INVALID_PRED if is_pred else _INVALID_TRUE
+    n = len(records)
+
+    sentiment = np.empty(n, dtype=np.int32)
+    sentiment_score = np.empty(n, dtype=np.float64)
+    project_type = np.empty(n, dtype=np.int32)
+    project_alias = np.zeros(n, dtype=bool)
+    mentions_price = np.empty(n, dtype=bool)
+    mentions_timeline = np.empty(n, dtype=bool)
+    confidence = np.empty(n, dtype=np.float64)
+    services = []
+
+    for i, record in enumerate(records):
+        value = _get(record, "sentiment", None if is_pred else "")
+        if spec.lowercase_sentiment:
+            sentiment[i] = interner(value.lower()) if isinstance(value, str) else invalid
+        else:
+            try:
+                sentiment[i] = interner(value)
+            except TypeError:
+                sentiment[i] = invalid
+
+        sentiment_score[i] = _to_float(_get(record, "sentiment_score", None if is_pred else 0))
+
+        project = _get(record, "project_type")
+        project = str(project).lower() if project else "null"
+        project_type[i] = interner(project)
+        project_alias[i] = project == ("none" if is_pred else "null")
+
+        for field, column in (("mentions_price", mentions_price), ("mentions_timeline", mentions_timeline)):
+            value = _get(record, field, None if is_pred else False)
+            column[i] = str(value).lower() in TRUTHY if is_pred else bool(value)
+
+        services.append(_service_ids(_get(record, "detected_services", None if is_pred else []),
+                                     services_interner, strict=spec.strict_true_services and not is_pred))
+        confidence[i] = _to_float(_get(record, "confidence"))
+
+    return sentiment, sentiment_score, project_type, project_alias, mentions_price, mentions_timeline, \
+        services, confidence
+
+
+def _pack_services(rows: list, vocab_size: int) -> tuple[np.ndarray, np.ndarray]:
+    width = max(1, (vocab_size + 7) // 8)
+    bits = np.zeros((len(rows), width * 8), dtype=bool)
+    valid = np.ones(len(rows), dtype=bool)
+    for i, ids in enumerate(rows):
+        if ids is None:
+            valid[i] = False
+        elif ids:
+            bits[i, ids] = True
+    return np.packbits(bits, axis=1), valid
+
+
+def encode_batch(predictions, expected, spec: MetricSpec) -> tuple[Columns, Columns]:
+    """Encode both sides with shared interning tables."""
+    interner, services_interner = Interner(), Interner()
+    pred = encode(predictions, spec, "pred", interner, services_interner)
+    true = encode(expected, spec, "true", interner, services_interner)
+
+    columns = []
+    for encoded in (pred, true):
+        packed, valid = _pack_services(encoded[6], len(services_interner))
+        columns.append(Columns(*encoded[:6], services=packed, services_valid=valid, confidence=encoded[7]))
+    return columns[0], columns[1]
+
+
+def _popcount(bitsets: np.ndarray) -> np.ndarray:
+    return np.unpackbits(bitsets, axis=1).sum(axis=1, dtype=np.int64)
+
+
+def score_columns(pred: Columns, true: Columns, spec: MetricSpec) -> BatchScores:
+    """Score every row in one pass over the columns."""
+    fields = {}
+    fields["sentiment"] = (pred.sentiment == true.sentiment).astype(np.float64)
+    with np.errstate(invalid="ignore"):
+        fields["sentiment_score"] = (
+            np.abs(pred.sentiment_score - true.sentiment_score) <= spec.score_tolerance
+        ).astype(np.float64)
+
+    project_match = pred.project_type == true.project_type
+    if spec.none_matches_null:
+        project_match |= pred.project_alias & true.project_alias
+    fields["project_type"] = project_match.astype(np.float64)
+
+    fields["mentions_price"] = (pred.mentions_price == true.mentions_price).astype(np.float64)
+    fields["mentions_timeline"] = (pred.mentions_timeline == true.mentions_timeline).astype(np.float64)
+
+    intersection = _popcount(pred.services & true.services)
+    union = _popcount(pred.services | true.services)
+    pred_count, true_count = _popcount(pred.services), _popcount(true.services)
+    jaccard = np.divide(intersection, union, out=np.zeros(len(union), dtype=np.float64), where=union > 0)
+    services = np.where((pred_count == 0) & (true_count == 0), 1.0,
+                        np.where((pred_count > 0) & (true_count > 0), jaccard, 0.0))
+    fields["detected_services"] = np.where(pred.services_valid & true.services_valid, services, 0.0)
+
+    if spec.score_confidence:
+        with np.errstate(invalid="ignore"):
+            fields["confidence"] = ((pred.confidence >= 0.5) & (pred.confidence <= 1.0)).astype(np.float64)
+
+    # Accumulate in the scalar metric's field order so float sums round identically
+    total = np.zeros(len(pred.sentiment), dtype=np.float64)
+    for name in spec.fields:
+        total += fields[name]
+    return BatchScores(fields=fields, overall=total / float(len(spec.fields)))
+
+
+def score_records(predictions, expected, spec: MetricSpec = TAGGER_METRIC) -> BatchScores:
+    """Encode and score a batch of prediction/ground-truth records."""
+    if len(predictions) != len(expected):
+        raise ValueError(f"{len(predictions)} predictions vs {len(expected)} ground-truth records")
+    pred, true = encode_batch(predictions, expected, spec)
+    return score_columns(pred, true, spec)
+
+
+def score_tagged(tagged_results, expected, spec: MetricSpec = TAGGER_METRIC) -> tuple[dict, BatchScores]:
+    """
+    Score the successful batch_tagging.TagResults in one pass.
+
+    `expected` maps a TagResult's review to its ground truth. Returns
+    {result.index: overall score} and the full BatchScores.
+    """
+    ok = [t for t in tagged_results if t.ok]
+    batch = score_records([t.prediction for t in ok], [expected(t.review) for t in ok], spec)
+    return dict(zip((t.index for t in ok), batch.overall.tolist())), batch